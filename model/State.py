@@ -12,6 +12,7 @@ class EvidenceItem(BaseModel):
     chunk_id: str = Field(..., description="Chunk identifier within the source document.")
     text: str = Field(..., description="Retrieved text chunk used as LLM context.")
     score: float = Field(..., description="Retriever/re-ranker score; higher is better.")
+    kb_fingerprint: Optional[str] = Field(None, description="Fingerprint of the KB version chunk_id is a node of; None if unknown.")
 
 
 class StepAudit(BaseModel):
@@ -24,6 +25,7 @@ class StepAudit(BaseModel):
 class State(BaseModel):
     request_id: int = Field(..., description="Stable ID to correlate logs, retries, and tool calls.")
     raw_text: str = Field(..., description="Original user message for audit and replay.")
+    kb: Optional[str] = Field(None, description="Knowledge base serving this request; None selects the default KB.")
     chat_history: List[Dict[str, str]] = Field(
         default_factory=list,
         description="Full chat transcript with role/content pairs for planner context.",
@@ -34,6 +36,13 @@ class State(BaseModel):
     entities: List[Entity] = Field(default_factory=list, description="NER anchors extracted from the request.")
     search_query: Optional[str] = Field(None, description="Canonical query string used by the retriever.")
     evidence: List[EvidenceItem] = Field(default_factory=list, description="Top-K grounding snippets for synthesis.")
+    context_evidence: List[EvidenceItem] = Field(
+        default_factory=list,
+        description="Deduplicated evidence packed into the prompt token budget; [E#] ids index this list.",
+    )
+    retrieval_similarity: Optional[Dict[str, float]] = Field(
+        None, description="Dense similarity of the request to the KB (top1, topk, margin, mean, k)."
+    )
     steps: List[StepAudit] = Field(default_factory=list, description="Action/observation audit for the ReAct loop.")
     answer_draft: Optional[str] = Field(None, description="First-pass synthesized answer before checks.")
     thoughts: List[str] = Field(default_factory=list, description="Intermediate observations captured during ReAct.")
@@ -1,8 +1,18 @@
 import json
 import logging
-from typing import Any, Dict, Mapping, Sequence
+from typing import Any, Dict, Mapping, Optional, Sequence
 
 from .State import EvidenceItem, State, StepAudit
+from .config import (
+    CONTEXT_COMPRESSION,
+    OOD_ELEVATE_TEXT,
+    OOD_MAX_MARGIN,
+    OOD_MAX_TOP1,
+    OOD_POLICY,
+    OOD_REPLY_TEXT,
+    OOD_STATS_TOP_K,
+)
+from .context_packing import compress_evidence, merge_evidence, pack_evidence
 from .initial_text_parsing import extract_entities, normalize_text
 from .local_calls import LLM_call
 from .prompts import (
@@ -14,7 +24,7 @@ from .prompts import (
     get_observation_prompt,
     get_planner_prompt,
 )
-from .tools import RAG_tool
+from .tools import RAG_similarity_stats, RAG_tool, current_raptor_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +41,55 @@ def _coerce_entities(raw_entities):
     return normalized
 
 
-def react_workflow(request_id: int, messages: Sequence[Mapping[str, str]]) -> Dict[str, Any]:
-    """Core ReAct entrypoint that orchestrates normalization, entity extraction, and classification."""
+def _evidence_context(state: State) -> str:
+    """Pack the accumulated evidence into ``state.context_evidence`` and return its text."""
+    pipeline = current_raptor_pipeline(state.kb)
+    packed = pack_evidence(state.evidence, pipeline=pipeline)
+    if CONTEXT_COMPRESSION:
+        packed = compress_evidence(packed, state.norm_text or state.raw_text, pipeline=pipeline)
+    state.context_evidence = packed
+    return "\n".join(item.text for item in state.context_evidence)
+
+
+def _is_out_of_domain(state: State) -> bool:
+    """Record KB similarity for the request and decide whether it is clearly out of domain.
+
+    The statistics and the decision are recorded under every policy, "off" included, so the
+    thresholds can be calibrated on live traffic before the check acts on it.
+    """
+    stats = RAG_similarity_stats(
+        state.norm_text or state.raw_text, top_k=OOD_STATS_TOP_K, kb=state.kb
+    )
+    state.retrieval_similarity = stats
+    if stats is None:
+        return False
+
+    out_of_domain = stats["top1"] < OOD_MAX_TOP1 and stats["margin"] < OOD_MAX_MARGIN
+    state.steps.append(
+        StepAudit(
+            n=len(state.steps) + 1,
+            tool="DomainCheck",
+            input_summary=f"top1={stats['top1']:.3f} margin={stats['margin']:.3f}",
+            output_summary=f"out_of_domain={out_of_domain} policy={OOD_POLICY}",
+        )
+    )
+    logger.info(
+        "Domain check; request_id=%s top1=%.3f margin=%.3f out_of_domain=%s",
+        state.request_id,
+        stats["top1"],
+        stats["margin"],
+        out_of_domain,
+    )
+    return out_of_domain and OOD_POLICY in {"elevate", "reply"}
+
+
+def react_workflow(
+    request_id: int, messages: Sequence[Mapping[str, str]], kb: Optional[str] = None
+) -> Dict[str, Any]:
+    """Core ReAct entrypoint that orchestrates normalization, entity extraction, and classification.
+
+    ``kb`` names the knowledge base retrieval runs against (None: the default KB).
+    """
     if not messages:
         raise ValueError("messages payload must include at least one entry.")
 
@@ -51,7 +108,9 @@ def react_workflow(request_id: int, messages: Sequence[Mapping[str, str]]) -> Di
     if last_user_message is None:
         raise ValueError("messages payload must include at least one user message.")
 
-    state = State(request_id=request_id, raw_text=last_user_message, chat_history=chat_history)
+    state = State(
+        request_id=request_id, raw_text=last_user_message, chat_history=chat_history, kb=kb
+    )
 
     normalized_text = normalize_text(last_user_message)
     state.norm_text = normalized_text
@@ -64,6 +123,12 @@ def react_workflow(request_id: int, messages: Sequence[Mapping[str, str]]) -> Di
     # state.intent_label = ...
     # state.intent_conf = ...
 
+    if _is_out_of_domain(state):
+        # Skip rephrasing, reranking and every planner/observation call.
+        if OOD_POLICY == "elevate":
+            return {"message": OOD_ELEVATE_TEXT, "is_support_needed": True}
+        return {"message": OOD_REPLY_TEXT, "is_support_needed": False}
+
     state = _react_loop(state)
 
     if not state.finalize_required:
@@ -120,15 +185,21 @@ def _react_loop(state: State) -> None:
         if normalized_instrument in {"rag", "rag_retrieve"}:
             query_text = instrument_args.get("query", state.norm_text or "")
             top_k = instrument_args.get("top_k", 3)
-            rag_items = RAG_tool(query=query_text, top_k=top_k)
-            state.evidence.extend(rag_items)
+            filters = instrument_args.get("filters")
+            rag_items = RAG_tool(
+                query=query_text,
+                top_k=top_k,
+                kb=state.kb,
+                filters=filters if isinstance(filters, dict) else None,
+            )
+            state.evidence = merge_evidence(state.evidence, rag_items)
             if rag_items:
                 state.rag_used = True
             tool_output = "\n".join(item.text for item in rag_items)
             tool_input_summary = f"query_len={len(query_text)} top_k={top_k}"
             tool_output_summary = f"evidence_items={len(rag_items)}"
         elif normalized_instrument in {"draft", "draft_answer"}:
-            context = "\n".join(item.text for item in state.evidence)
+            context = _evidence_context(state)
             # TODO: Fix prompt
             draft_messages = get_draft_prompt(state, context)
             tool_output = LLM_call(draft_messages)
@@ -139,7 +210,7 @@ def _react_loop(state: State) -> None:
             logger.info("Generated draft answer; length=%d", len(tool_output))
             should_return = True
         elif normalized_instrument == "elevate":
-            context = "\n".join(item.text for item in state.evidence)
+            context = _evidence_context(state)
             elevate_messages = get_elevate_prompt(state, context)
             tool_output = LLM_call(elevate_messages)
             state.answer_draft = tool_output
@@ -160,7 +231,7 @@ def _react_loop(state: State) -> None:
                     len(state.evidence),
                 )
             else:
-                context = "\n".join(item.text for item in state.evidence)
+                context = _evidence_context(state)
                 ask_messages = get_ask_user_prompt(state, context)
                 tool_output = LLM_call(ask_messages)
                 state.answer_draft = tool_output
@@ -200,7 +271,7 @@ def _react_loop(state: State) -> None:
         if should_return:
             return state
 
-    context = "\n".join(item.text for item in state.evidence)
+    context = _evidence_context(state)
     # TODO: Fix prompt
     force_prompt = get_force_draft_prompt(state, context)
     fallback_output = LLM_call(force_prompt)
@@ -0,0 +1,136 @@
+"""Benchmark Matryoshka first-stage search: recall loss versus speedup on a Raptor KB."""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import pickle
+import re
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from .config import RAPTOR_EMBEDDING_DTYPE
+from .raptor.raptorRag import _LocalEmbeddingModel
+from .raptor.tree_retriever import TreeRetriever, TreeRetrieverConfig
+from .raptor.tree_structures import Tree
+from .raptor.utils import normalize_rows
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _load_questions(path: Path) -> List[str]:
+    """Read one question per non-empty line, dropping list numbering like '1.'."""
+    questions = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        question = re.sub(r"^\s*\d+[.)]\s*", "", line).strip()
+        if question:
+            questions.append(question)
+    return questions
+
+
+def _make_retriever(
+    tree: Tree,
+    embedding_dtype: str,
+    first_stage_dims: Optional[int] = None,
+    first_stage_candidates: Optional[int] = None,
+) -> TreeRetriever:
+    config = TreeRetrieverConfig(
+        embedding_model=_LocalEmbeddingModel(),
+        context_embedding_model="EMB",
+        embedding_dtype=embedding_dtype,
+        first_stage_dims=first_stage_dims,
+        first_stage_candidates=first_stage_candidates,
+    )
+    return TreeRetriever(config, tree)
+
+
+def _timed_search(retriever: TreeRetriever, queries: np.ndarray, top_k: int, repeats: int):
+    positions = None
+    started = time.perf_counter()
+    for _ in range(repeats):
+        positions = np.vstack(
+            [retriever.search_embeddings(query[np.newaxis, :], top_k)[1] for query in queries]
+        )
+    elapsed = (time.perf_counter() - started) / (repeats * len(queries))
+    return positions, elapsed
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--kb",
+        default=str(Path(__file__).resolve().parent / "raptorkb.pickle"),
+        help="Path to the Raptor KB pickle.",
+    )
+    parser.add_argument(
+        "--questions",
+        default=None,
+        help="Optional question file (one per line) embedded with the local model. "
+        "Without it, stored node embeddings are sampled as queries.",
+    )
+    parser.add_argument("--sample", type=int, default=200, help="Node embeddings to sample as queries.")
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--embedding-dtype", default=RAPTOR_EMBEDDING_DTYPE)
+    parser.add_argument("--seed", type=int, default=224)
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args()
+
+    with open(Path(args.kb).expanduser().resolve(), "rb") as file:
+        tree = pickle.load(file)
+    if not isinstance(tree, Tree):
+        raise ValueError("The loaded object is not an instance of Tree")
+
+    baseline = _make_retriever(tree, args.embedding_dtype)
+
+    if args.questions:
+        questions = _load_questions(Path(args.questions))
+        queries = normalize_rows(baseline.embedding_model.create_embeddings(questions))
+    else:
+        rng = np.random.default_rng(args.seed)
+        sample = rng.choice(
+            len(baseline.node_list), size=min(args.sample, len(baseline.node_list)), replace=False
+        )
+        queries = baseline.embedding_store.rows(np.sort(sample))
+
+    LOGGER.info(
+        "KB %s: %d nodes, dim=%d, %d queries, top_k=%d, dtype=%s",
+        args.kb,
+        len(baseline.node_list),
+        baseline.embedding_store.shape[1],
+        len(queries),
+        args.top_k,
+        args.embedding_dtype,
+    )
+
+    exact_positions, exact_latency = _timed_search(baseline, queries, args.top_k, args.repeats)
+    print(f"{'dims':>6} {'cands':>6} {'recall@k':>9} {'ms/query':>9} {'speedup':>8}")
+    print(f"{'full':>6} {'-':>6} {1.0:>9.4f} {exact_latency * 1e3:>9.3f} {1.0:>8.2f}")
+
+    for dims in args.dims:
+        for candidates in args.candidates:
+            retriever = _make_retriever(tree, args.embedding_dtype, dims, candidates)
+            positions, latency = _timed_search(retriever, queries, args.top_k, args.repeats)
+            recall = np.mean(
+                [
+                    len(set(found[found >= 0]) & set(exact[exact >= 0])) / max(1, (exact >= 0).sum())
+                    for found, exact in zip(positions, exact_positions)
+                ]
+            )
+            print(
+                f"{dims:>6} {candidates:>6} {recall:>9.4f} {latency * 1e3:>9.3f} "
+                f"{exact_latency / latency:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,32 +4,62 @@ from __future__ import annotations
 
 import argparse
 import logging
+import re
 from pathlib import Path
-from typing import List
-
+from typing import Dict, List, Optional, Tuple
+
+from .config import (
+    KB_LANGUAGE,
+    KB_NEIGHBOR_K,
+    KB_PRODUCT,
+    KB_QUESTION_BATCH_SIZE,
+    KB_QUESTIONS_PER_LEAF,
+    KB_SENTENCE_EMBEDDINGS,
+    KB_UPDATE_DRIFT_THRESHOLD,
+    RAPTOR_KB_EMBEDDING_DTYPE,
+    RAPTOR_KB_MANIFEST,
+)
+from .raptor.shardedRag import register_shard
 from .utils import build_raptor_tree
 
 LOGGER = logging.getLogger(__name__)
 
+_HEADING = re.compile(r"^#+\s*(.+)$")
+_NUMBERED = re.compile(r"^(\d+(?:\.\d+)*)[.)]\s")
+
 
-def _load_chunks(source_path: Path) -> List[str]:
-    """Split the knowledge source into non-empty chunks."""
+def _load_chunks(source_path: Path) -> List[Tuple[str, Optional[str]]]:
+    """Split the knowledge source into non-empty chunks at blank lines and numbered items,
+    each with its section: the last Markdown heading seen, else the chunk's own leading
+    number ("1." -> "1")."""
     raw_text = source_path.read_text(encoding="utf-8")
 
-    chunks: List[str] = []
+    chunks: List[Tuple[str, Optional[str]]] = []
     current_lines: List[str] = []
+    heading: Optional[str] = None
+
+    def close_chunk() -> None:
+        text = " ".join(current_lines)
+        numbered = _NUMBERED.match(text)
+        chunks.append((text, heading or (numbered.group(1) if numbered else None)))
 
     for line in raw_text.splitlines():
         stripped = line.strip()
         if not stripped:
             if current_lines:
-                chunks.append(" ".join(current_lines))
+                close_chunk()
                 current_lines = []
             continue
+        if current_lines and _NUMBERED.match(stripped):
+            close_chunk()
+            current_lines = []
+        heading_match = _HEADING.match(stripped)
+        if heading_match:
+            heading = heading_match.group(1).strip()
         current_lines.append(stripped)
 
     if current_lines:
-        chunks.append(" ".join(current_lines))
+        close_chunk()
 
     if not chunks:
         raise ValueError(f"No usable content found in knowledge file: {source_path}")
@@ -37,17 +67,126 @@ def _load_chunks(source_path: Path) -> List[str]:
     return chunks
 
 
+def _detect_language(text: str) -> str:
+    """'ru' when Cyrillic letters outnumber Latin ones, else 'en'."""
+    cyrillic = len(re.findall(r"[а-яё]", text, flags=re.IGNORECASE))
+    latin = len(re.findall(r"[a-z]", text, flags=re.IGNORECASE))
+    return "ru" if cyrillic > latin else "en"
+
+
+def _chunk_records(
+    source_path: Path,
+    chunks: List[Tuple[str, Optional[str]]],
+    product: str = "",
+    language: str = "",
+) -> List[Dict[str, str]]:
+    """Provenance of every chunk of a source; doc ids are ``<source stem>#<chunk number>``."""
+    records = []
+    for number, (text, section) in enumerate(chunks, start=1):
+        record = {
+            "doc_id": f"{source_path.stem}#{number}",
+            "source": source_path.name,
+            "language": language or _detect_language(text),
+        }
+        if section:
+            record["section"] = section
+        if product:
+            record["product"] = product
+        records.append(record)
+    return records
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Build Raptor KB pickle from knowledge text.")
     parser.add_argument(
         "--source",
-        default=str(Path(__file__).resolve().parent / "knowledge.txt"),
-        help="Path to the knowledge text file.",
+        nargs="+",
+        default=[str(Path(__file__).resolve().parent / "knowledge.txt")],
+        help="Path(s) to the knowledge text file(s).",
     )
     parser.add_argument(
         "--output",
         default=str(Path(__file__).resolve().parent / "raptorkb.pickle"),
-        help="Destination path for the generated pickle.",
+        help="Destination path for the generated pickle; a path ending in .kb is written as "
+        "a memory-mapped columnar KB directory.",
+    )
+    parser.add_argument(
+        "--embedding-dtype",
+        choices=["list", "float32", "float16"],
+        default=RAPTOR_KB_EMBEDDING_DTYPE,
+        help="Storage of node embeddings in the pickle ('list' keeps Python floats).",
+    )
+    parser.add_argument(
+        "--questions-per-leaf",
+        type=int,
+        default=KB_QUESTIONS_PER_LEAF,
+        help="Synthetic user questions generated per leaf and stored as extra search keys "
+        "(0 disables).",
+    )
+    parser.add_argument(
+        "--question-batch-size",
+        type=int,
+        default=KB_QUESTION_BATCH_SIZE,
+        help="Leaves sent to the chat model per question-generation call.",
+    )
+    parser.add_argument(
+        "--question-cache",
+        default=None,
+        help="JSON cache of generated questions. Defaults to <output>.questions.json.",
+    )
+    parser.add_argument(
+        "--embedding-store",
+        default=None,
+        help="Persistent embedding store (sqlite) reused across builds, so unchanged chunks "
+        "and summaries are never embedded twice. Defaults to <output>.embeddings.sqlite; an "
+        "empty value disables it.",
+    )
+    parser.add_argument(
+        "--sentence-embeddings",
+        action=argparse.BooleanOptionalAction,
+        default=KB_SENTENCE_EMBEDDINGS,
+        help="Store per-sentence sub-embeddings of every node for evidence compression.",
+    )
+    parser.add_argument(
+        "--neighbors",
+        type=int,
+        default=KB_NEIGHBOR_K,
+        help="Neighbours per node in the persisted kNN graph used for related-chunk "
+        "expansion (0 disables).",
+    )
+    parser.add_argument(
+        "--product",
+        default=KB_PRODUCT,
+        help="Product recorded in the metadata of every chunk, for filtered retrieval.",
+    )
+    parser.add_argument(
+        "--language",
+        default=KB_LANGUAGE,
+        help="Language recorded for every chunk (default: detected per chunk).",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update the existing KB at --output instead of rebuilding it: only new chunks are "
+        "embedded and only the summaries above changed chunks are regenerated.",
+    )
+    parser.add_argument(
+        "--drift-threshold",
+        type=float,
+        default=KB_UPDATE_DRIFT_THRESHOLD,
+        help="With --incremental, fraction of chunks changed since the last full build above "
+        "which the tree is re-clustered from scratch.",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help="Register the generated tree as this shard of the sharded KB manifest "
+        "(added, or replaced if the name exists).",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=str(Path(__file__).resolve().parent / RAPTOR_KB_MANIFEST),
+        help="Sharded KB manifest updated by --shard.",
     )
     return parser.parse_args()
 
@@ -56,13 +195,49 @@ def main() -> None:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     args = parse_args()
 
-    source_path = Path(args.source).expanduser().resolve()
+    source_paths = [Path(source).expanduser().resolve() for source in args.source]
     output_path = Path(args.output).expanduser().resolve()
 
-    LOGGER.info("Building Raptor KB from %s -> %s", source_path, output_path)
-    chunks = _load_chunks(source_path)
-    build_raptor_tree(chunks, output_path)
+    LOGGER.info(
+        "Building Raptor KB from %s -> %s", ", ".join(map(str, source_paths)), output_path
+    )
+    chunks: List[str] = []
+    chunk_metadata: List[Dict[str, str]] = []
+    for source_path in source_paths:
+        source_chunks = _load_chunks(source_path)
+        chunks.extend(text for text, _ in source_chunks)
+        chunk_metadata.extend(
+            _chunk_records(source_path, source_chunks, args.product, args.language)
+        )
+    embedding_dtype = None if args.embedding_dtype == "list" else args.embedding_dtype
+    question_cache = (
+        Path(args.question_cache).expanduser().resolve()
+        if args.question_cache
+        else output_path.with_name(f"{output_path.name}.questions.json")
+    )
+    embedding_store: Optional[Path] = None
+    if args.embedding_store is None:
+        embedding_store = output_path.with_name(f"{output_path.name}.embeddings.sqlite")
+    elif args.embedding_store:
+        embedding_store = Path(args.embedding_store).expanduser().resolve()
+    build_raptor_tree(
+        chunks,
+        output_path,
+        embedding_dtype=embedding_dtype,
+        questions_per_leaf=args.questions_per_leaf,
+        question_batch_size=args.question_batch_size,
+        question_cache_path=question_cache,
+        sentence_embeddings=args.sentence_embeddings,
+        neighbor_k=args.neighbors,
+        chunk_metadata=chunk_metadata,
+        incremental=args.incremental,
+        drift_threshold=args.drift_threshold,
+        embedding_store_path=embedding_store,
+    )
     LOGGER.info("Raptor KB generated successfully at %s", output_path)
+    if args.shard:
+        register_shard(args.manifest, args.shard, output_path)
+        LOGGER.info("Registered shard '%s' in %s", args.shard, args.manifest)
 
 
 if __name__ == "__main__":
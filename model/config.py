@@ -28,3 +28,143 @@ HF_RERANK_MODEL: str = os.getenv(
 
 HF_TIMEOUT: float = float(os.getenv("HF_TIMEOUT", "60"))
 HF_MAX_RETRIES: int = int(os.getenv("HF_MAX_RETRIES", "3"))
+
+# --- Raptor retrieval settings ----------------------------------------------------------------
+# Index backend for the collapsed-tree search: "matrix" (exact numpy), "flat" (exact FAISS),
+# "hnsw" or "ivf" (approximate FAISS). ANN indexes are persisted next to the KB pickle.
+RAPTOR_INDEX_BACKEND: str = os.getenv("RAPTOR_INDEX_BACKEND", "matrix")
+RAPTOR_IVF_NPROBE: int = int(os.getenv("RAPTOR_IVF_NPROBE", "8"))
+RAPTOR_HNSW_EF_SEARCH: int = int(os.getenv("RAPTOR_HNSW_EF_SEARCH", "64"))
+# Sharded KB: a JSON manifest (relative to the model package) listing independently rebuilt
+# tree shards, searched in parallel by RAPTOR_SHARD_WORKERS threads. Without the manifest
+# file the single raptorkb.pickle is served.
+RAPTOR_KB_MANIFEST: str = os.getenv("RAPTOR_KB_MANIFEST", "raptorkb.manifest.json")
+RAPTOR_SHARD_WORKERS: int = int(os.getenv("RAPTOR_SHARD_WORKERS", "4"))
+# Multi-tenant KBs: a request's "kb" field selects <name>.manifest.json, <name>.kb (columnar)
+# or <name>.pickle in RAPTOR_KB_DIR (default: the model package); without it the default KB
+# above is served.
+# Loaded KBs are evicted least-recently-used once their estimated memory exceeds the budget
+# (0: unlimited).
+RAPTOR_KB_DIR: Optional[str] = os.getenv("RAPTOR_KB_DIR") or None
+RAPTOR_KB_MEMORY_BUDGET_MB: float = float(os.getenv("RAPTOR_KB_MEMORY_BUDGET_MB", "0"))
+# Hot reload: a watcher thread polls the KB artifacts every N seconds and loads a replaced KB
+# in the background, swapping it in once loaded (0: requests check the artifacts themselves).
+RAPTOR_KB_WATCH_INTERVAL: float = float(os.getenv("RAPTOR_KB_WATCH_INTERVAL", "2"))
+# In-memory search representation of node embeddings: "float32", "float16" or "int8"
+# (per-vector scaled, quantized at load; KBs are saved as float32/float16). Unset: the dtype
+# the KB was saved with, which columnar KBs map without a copy; a float16 KB is only upcast
+# when "float32" is asked for explicitly. A rescore factor > 0 over-fetches top_k * factor
+# candidates and reranks them with the embeddings at the precision the KB was saved with.
+RAPTOR_EMBEDDING_DTYPE: Optional[str] = os.getenv("RAPTOR_EMBEDDING_DTYPE") or None
+RAPTOR_RESCORE_FACTOR: int = int(os.getenv("RAPTOR_RESCORE_FACTOR", "0"))
+# Matryoshka two-stage search: score only the first N dimensions over the whole tree, then
+# rescore the best candidates at full width. Unset disables the first stage.
+_raw_first_stage_dims = os.getenv("RAPTOR_FIRST_STAGE_DIMS", "").strip()
+RAPTOR_FIRST_STAGE_DIMS: Optional[int] = int(_raw_first_stage_dims) if _raw_first_stage_dims else None
+RAPTOR_FIRST_STAGE_CANDIDATES: int = int(os.getenv("RAPTOR_FIRST_STAGE_CANDIDATES", "100"))
+# Packing of node embeddings inside the persisted KB pickle: "list" keeps Python floats,
+# "float32"/"float16" store numpy arrays.
+RAPTOR_KB_EMBEDDING_DTYPE: str = os.getenv("RAPTOR_KB_EMBEDDING_DTYPE", "float32")
+# KB build: synthetic user questions generated per leaf by the chat model (batched, cached next
+# to the KB) and embedded as extra search keys for their leaf. 0 disables the step.
+KB_QUESTIONS_PER_LEAF: int = int(os.getenv("KB_QUESTIONS_PER_LEAF", "0"))
+KB_QUESTION_BATCH_SIZE: int = int(os.getenv("KB_QUESTION_BATCH_SIZE", "8"))
+# KB build: embed every distinct sentence of every node so evidence can be compressed to the
+# sentences relevant to the request (see CONTEXT_COMPRESSION).
+KB_SENTENCE_EMBEDDINGS: bool = os.getenv("KB_SENTENCE_EMBEDDINGS", "0").lower() not in ("0", "false", "no")
+# KB build: neighbours per node in the persisted kNN graph over node embeddings (0, the default,
+# disables it; large KBs build it with an approximate HNSW index). RAPTOR_NEIGHBOR_EXPANSION > 0
+# appends that many graph neighbours of every RAG hit, so set both to use it.
+KB_NEIGHBOR_K: int = int(os.getenv("KB_NEIGHBOR_K", "0"))
+# KB build: provenance stored per node (doc id, source, section, product, language) for
+# filtered retrieval. Product and language apply to a whole source; an empty language is
+# detected per chunk from its script.
+KB_PRODUCT: str = os.getenv("KB_PRODUCT", "")
+KB_LANGUAGE: str = os.getenv("KB_LANGUAGE", "")
+# KB build: --incremental updates the existing tree in place until the fraction of leaves
+# changed since it was last clustered exceeds this threshold, then re-clusters it.
+KB_UPDATE_DRIFT_THRESHOLD: float = float(os.getenv("KB_UPDATE_DRIFT_THRESHOLD", "0.2"))
+RAPTOR_NEIGHBOR_EXPANSION: int = int(os.getenv("RAPTOR_NEIGHBOR_EXPANSION", "0"))
+# Tree context appended to every RAG hit through the parent pointers: "parent" (its summary),
+# "ancestors" (summaries up to the root) or "siblings" (leaves of the same cluster). Empty: off.
+RAPTOR_STRUCTURE_EXPANSION: Optional[str] = os.getenv("RAPTOR_STRUCTURE_EXPANSION", "").strip() or None
+# Ranking used by RAG calls: "dense" (cosine), "lexical" (BM25 over node texts) or "hybrid"
+# (both fused with Reciprocal Rank Fusion over the top RAPTOR_FUSION_CANDIDATES of each).
+# With the lexical fallback on, queries are served by BM25 until the embedding model loads.
+RAPTOR_RETRIEVAL_MODE: str = os.getenv("RAPTOR_RETRIEVAL_MODE", "dense")
+RAPTOR_RRF_K: int = int(os.getenv("RAPTOR_RRF_K", "60"))
+RAPTOR_FUSION_CANDIDATES: int = int(os.getenv("RAPTOR_FUSION_CANDIDATES", "50"))
+RAPTOR_LEXICAL_FALLBACK: bool = os.getenv("RAPTOR_LEXICAL_FALLBACK", "1").lower() not in ("0", "false", "no")
+
+# --- Embedding cache ---------------------------------------------------------------------------
+# Bounded in-memory LRU in front of the local embedder (0 disables it) and an optional sqlite
+# file that keeps embeddings across restarts.
+EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH: Optional[str] = os.getenv("EMBEDDING_CACHE_PATH") or None
+
+# --- Retrieval result cache --------------------------------------------------------------------
+# Results are keyed by the KB content fingerprint, so a rebuilt KB never serves stale hits.
+RAG_RESULT_CACHE_SIZE: int = int(os.getenv("RAG_RESULT_CACHE_SIZE", "2048"))
+RAG_RESULT_CACHE_TTL: float = float(os.getenv("RAG_RESULT_CACHE_TTL", "600"))
+
+# --- Evidence packing ---------------------------------------------------------------------------
+# Token budget for the evidence block placed in draft/ask/elevate prompts, and the MMR trade-off
+# between relevance (1.0) and novelty (0.0) when choosing what fills it.
+CONTEXT_MAX_TOKENS: int = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_MMR_LAMBDA: float = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Sentence-level compression of the packed evidence (needs a KB built with sentence embeddings):
+# the sentences most similar to the request, each with CONTEXT_SENTENCE_WINDOW neighbours on
+# both sides, are kept until CONTEXT_COMPRESSED_MAX_TOKENS.
+CONTEXT_COMPRESSION: bool = os.getenv("CONTEXT_COMPRESSION", "1").lower() not in ("0", "false", "no")
+CONTEXT_COMPRESSED_MAX_TOKENS: int = int(os.getenv("CONTEXT_COMPRESSED_MAX_TOKENS", "1200"))
+CONTEXT_SENTENCE_WINDOW: int = int(os.getenv("CONTEXT_SENTENCE_WINDOW", "1"))
+
+# --- Retrieval cascade --------------------------------------------------------------------------
+# RAG_tool stages: over-fetch N candidates per query variant with the configured retrieval mode,
+# rescore the best M with full-precision stored embeddings (0 skips the stage), and send only
+# the best R to the remote reranker. Per-stage latency/counts are reported at GET /stats.
+RAG_CASCADE_CANDIDATES: int = int(os.getenv("RAG_CASCADE_CANDIDATES", "20"))
+RAG_CASCADE_RESCORE: int = int(os.getenv("RAG_CASCADE_RESCORE", "20"))
+RAG_CASCADE_RERANK: int = int(os.getenv("RAG_CASCADE_RERANK", "8"))
+
+# --- Shadow retrieval ---------------------------------------------------------------------------
+# Candidate KB artifact (tree pickle or shard manifest, relative to RAPTOR_KB_DIR) replayed off the
+# response path for RAPTOR_SHADOW_SAMPLE_RATE of the RAG calls. Overlap@k, score deltas and stage
+# latencies of both KBs are appended to RAPTOR_SHADOW_REPORT (JSON lines). Empty: off.
+RAPTOR_SHADOW_KB: str = os.getenv("RAPTOR_SHADOW_KB", "")
+RAPTOR_SHADOW_SAMPLE_RATE: float = float(os.getenv("RAPTOR_SHADOW_SAMPLE_RATE", "0.05"))
+RAPTOR_SHADOW_REPORT: str = os.getenv("RAPTOR_SHADOW_REPORT", "raptorkb.shadow.jsonl")
+RAPTOR_SHADOW_MAX_PENDING: int = int(os.getenv("RAPTOR_SHADOW_MAX_PENDING", "8"))
+
+# --- Query expansion ----------------------------------------------------------------------------
+# How RAG_tool broadens a query before retrieval: "llm" (two chat-model rephrasings), "prf"
+# (local Rocchio pseudo-relevance feedback: the query vector is moved towards the mean of the
+# stored embeddings of its top RAG_PRF_DOCS hits and searched again) or "none" (suited to KBs
+# built with synthetic question keys, see KB_QUESTIONS_PER_LEAF).
+RAG_QUERY_EXPANSION: str = os.getenv("RAG_QUERY_EXPANSION", "llm")
+RAG_PRF_DOCS: int = int(os.getenv("RAG_PRF_DOCS", "5"))
+RAG_PRF_ALPHA: float = float(os.getenv("RAG_PRF_ALPHA", "1.0"))
+RAG_PRF_BETA: float = float(os.getenv("RAG_PRF_BETA", "0.5"))
+
+# --- Out-of-domain early exit -------------------------------------------------------------------
+# Before the ReAct loop the request is embedded once and searched against the KB. When the best
+# cosine is below OOD_MAX_TOP1 and the top1-to-top-k margin below OOD_MAX_MARGIN (a flat score
+# profile: no node stands out) the request is treated as out of domain: "elevate" hands it to a
+# human, "reply" returns OOD_REPLY_TEXT, and "off" (default) only records the statistics and
+# the decision (the "Domain check" log line and State.retrieval_similarity).
+# Both thresholds depend on the embedding model and the KB. Calibrate them per KB with "off":
+# collect top1 and margin of known in-domain requests and set each threshold near its 5th
+# percentile, then check the decisions on known out-of-domain requests before enabling a policy.
+OOD_POLICY: str = os.getenv("OOD_POLICY", "off")
+OOD_MAX_TOP1: float = float(os.getenv("OOD_MAX_TOP1", "0.35"))
+OOD_MAX_MARGIN: float = float(os.getenv("OOD_MAX_MARGIN", "0.05"))
+OOD_STATS_TOP_K: int = int(os.getenv("OOD_STATS_TOP_K", "10"))
+OOD_REPLY_TEXT: str = os.getenv(
+    "OOD_REPLY_TEXT",
+    "К сожалению, я могу помочь только с вопросами о наших продуктах и сервисах. "
+    "Пожалуйста, уточните ваш вопрос.",
+)
+OOD_ELEVATE_TEXT: str = os.getenv(
+    "OOD_ELEVATE_TEXT",
+    "Ваш вопрос передан специалисту поддержки. Он свяжется с вами в ближайшее время.",
+)
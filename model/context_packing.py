@@ -0,0 +1,273 @@
+"""Evidence packing: turn accumulated retrieval hits into a compact, non-redundant prompt context."""
+
+from __future__ import annotations
+
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import tiktoken
+
+try:
+    from .config import (
+        CONTEXT_COMPRESSED_MAX_TOKENS,
+        CONTEXT_MAX_TOKENS,
+        CONTEXT_MMR_LAMBDA,
+        CONTEXT_SENTENCE_WINDOW,
+    )
+except Exception:  # pragma: no cover - fallback
+    from config import (  # type: ignore
+        CONTEXT_COMPRESSED_MAX_TOKENS,
+        CONTEXT_MAX_TOKENS,
+        CONTEXT_MMR_LAMBDA,
+        CONTEXT_SENTENCE_WINDOW,
+    )
+
+try:
+    from .State import EvidenceItem
+except Exception:  # pragma: no cover - fallback
+    from State import EvidenceItem  # type: ignore
+
+try:
+    from .raptor.raptorRag import RaptorRagPipeline  # type: ignore
+except Exception:  # pragma: no cover - fallback when running as flat package
+    from raptor.raptorRag import RaptorRagPipeline  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def _normalized(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def _node_index(item: EvidenceItem, pipeline: Optional[RaptorRagPipeline]) -> Optional[int]:
+    """The node of ``item`` in the KB of ``pipeline``; None for evidence retrieved from another
+    version of the KB (hot reloaded since), whose chunk id names another node."""
+    if pipeline is None or item.kb_fingerprint != pipeline.fingerprint:
+        return None
+    try:
+        return int(item.chunk_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def merge_evidence(
+    existing: Sequence[EvidenceItem], new: Sequence[EvidenceItem]
+) -> List[EvidenceItem]:
+    """Append ``new`` to ``existing``, collapsing repeats of a chunk (same ids or same text).
+
+    Each repeated chunk keeps its first position and the copy with the highest score.
+    """
+    merged: List[EvidenceItem] = []
+    slots: Dict[object, int] = {}
+    for item in [*existing, *new]:
+        keys = ((item.doc_id, item.chunk_id), _normalized(item.text))
+        slot = next((slots[key] for key in keys if key in slots), None)
+        if slot is None:
+            slot = len(merged)
+            merged.append(item)
+        elif item.score > merged[slot].score:
+            merged[slot] = item
+        for key in keys:
+            slots.setdefault(key, slot)
+    return merged
+
+
+def _candidate_embeddings(
+    candidates: List[EvidenceItem], pipeline: Optional[RaptorRagPipeline]
+) -> Optional[np.ndarray]:
+    """Unit-length stored node embeddings per candidate; zero rows where unavailable."""
+    if pipeline is None:
+        return None
+    rows: List[Optional[np.ndarray]] = []
+    for item in candidates:
+        node_index = _node_index(item, pipeline)
+        try:
+            embedding = pipeline.node_embedding(node_index) if node_index is not None else None
+        except (KeyError, IndexError):
+            embedding = None
+        rows.append(None if embedding is None else np.asarray(embedding, dtype=np.float32))
+
+    dims = {row.shape[0] for row in rows if row is not None}
+    if len(dims) != 1:
+        return None
+    matrix = np.zeros((len(rows), dims.pop()), dtype=np.float32)
+    for position, row in enumerate(rows):
+        if row is not None:
+            matrix[position] = row / max(float(np.linalg.norm(row)), 1e-12)
+    return matrix
+
+
+def _candidate_descendants(
+    candidates: List[EvidenceItem], pipeline: Optional[RaptorRagPipeline]
+) -> List[Set[int]]:
+    if pipeline is None:
+        return [set() for _ in candidates]
+    descendants = []
+    for item in candidates:
+        node_index = _node_index(item, pipeline)
+        descendants.append(pipeline.node_descendants(node_index) if node_index is not None else set())
+    return descendants
+
+
+def pack_evidence(
+    items: Sequence[EvidenceItem],
+    pipeline: Optional[RaptorRagPipeline] = None,
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+) -> List[EvidenceItem]:
+    """Select the evidence that goes into a prompt.
+
+    Candidates are picked greedily by Maximal Marginal Relevance: min-max normalized score
+    against the highest cosine similarity (stored node embeddings) to what is already
+    picked. A candidate is dropped when it is an ancestor or descendant of a picked node in
+    the Raptor tree (parents concatenate their children's text) or when its text contains
+    or is contained in a picked text. Candidates that no longer fit the token budget are
+    skipped while smaller ones may still fill it.
+
+    Without a pipeline only the text-containment and budget checks apply, as for evidence
+    retrieved from another version of the KB than the pipeline's.
+    """
+    candidates = merge_evidence([], items)
+    if not candidates:
+        return []
+
+    encoding = _encoding()
+    lengths = [len(encoding.encode(item.text)) for item in candidates]
+    texts = [_normalized(item.text) for item in candidates]
+    node_indices = [_node_index(item, pipeline) for item in candidates]
+    descendants = _candidate_descendants(candidates, pipeline)
+    embeddings = _candidate_embeddings(candidates, pipeline)
+
+    scores = np.asarray([item.score for item in candidates], dtype=np.float32)
+    spread = float(scores.max() - scores.min())
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    max_similarity = np.zeros(len(candidates), dtype=np.float32)
+
+    def overlaps(candidate: int, chosen: int) -> bool:
+        if node_indices[candidate] is not None and node_indices[chosen] is not None:
+            if (
+                node_indices[candidate] in descendants[chosen]
+                or node_indices[chosen] in descendants[candidate]
+            ):
+                return True
+        return texts[candidate] in texts[chosen] or texts[chosen] in texts[candidate]
+
+    selected: List[int] = []
+    remaining = list(range(len(candidates)))
+    budget = max_tokens
+    while remaining:
+        values = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * max_similarity[remaining]
+        best = remaining.pop(int(np.argmax(values)))
+        if lengths[best] > budget or any(overlaps(best, chosen) for chosen in selected):
+            continue
+        selected.append(best)
+        budget -= lengths[best]
+        if embeddings is not None:
+            max_similarity = np.maximum(max_similarity, embeddings @ embeddings[best])
+
+    logger.info(
+        "Packed evidence: %d of %d items, %d of %d tokens",
+        len(selected),
+        len(candidates),
+        max_tokens - budget,
+        sum(lengths),
+    )
+    return [candidates[position] for position in selected]
+
+
+def _join_sentences(sentences: List[str], kept: Set[int]) -> str:
+    """Join kept sentences in reading order, marking skipped stretches with an ellipsis."""
+    parts: List[str] = []
+    previous: Optional[int] = None
+    for position in sorted(kept):
+        if previous is not None and position != previous + 1:
+            parts.append("…")
+        parts.append(sentences[position])
+        previous = position
+    return " ".join(parts)
+
+
+def compress_evidence(
+    items: Sequence[EvidenceItem],
+    query: str,
+    pipeline: Optional[RaptorRagPipeline] = None,
+    max_tokens: int = CONTEXT_COMPRESSED_MAX_TOKENS,
+    window: int = CONTEXT_SENTENCE_WINDOW,
+) -> List[EvidenceItem]:
+    """Cut packed evidence down to the sentences that matter for ``query``.
+
+    Sentences of all items are ranked by cosine similarity of their precomputed sub-embeddings
+    to the query; each picked sentence brings ``window`` neighbours on both sides so it stays
+    readable. Picks continue until ``max_tokens`` is spent, a sentence already kept for another
+    item is not repeated. Items keep their order, items without a single kept sentence are
+    dropped. Items without sentence embeddings are kept whole (and charged to the budget
+    first), as are items retrieved from another version of the KB; without a pipeline,
+    sentence store or query embedding nothing changes.
+    """
+    if pipeline is None or not items:
+        return list(items)
+    sentences: List[Optional[Tuple[List[str], np.ndarray]]] = []
+    for item in items:
+        node_index = _node_index(item, pipeline)
+        sentences.append(pipeline.node_sentences(node_index) if node_index is not None else None)
+    if all(entry is None for entry in sentences):
+        return list(items)
+    query_vector = pipeline.query_embedding(query)
+    if query_vector is None:
+        return list(items)
+
+    encoding = _encoding()
+    budget = max_tokens
+    ranked: List[Tuple[float, int, int]] = []
+    for position, entry in enumerate(sentences):
+        if entry is None:
+            budget -= len(encoding.encode(items[position].text))
+            continue
+        scores = entry[1] @ query_vector if len(entry[0]) else []
+        ranked.extend((float(score), position, index) for index, score in enumerate(scores))
+    ranked.sort(key=lambda candidate: -candidate[0])
+
+    kept: Dict[int, Set[int]] = {position: set() for position in range(len(items))}
+    seen: Set[str] = set()
+    for _, position, index in ranked:
+        texts = sentences[position][0]
+        group = [
+            neighbour
+            for neighbour in range(max(0, index - window), min(len(texts), index + window + 1))
+            if neighbour not in kept[position] and _normalized(texts[neighbour]) not in seen
+        ]
+        if not group:
+            continue
+        cost = sum(len(encoding.encode(texts[neighbour])) for neighbour in group)
+        if cost > budget:
+            continue
+        budget -= cost
+        kept[position].update(group)
+        seen.update(_normalized(texts[neighbour]) for neighbour in group)
+
+    compressed: List[EvidenceItem] = []
+    for position, item in enumerate(items):
+        if sentences[position] is None:
+            compressed.append(item)
+        elif kept[position]:
+            text = _join_sentences(sentences[position][0], kept[position])
+            compressed.append(item.model_copy(update={"text": text}))
+
+    logger.info(
+        "Compressed evidence: %d of %d items, %d of %d sentences, %d of %d tokens",
+        len(compressed),
+        len(items),
+        sum(len(indices) for indices in kept.values()),
+        len(ranked),
+        max_tokens - budget,
+        sum(len(encoding.encode(item.text)) for item in items),
+    )
+    return compressed
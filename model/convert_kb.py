@@ -0,0 +1,102 @@
+"""Command line helper to convert a pickled Raptor knowledge base into the columnar format."""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import pickle
+from pathlib import Path
+
+from .config import RAPTOR_EMBEDDING_DTYPE
+from .raptor.columnar_kb import PERSISTED_EMBEDDING_DTYPES, write_columnar_kb
+from .raptor.lexical_index import BM25Index
+from .raptor.tree_structures import Tree
+from .raptor.utils import get_node_list
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _embedding_key(tree: Tree) -> str:
+    """The embedding key shared by all nodes of the tree."""
+    keys = None
+    for node in tree.all_nodes.values():
+        node_keys = set(node.embeddings)
+        keys = node_keys if keys is None else keys & node_keys
+    if not keys:
+        raise ValueError("The tree has no embedding key common to all nodes")
+    if len(keys) > 1:
+        raise ValueError(
+            f"The tree has several embedding keys {sorted(keys)}; pass --embedding-model"
+        )
+    return next(iter(keys))
+
+
+def convert(
+    input_path: Path,
+    output_path: Path,
+    embedding_dtype: str = "float32",
+    embedding_model: str | None = None,
+) -> Path:
+    """Write the pickled tree at ``input_path`` as a columnar KB directory at ``output_path``."""
+    with open(input_path, "rb") as file:
+        tree = pickle.load(file)
+    if not isinstance(tree, Tree):
+        raise ValueError(f"{input_path} does not contain a Raptor tree")
+    if getattr(tree, "lexical_index", None) is None:
+        tree.lexical_index = BM25Index.from_nodes(get_node_list(tree.all_nodes))
+    return write_columnar_kb(
+        tree, output_path, embedding_model or _embedding_key(tree), embedding_dtype
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Convert a Raptor KB pickle into a memory-mapped columnar KB directory."
+    )
+    parser.add_argument(
+        "--input",
+        default=str(Path(__file__).resolve().parent / "raptorkb.pickle"),
+        help="Path to the pickled knowledge base.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Destination KB directory. Defaults to the input path with a .kb suffix.",
+    )
+    parser.add_argument(
+        "--embedding-dtype",
+        choices=PERSISTED_EMBEDDING_DTYPES,
+        default=(
+            RAPTOR_EMBEDDING_DTYPE
+            if RAPTOR_EMBEDDING_DTYPE in PERSISTED_EMBEDDING_DTYPES
+            else "float16"
+        ),
+        help="Storage of node embeddings, also used for exact rescoring; serving with "
+        "RAPTOR_EMBEDDING_DTYPE unset or the same dtype maps them without a copy (int8 serving "
+        "quantizes them at load).",
+    )
+    parser.add_argument(
+        "--embedding-model",
+        default=None,
+        help="Embedding key of the nodes (default: the single key found in the tree).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args()
+
+    input_path = Path(args.input).expanduser().resolve()
+    output_path = (
+        Path(args.output).expanduser().resolve()
+        if args.output
+        else input_path.with_suffix(".kb")
+    )
+    LOGGER.info("Converting Raptor KB %s -> %s", input_path, output_path)
+    convert(input_path, output_path, args.embedding_dtype, args.embedding_model)
+    LOGGER.info("Columnar Raptor KB written to %s", output_path)
+
+
+if __name__ == "__main__":
+    main()
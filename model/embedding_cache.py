@@ -0,0 +1,119 @@
+"""Two-tier cache for text embeddings: a bounded in-memory LRU plus an optional sqlite store."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import sqlite3
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_cache_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC, trimmed, whitespace runs collapsed."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class EmbeddingCache:
+    """Thread-safe embedding cache keyed by model id, pooling plus normalized text.
+
+    Lookups hit the in-memory LRU first, then the persistent sqlite tier (if configured);
+    disk hits are promoted into memory. Writes go to both tiers. With ``max_entries=0`` and
+    a ``persistent_path`` it is a pure content-addressed store on disk.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = 10000,
+        persistent_path: Optional[str | Path] = None,
+        pooling: str = "",
+    ) -> None:
+        self._model_id = model_id
+        self._pooling = pooling
+        self._max_entries = max(0, int(max_entries))
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if persistent_path:
+            path = Path(persistent_path).expanduser().resolve()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+            logger.info("Embedding cache persistent tier at %s", path)
+
+    def key(self, text: str) -> str:
+        payload = f"{self._model_id}\n{self._pooling}\n{normalize_cache_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Return cached embeddings aligned with ``texts``; ``None`` marks a miss."""
+        keys = [self.key(text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(keys)
+        with self._lock:
+            for position, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is None and self._db is not None:
+                    row = self._db.execute(
+                        "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                        self._remember(key, vector)
+                        self._disk_hits += 1
+                elif vector is not None:
+                    self._memory.move_to_end(key)
+                if vector is None:
+                    self._misses += 1
+                    continue
+                self._hits += 1
+                results[position] = vector
+        return results
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[List[float]]) -> None:
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, embeddings):
+                key = self.key(text)
+                self._remember(key, list(vector))
+                if self._db is not None:
+                    rows.append((key, np.asarray(vector, dtype=np.float32).tobytes()))
+            if rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        if self._max_entries == 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "memory_entries": len(self._memory),
+                "max_entries": self._max_entries,
+            }
@@ -1,5 +1,6 @@
 import logging
-from threading import Lock
+from pathlib import Path
+from threading import Lock, Thread
 from typing import List, Mapping, Optional, Sequence
 
 import requests
@@ -18,6 +19,8 @@ else:
     _embedding_import_error = None
 
 from .config import (
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_SIZE,
     HF_API_BASE_URL,
     HF_API_TOKEN,
     HF_CHAT_MAX_OUTPUT_TOKENS,
@@ -27,13 +30,25 @@ from .config import (
     HF_TIMEOUT,
     HF_MAX_RETRIES,
 )
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
 EMBEDDING_MODEL_ID = "Qwen/Qwen3-Embedding-0.6B"
+# Part of every embedding cache key: vectors pooled differently must never be mixed.
+EMBEDDING_POOLING = "mean+l2"
 _embedding_model_lock = Lock()
+# Guards only the warm-up thread handle; never held while the model loads.
+_embedding_warmup_lock = Lock()
 _embedding_model = None
 _embedding_tokenizer = None
+_embedding_warmup_thread: Optional[Thread] = None
+_embedding_cache = EmbeddingCache(
+    EMBEDDING_MODEL_ID,
+    max_entries=EMBEDDING_CACHE_SIZE,
+    persistent_path=EMBEDDING_CACHE_PATH,
+    pooling=EMBEDDING_POOLING,
+)
 
 
 def _ensure_messages(messages: Sequence[Mapping[str, str]]) -> List[Mapping[str, str]]:
@@ -125,22 +140,100 @@ def LLM_call(messages: List[Mapping[str, str]]) -> str:
     return assistant_message
 
 
-def embedding_call(texts: List[str]) -> List[List[float]]:
-    """Return embeddings for each text using the local Qwen embedding model."""
+def open_embedding_store(path: str | Path) -> EmbeddingCache:
+    """Persistent content-addressed store of embeddings by (model id, pooling, text), for KB
+    builds: pass it to ``embedding_call`` so unchanged texts are never embedded twice."""
+    return EmbeddingCache(
+        EMBEDDING_MODEL_ID, max_entries=0, persistent_path=path, pooling=EMBEDDING_POOLING
+    )
+
+
+def embedding_call(
+    texts: List[str], store: Optional[EmbeddingCache] = None
+) -> List[List[float]]:
+    """Return embeddings for each text using the local Qwen embedding model, aligned
+    one-to-one with ``texts``.
+
+    ``store`` (see ``open_embedding_store``) replaces the query cache: it is looked up
+    before the model and receives every embedding it did not have. Build-time texts thus
+    never displace queries from the query cache.
+
+    Raises:
+        RuntimeError: If the model returns a different number of embeddings than requested
+            (nothing is cached then: the vectors cannot be matched to their texts).
+    """
     if not texts:
         return []
 
-    embeddings = _local_embedding_request(texts)
+    if store is not None:
+        embeddings = store.get_many(texts)
+        missing_positions = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing_positions:
+            to_embed = list(dict.fromkeys(texts[i] for i in missing_positions))
+            computed = _checked_embedding_request(to_embed)
+            store.put_many(to_embed, computed)
+            by_text = dict(zip(to_embed, computed))
+            for position in missing_positions:
+                embeddings[position] = by_text[texts[position]]
+        return embeddings
+
+    embeddings = _embedding_cache.get_many(texts)
+    missing: dict = {}
+    for position, embedding in enumerate(embeddings):
+        if embedding is None:
+            missing.setdefault(_embedding_cache.key(texts[position]), []).append(position)
+
+    if missing:
+        to_embed = [texts[positions[0]] for positions in missing.values()]
+        computed = _checked_embedding_request(to_embed)
+        _embedding_cache.put_many(to_embed, computed)
+        for positions, embedding in zip(missing.values(), computed):
+            for position in positions:
+                embeddings[position] = embedding
 
-    if embeddings and len(embeddings) != len(texts):
-        logger.warning(
-            "Embedding count mismatch; requested=%d received=%d",
-            len(texts),
-            len(embeddings),
-        )
     return embeddings
 
 
+def _checked_embedding_request(texts: List[str]) -> List[List[float]]:
+    computed = _local_embedding_request(texts)
+    if len(computed) != len(texts):
+        raise RuntimeError(
+            f"Embedding count mismatch; requested={len(texts)} received={len(computed)}"
+        )
+    return computed
+
+
+def embedding_cache_stats() -> dict:
+    """Hit/miss counters of the query embedding cache."""
+    return _embedding_cache.stats()
+
+
+def embedding_model_ready() -> bool:
+    """Whether the local embedding model is loaded and queries can be embedded without waiting."""
+    return _embedding_model is not None and _embedding_tokenizer is not None
+
+
+def warm_up_embedding_model() -> None:
+    """Start loading the local embedding model in a background thread (once)."""
+    global _embedding_warmup_thread
+    if embedding_model_ready() or _embedding_import_error is not None:
+        return
+    with _embedding_warmup_lock:
+        if _embedding_warmup_thread is not None:
+            return
+        _embedding_warmup_thread = Thread(
+            target=_warm_up_embedding_model, name="embedding-warmup", daemon=True
+        )
+    _embedding_warmup_thread.start()
+
+
+def _warm_up_embedding_model() -> None:
+    try:
+        _load_embedding_components()
+    except Exception:
+        logger.exception("Background load of embedding model %s failed", EMBEDDING_MODEL_ID)
+
+
 def _load_embedding_components():
     """Lazily load the local embedding model and tokenizer once."""
     global _embedding_model, _embedding_tokenizer
@@ -4,6 +4,14 @@ from typing import Any, Dict, List, Mapping, Tuple
 from flask import Flask, jsonify, request
 
 from model.agent_workflow import react_workflow
+from model.local_calls import embedding_cache_stats
+from model.tools import (
+    cascade_stats,
+    pipeline_registry_stats,
+    retrieval_cache_stats,
+    shadow_stats,
+    start_kb_watcher,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +24,11 @@ def _execute_workflow(payload: Dict[str, Any]):
     else:
         messages = []
     messages = [*messages, {"role": "user", "content": payload["user_request"]}]
-    logger.debug("Executing workflow for chat_id=%s", chat_id)
-    workflow_result = react_workflow(chat_id, messages)
+    kb = payload.get("kb")
+    if not isinstance(kb, str) or not kb.strip():
+        kb = None
+    logger.debug("Executing workflow for chat_id=%s kb=%s", chat_id, kb)
+    workflow_result = react_workflow(chat_id, messages, kb=kb)
     message = workflow_result.get("message", "")
     is_support_needed = bool(workflow_result.get("is_support_needed", False))
     return jsonify({"message": message, "is_support_needed": is_support_needed})
@@ -26,11 +37,24 @@ def _execute_workflow(payload: Dict[str, Any]):
 def create_app() -> Flask:
     """Application factory for the model workflow service."""
     app = Flask(__name__)
+    start_kb_watcher()
 
     @app.route("/ping", methods=["GET"])
     def ping() -> Tuple[str, int]:
         return "", 200
 
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return jsonify(
+            {
+                "embedding_cache": embedding_cache_stats(),
+                "retrieval_cache": retrieval_cache_stats(),
+                "retrieval_cascade": cascade_stats(),
+                "knowledge_bases": pipeline_registry_stats(),
+                "shadow_retrieval": shadow_stats(),
+            }
+        )
+
     @app.route("/workflow", methods=["POST"])
     def workflow():
         payload = request.get_json(silent=True) or {}
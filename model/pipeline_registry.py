@@ -0,0 +1,270 @@
+"""Registry of named retrieval pipelines: lazy single-flight loading, background hot reload,
+LRU eviction by memory."""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass, field
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    pipeline: Any
+    signature: Hashable
+    size_bytes: int
+    version: int
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Loading:
+    done: Event = field(default_factory=Event)
+    pipeline: Any = None
+
+
+@dataclass
+class _Failure:
+    signature: Hashable
+    error: str
+    at: float = field(default_factory=time.time)
+
+
+class PipelineRegistry:
+    """Pipelines by name, loaded on first use and evicted least-recently-used first once
+    their total size exceeds ``max_bytes`` (0 disables the budget).
+
+    ``load(name)`` returns the pipeline or None (nothing to serve; not cached).
+    ``signature(name)`` identifies the artifact behind a name. ``refresh(name, pipeline)``, if
+    given, may update a loaded pipeline in place for a new signature (returning True) instead
+    of loading it anew, e.g. to reload only the changed shards of a sharded KB. Only the first load of a name
+    blocks its callers (concurrent ones share it); when the signature of a loaded name changes
+    the new version is loaded on a background thread while the current one keeps serving, and
+    is swapped in only once it loaded. A failed load keeps the current version and is not
+    retried until the signature changes again. Reading a loaded pipeline takes no lock.
+
+    Signatures are checked on every ``get`` unless ``watch`` runs, which polls the loaded
+    names instead (and also loads the watched names once, ahead of their first request).
+
+    A name has at most one load or refresh in flight (its ``_loading`` entry); loads of
+    different names run concurrently. A pipeline's size is ``size_hint(name)`` bytes, e.g. the
+    size of its artifact, read after the load: process RSS would also count whatever other
+    threads allocate meanwhile. The most recently used pipeline is never evicted, even when it
+    alone exceeds the budget.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Any],
+        signature: Callable[[str], Hashable],
+        max_bytes: int = 0,
+        size_hint: Optional[Callable[[str], int]] = None,
+        refresh: Optional[Callable[[str, Any], bool]] = None,
+    ) -> None:
+        self._load = load
+        self._refresh = refresh
+        self._signature = signature
+        self._size_hint = size_hint or (lambda name: 0)
+        self._max_bytes = max(0, int(max_bytes))
+        # Replaced entry by entry under ``_lock``; readers only ``get`` from it.
+        self._entries: Dict[str, _Entry] = {}
+        self._loading: Dict[str, _Loading] = {}
+        self._failures: Dict[str, _Failure] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = Lock()
+        self._watcher: Optional[Thread] = None
+        self._hits = 0
+        self._loads = 0
+        self._reloads = 0
+        self._failed_loads = 0
+        self._evictions = 0
+
+    def get(self, name: str) -> Optional[Any]:
+        """The pipeline for ``name``, loading it if needed; a changed artifact is reloaded in
+        the background and the current version is returned meanwhile."""
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry.last_used = time.monotonic()
+            self._hits += 1  # unlocked: approximate under concurrency
+            if self._watcher is None:
+                self._check(name)
+            return entry.pipeline
+
+        signature = self._signature(name)
+        failure = self._failures.get(name)
+        if failure is not None and failure.signature == signature:
+            return None
+        return self._load_now(name)
+
+    def _check(self, name: str) -> None:
+        """Start a background load when the artifact of ``name`` changed since it was loaded
+        (or since its last failed load)."""
+        signature = self._signature(name)
+        with self._lock:
+            # Under the lock a finished load has already swapped its entry in.
+            entry = self._entries.get(name)
+            if entry is not None and entry.signature == signature:
+                return
+            failure = self._failures.get(name)
+            if failure is not None and failure.signature == signature:
+                return
+            if name in self._loading:
+                return
+            loading = self._loading[name] = _Loading()
+        Thread(
+            target=self._run_load, args=(name, loading), name=f"kb-load-{name}", daemon=True
+        ).start()
+
+    def _load_now(self, name: str) -> Optional[Any]:
+        """Load ``name`` on the calling thread, or wait for the load already running."""
+        with self._lock:
+            loading = self._loading.get(name)
+            owner = loading is None
+            if owner:
+                loading = self._loading[name] = _Loading()
+        if owner:
+            self._run_load(name, loading)
+        loading.done.wait()
+        return loading.pipeline
+
+    def _run_load(self, name: str, loading: _Loading) -> None:
+        pipeline = None
+        try:
+            pipeline = self._measured_load(name)
+        finally:
+            with self._lock:
+                del self._loading[name]
+            loading.pipeline = pipeline
+            loading.done.set()
+
+    def _measured_load(self, name: str) -> Optional[Any]:
+        error = "nothing to load"
+        previous = self._entries.get(name)
+        refreshed = False
+        # Taken before loading: an artifact replaced mid-load is picked up by the next check.
+        signature = self._signature(name)
+        try:
+            if previous is not None and self._refresh is not None:
+                refreshed = bool(self._refresh(name, previous.pipeline))
+            pipeline = previous.pipeline if refreshed else self._load(name)
+        except Exception as exc:
+            logger.warning("Loading pipeline '%s' failed: %s", name, exc)
+            pipeline, error = None, str(exc)
+
+        if pipeline is None:
+            with self._lock:
+                self._failures[name] = _Failure(signature, error)
+                self._failed_loads += 1
+            if previous is not None:
+                logger.warning(
+                    "Keeping version %d of pipeline '%s' after a failed reload",
+                    previous.version,
+                    name,
+                )
+            return previous.pipeline if previous is not None else None
+
+        size_bytes = self._size_hint(name)
+        with self._lock:
+            version = self._versions.get(name, 0) + 1
+            self._versions[name] = version
+            self._entries[name] = _Entry(pipeline, signature, size_bytes, version)
+            self._failures.pop(name, None)
+            self._loads += 1
+            if previous is not None:
+                self._reloads += 1
+            self._evict(name)
+        logger.info(
+            "Loaded version %d of pipeline '%s' (~%.1f MiB)", version, name, size_bytes / 2**20
+        )
+        return pipeline
+
+    def _evict(self, keep: str) -> None:
+        if self._max_bytes <= 0:
+            return
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        while total > self._max_bytes and len(self._entries) > 1:
+            name = min(
+                (name for name in self._entries if name != keep),
+                key=lambda name: self._entries[name].last_used,
+            )
+            entry = self._entries.pop(name)
+            total -= entry.size_bytes
+            self._evictions += 1
+            logger.info("Evicted pipeline '%s' (~%.1f MiB)", name, entry.size_bytes / 2**20)
+
+    def watch(self, names: Iterable[str] = (), interval: float = 2.0) -> None:
+        """Poll the signatures of every loaded pipeline every ``interval`` seconds on a daemon
+        thread, loading new versions in the background. Idempotent.
+
+        ``names`` are loaded once in the background ahead of their first request but are not
+        pinned: once evicted, a name is polled again only after a request loaded it back, so
+        an evicted KB is never reloaded just because it is watched.
+        """
+        names = tuple(names)
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = Thread(
+                target=self._watch, args=(names, interval), name="kb-watcher", daemon=True
+            )
+        self._watcher.start()
+
+    def _watch(self, names: tuple, interval: float) -> None:
+        while True:
+            for name in dict.fromkeys((*names, *list(self._entries))):
+                try:
+                    self._check(name)
+                except Exception as exc:
+                    logger.warning("Checking pipeline '%s' failed: %s", name, exc)
+            names = ()
+            time.sleep(interval)
+
+    def peek(self, name: str) -> Optional[Any]:
+        """The loaded pipeline for ``name``, if any; never loads and does not touch LRU order."""
+        entry = self._entries.get(name)
+        return entry.pipeline if entry is not None else None
+
+    def status(self, name: str) -> Dict[str, Any]:
+        """Load state of ``name``: "ready", "loading" (first load), "reloading", "failed"
+        (last load failed, nothing to serve) or "stale" (last reload failed, the previous
+        version is served) or "absent", with the active version and the last error."""
+        with self._lock:
+            entry = self._entries.get(name)
+            failure = self._failures.get(name)
+            loading = name in self._loading
+        if loading:
+            state = "reloading" if entry is not None else "loading"
+        elif failure is not None:
+            state = "stale" if entry is not None else "failed"
+        else:
+            state = "ready" if entry is not None else "absent"
+        status: Dict[str, Any] = {"state": state}
+        if entry is not None:
+            status["version"] = entry.version
+            status["loaded_at"] = round(entry.loaded_at, 3)
+        if failure is not None:
+            status["error"] = failure.error
+            status["failed_at"] = round(failure.at, 3)
+        return status
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            names = dict.fromkeys((*self._entries, *self._loading, *self._failures))
+            stats = {
+                "loaded": {name: entry.size_bytes for name, entry in self._entries.items()},
+                "total_bytes": sum(entry.size_bytes for entry in self._entries.values()),
+                "max_bytes": self._max_bytes,
+                "hits": self._hits,
+                "loads": self._loads,
+                "reloads": self._reloads,
+                "failed_loads": self._failed_loads,
+                "evictions": self._evictions,
+                "watching": self._watcher is not None,
+            }
+        stats["status"] = {name: self.status(name) for name in names}
+        return stats
@@ -23,6 +23,25 @@ Requirements:
     ]
 
 
+def get_synthetic_questions_prompt(passages: List[str], per_passage: int) -> List[Dict[str, Any]]:
+    """Prompt the chat model to write likely user questions for a batch of KB passages."""
+    system_prompt = f"""\
+You write the questions that real users of a support service would ask and that a knowledge-base passage answers.
+
+Requirements:
+- For every passage write exactly {per_passage} short, diverse questions in the user's words (symptoms, error messages, goals), not in the passage's wording.
+- Each question must be answerable from its passage alone.
+- Use the same language as the passage.
+- Respond **only** with a JSON object mapping each passage id to its list of questions:
+  {{"questions": {{"0": ["question one", "question two"], "1": ["..."]}}}}
+"""
+    user_payload = {"passages": [{"id": str(i), "text": text} for i, text in enumerate(passages)]}
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+    ]
+
+
 def get_planner_prompt(state: State) -> List[Dict[str, Any]]:
     """Build messages for the planner LLM call."""
     system_prompt = """\
@@ -43,7 +62,7 @@ Silently sketch 2–3 micro-plans, simulate likely outcomes, compare trade-offs,
 Use only the names and argument shapes below. Omit optional args unless needed. All values must be JSON-serializable.
 
 - rag_retrieve
-  - args: query:str, top_k:int
+  - args: query:str, top_k:int, filters:object (optional; metadata the chunks must match, e.g. {"product":"<product>"} or {"language":"ru"})
 - draft_answer
   - args: content:str
 - elevate
@@ -151,7 +170,7 @@ Return ONLY the final message text (plain/Markdown). No JSON, no code blocks, no
             "score": getattr(ev, "score", None),
             "timestamp": getattr(ev, "timestamp", None),
         }
-        for i, ev in enumerate(state.evidence)
+        for i, ev in enumerate(state.context_evidence)
     ]
 
     user_payload = {
@@ -201,7 +220,7 @@ Return ONLY the final Markdown text. No JSON, no code blocks, no commentary.
             "score": getattr(ev, "score", None),
             "timestamp": getattr(ev, "timestamp", None),
         }
-        for i, ev in enumerate(state.evidence)
+        for i, ev in enumerate(state.context_evidence)
     ]
 
 
@@ -230,7 +249,7 @@ Return ONLY the final message text (plain/Markdown). No JSON, no code blocks, no
             "score": getattr(ev, "score", None),
             "timestamp": getattr(ev, "timestamp", None),
         }
-        for i, ev in enumerate(state.evidence)
+        for i, ev in enumerate(state.context_evidence)
     ]
 
     user_payload = {
@@ -319,7 +338,7 @@ Return ONLY the final message text (plain/Markdown). No JSON, no code blocks, no
             "score": getattr(ev, "score", None),
             "timestamp": getattr(ev, "timestamp", None),
         }
-        for i, ev in enumerate(state.evidence)
+        for i, ev in enumerate(state.context_evidence)
     ]
 
     user_payload = {
@@ -359,7 +378,7 @@ You are the Finalizer. Produce the final user answer using:
             "score": getattr(ev, "score", None),
             "timestamp": getattr(ev, "timestamp", None),
         }
-        for i, ev in enumerate(state.evidence)
+        for i, ev in enumerate(state.context_evidence)
     ]
 
     # Prefer explicit state.last_draft; fallback to last thought if that’s how you store it.
@@ -6,6 +6,10 @@ class BaseEmbeddingModel(ABC):
     def create_embedding(self, text):
         pass
 
+    def create_embeddings(self, texts):
+        """Embeds a batch of texts; models with a batched endpoint should override this."""
+        return [self.create_embedding(text) for text in texts]
+
 
 class OpenAIEmbeddingModel(BaseEmbeddingModel):
     """
@@ -1,13 +1,17 @@
 # убрал логирование import logging
+import os
 import pickle
 
 from .cluster_tree_builder import ClusterTreeBuilder, ClusterTreeConfig
+from .columnar_kb import is_columnar_kb, load_columnar_tree, write_columnar_kb
 from .EmbeddingModels import BaseEmbeddingModel
+from .lexical_index import BM25Index
 from .QAModels import BaseQAModel, GPT3TurboQAModel
 from .SummarizationModels import BaseSummarizationModel
 from .tree_builder import TreeBuilder, TreeBuilderConfig
 from .tree_retriever import TreeRetriever, TreeRetrieverConfig
 from .tree_structures import Node, Tree
+from .utils import get_node_list, pack_node_embeddings, split_text
 
 # Define a dictionary to map supported tree builders to their respective configs
 supported_tree_builders = {"cluster": (ClusterTreeBuilder, ClusterTreeConfig)}
@@ -32,6 +36,14 @@ class RetrievalAugmentationConfig:
         tr_embedding_model=None,
         tr_num_layers=None,
         tr_start_layer=None,
+        tr_index_backend=None,
+        tr_index_path=None,
+        tr_nprobe=None,
+        tr_ef_search=None,
+        tr_embedding_dtype=None,
+        tr_rescore_factor=None,
+        tr_first_stage_dims=None,
+        tr_first_stage_candidates=None,
         # TreeBuilderConfig arguments
         tb_tokenizer=None,
         tb_max_tokens=100,
@@ -118,6 +130,14 @@ class RetrievalAugmentationConfig:
                 embedding_model=tr_embedding_model,
                 num_layers=tr_num_layers,
                 start_layer=tr_start_layer,
+                index_backend=tr_index_backend,
+                index_path=tr_index_path,
+                nprobe=tr_nprobe,
+                ef_search=tr_ef_search,
+                embedding_dtype=tr_embedding_dtype,
+                rescore_factor=tr_rescore_factor,
+                first_stage_dims=tr_first_stage_dims,
+                first_stage_candidates=tr_first_stage_candidates,
             )
         elif not isinstance(tree_retriever_config, TreeRetrieverConfig):
             raise ValueError(
@@ -158,7 +178,8 @@ class RetrievalAugmentation:
         Initializes a RetrievalAugmentation instance with the specified configuration.
         Args:
             config (RetrievalAugmentationConfig): The configuration for the RetrievalAugmentation instance.
-            tree: The tree instance or the path to a pickled tree file.
+            tree: The tree instance, the path to a pickled tree file or to a columnar KB
+                directory (memory-mapped, see columnar_kb).
         """
         if config is None:
             config = RetrievalAugmentationConfig()
@@ -167,8 +188,10 @@ class RetrievalAugmentation:
                 "config must be an instance of RetrievalAugmentationConfig"
             )
 
-        # Check if tree is a string (indicating a path to a pickled tree)
-        if isinstance(tree, str):
+        # Check if tree is a string (indicating a path to a pickled tree or a columnar KB)
+        if isinstance(tree, str) and is_columnar_kb(tree):
+            self.tree = load_columnar_tree(tree)
+        elif isinstance(tree, str):
             with open(tree, "rb") as file:
                 self.tree = pickle.load(file)
             if not isinstance(self.tree, Tree):
@@ -178,7 +201,7 @@ class RetrievalAugmentation:
             self.tree = tree
         else:
             raise ValueError(
-                "tree must be an instance of Tree, a path to a pickled Tree, or None"
+                "tree must be an instance of Tree, a path to a pickled Tree or columnar KB, or None"
             )
 
         tree_builder_class = supported_tree_builders[config.tree_builder_type][0]
@@ -195,20 +218,65 @@ class RetrievalAugmentation:
 
     def add_documents(self, docs):
         """
-        Adds documents to the tree and creates a TreeRetriever instance.
+        Builds the tree from documents, replacing any existing tree (see 'add_to_existing'
+        to extend it), and creates a TreeRetriever instance.
+
+        Args:
+            docs (str): The input text to build the tree from.
+        """
+        self.tree = self.tree_builder.build_from_text(text=docs)
+        self.retriever = TreeRetriever(self.tree_retriever_config, self.tree)
+
+    def add_to_existing(self, docs, drift_threshold: float = 0.2):
+        """
+        Adds documents to the existing tree incrementally (see 'update_chunks'); builds the
+        tree when there is none.
 
         Args:
             docs (str): The input text to add to the tree.
+            drift_threshold (float): Cumulative changed-leaf fraction that triggers a full rebuild.
+
+        Returns:
+            TreeUpdate: What changed, or None when the tree was built.
         """
-        if self.tree is not None:
-            user_input = input(
-                "Warning: Overwriting existing tree. Did you mean to call 'add_to_existing' instead? (y/n): "
-            )
-            if user_input.lower() == "y":
-                # self.add_to_existing(docs)
-                return
+        if self.tree is None:
+            self.add_documents(docs)
+            return None
+        existing = [node.text for node in get_node_list(self.tree.leaf_nodes)]
+        new_chunks = split_text(docs, self.tree_builder.tokenizer, self.tree_builder.max_tokens)
+        return self.update_chunks(existing + new_chunks, drift_threshold=drift_threshold)
 
-        self.tree = self.tree_builder.build_from_text(text=docs)
+    def update_chunks(self, chunks, drift_threshold: float = 0.2):
+        """
+        Updates the tree so that its leaves are ``chunks``: only new leaves are embedded and
+        only the summaries above changed leaves are regenerated, until the accumulated
+        drift calls for a full rebuild (see TreeBuilder.update_from_chunks).
+
+        Args:
+            chunks (List[str]): The leaf texts of the updated tree.
+            drift_threshold (float): Cumulative changed-leaf fraction that triggers a full rebuild.
+
+        Returns:
+            TreeUpdate: The update, including the leaf node index of every chunk.
+        """
+        if self.tree is None:
+            raise ValueError("There is no tree to update. Call 'add_chunks' first.")
+        update = self.tree_builder.update_from_chunks(
+            self.tree, chunks, drift_threshold=drift_threshold
+        )
+        self.tree = update.tree
+        self.retriever = TreeRetriever(self.tree_retriever_config, self.tree)
+        return update
+
+    def add_chunks(self, chunks):
+        """
+        Builds the tree from already split leaf texts (leaf i is ``chunks[i]``) and creates
+        a TreeRetriever instance.
+
+        Args:
+            chunks (List[str]): The leaf texts.
+        """
+        self.tree = self.tree_builder.build_from_chunks(chunks)
         self.retriever = TreeRetriever(self.tree_retriever_config, self.tree)
 
     def retrieve(
@@ -290,9 +358,39 @@ class RetrievalAugmentation:
 
         return answer
 
-    def save(self, path):
+    def save(self, path, embedding_dtype=None):
+        """
+        Pickles the tree to ``path`` together with a freshly built BM25 index over its nodes.
+        A ``path`` ending in ``.kb`` is written as a columnar KB directory instead.
+
+        Args:
+            path (str): Destination file (or ``.kb`` directory).
+            embedding_dtype (str): If 'float32' or 'float16', node embeddings are packed into
+                numpy arrays of that dtype before saving. Defaults to keeping them as-is
+                (float32 in a columnar KB). int8 is a search representation only and is
+                never saved.
+        """
         if self.tree is None:
             raise ValueError("There is no tree to save.")
-        with open(path, "wb") as file:
+        if str(path).endswith(".kb"):
+            self.tree.lexical_index = BM25Index.from_nodes(get_node_list(self.tree.all_nodes))
+            write_columnar_kb(
+                self.tree,
+                path,
+                self.tree_retriever_config.context_embedding_model,
+                embedding_dtype or "float32",
+            )
+            return
+        if embedding_dtype is not None:
+            # leaf_nodes/layer_to_nodes may hold separate copies of the leaves.
+            nodes = list(self.tree.all_nodes.values()) + list(self.tree.leaf_nodes.values())
+            for layer_nodes in self.tree.layer_to_nodes.values():
+                nodes.extend(layer_nodes)
+            pack_node_embeddings(nodes, embedding_dtype)
+        self.tree.lexical_index = BM25Index.from_nodes(get_node_list(self.tree.all_nodes))
+        # Written aside and renamed, so a serving process never loads a partial pickle.
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
             pickle.dump(self.tree, file)
+        os.replace(tmp_path, path)
 # убрал логирование logging.info(f"Tree successfully saved to {path}")
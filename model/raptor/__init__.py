@@ -1,5 +1,6 @@
 # raptor/__init__.py
 from .cluster_tree_builder import ClusterTreeBuilder, ClusterTreeConfig
+from .columnar_kb import ColumnarKB, ColumnarTree, load_columnar_tree, write_columnar_kb
 from .EmbeddingModels import BaseEmbeddingModel
 from .FaissRetriever import FaissRetriever, FaissRetrieverConfig
 from .QAModels import (BaseQAModel, 
@@ -12,3 +13,8 @@ from .SummarizationModels import (BaseSummarizationModel,
 from .tree_builder import TreeBuilder, TreeBuilderConfig
 from .tree_retriever import TreeRetriever, TreeRetrieverConfig
 from .tree_structures import Node, Tree
+from .vector_index import BaseVectorIndex, FaissIndex, MatrixIndex
+from .lexical_index import BM25Index
+from .neighbor_graph import NeighborGraph
+from .node_metadata import METADATA_FIELDS, NodeMetadata
+from .sentence_index import SentenceStore
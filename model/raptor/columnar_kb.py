@@ -0,0 +1,357 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from .tree_structures import Node, Tree
+from .utils import (get_children_csr, get_embedding_matrix, get_layer_offsets,
+                    get_layer_order, get_node_list, get_node_positions,
+                    get_parents_csr)
+from .vector_index import EmbeddingStore
+
+COLUMNAR_FORMAT_VERSION = 1
+# Stored embeddings double as the exact rescoring source, so they are never saved as int8;
+# RAPTOR_EMBEDDING_DTYPE=int8 quantizes them when the KB is loaded.
+PERSISTED_EMBEDDING_DTYPES = ["float32", "float16"]
+
+_META_FILE = "meta.json"
+_EXTRAS_FILE = "extras.pickle"
+# Names the version subdirectory being served; replaced atomically by the writer.
+_CURRENT_FILE = "CURRENT"
+_VERSION_PREFIX = "v-"
+# Optional tree attributes; they are small next to the node columns and pickled as-is.
+_EXTRA_ATTRIBUTES = (
+    "lexical_index",
+    "question_keys",
+    "sentence_store",
+    "neighbor_graph",
+    "node_metadata",
+    "update_drift",
+)
+
+
+def is_columnar_kb(path) -> bool:
+    """Whether ``path`` is a columnar KB directory."""
+    path = Path(path)
+    return (path / _CURRENT_FILE).is_file() or (path / _META_FILE).is_file()
+
+
+def columnar_version_path(path) -> Path:
+    """
+    The directory holding the version of a columnar KB served now: the subdirectory named by
+    its CURRENT file, or the KB directory itself for a KB written before versioning.
+
+    A version directory is never modified and outlives the next swap, so readers resolve it
+    once and read every file of one version from it.
+    """
+    path = Path(path)
+    try:
+        version = (path / _CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return path
+    return path / version
+
+
+def read_columnar_meta(path) -> Dict:
+    """The ``meta.json`` of a columnar KB directory (format, sizes, content hash)."""
+    meta = json.loads((columnar_version_path(path) / _META_FILE).read_text(encoding="utf-8"))
+    if meta.get("format_version") != COLUMNAR_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported columnar KB format {meta.get('format_version')!r} in {path}"
+        )
+    return meta
+
+
+def write_columnar_kb(
+    tree: Tree, path, embedding_model: str, embedding_dtype: str = "float32"
+) -> Path:
+    """
+    Writes a tree as a columnar KB directory: one ``.npy`` file per column over node
+    positions (nodes sorted by index), a ``meta.json`` and the pickled optional attributes.
+
+    Columns: ``node_indices``; ``embeddings`` (unit-length rows in ``embedding_dtype``; KBs
+    written with int8 also have ``embedding_scales``); ``texts`` (UTF-8 blob) with
+    ``text_offsets``; ``children_indptr``/``children`` and ``parents_indptr``/``parents``
+    (CSR over positions); ``layers`` (layer of every position, -1 if none).
+
+    Every version is written to its own ``v-<content hash>`` subdirectory of ``path`` and
+    published by atomically replacing the ``CURRENT`` file naming it, so ``path`` always
+    serves a complete version. The previous version is kept for readers that resolved it
+    just before the swap; older ones are deleted (readers that memory-mapped them keep their
+    unlinked files).
+
+    Args:
+        tree (Tree): The tree to write.
+        path: The KB directory.
+        embedding_model (str): The embedding key of the nodes.
+        embedding_dtype (str): One of PERSISTED_EMBEDDING_DTYPES.
+
+    Returns:
+        Path: The KB directory.
+    """
+    if embedding_dtype not in PERSISTED_EMBEDDING_DTYPES:
+        raise ValueError(
+            f"Unsupported embedding dtype '{embedding_dtype}'. "
+            f"Supported dtypes are: {PERSISTED_EMBEDDING_DTYPES}"
+        )
+    nodes = get_node_list(tree.all_nodes)
+    positions = get_node_positions(nodes)
+    children_indptr, children = get_children_csr(nodes, positions)
+    parents_indptr, parents = get_parents_csr(children_indptr, children)
+    node_layers, _, _ = get_layer_offsets(tree.layer_to_nodes, positions, len(nodes))
+    store = EmbeddingStore.from_matrix(
+        get_embedding_matrix(nodes, embedding_model), dtype=embedding_dtype
+    )
+    encoded = [node.text.encode("utf-8") for node in nodes]
+    text_offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    text_offsets[1:] = np.cumsum([len(text) for text in encoded])
+
+    columns = {
+        "node_indices": np.asarray([node.index for node in nodes], dtype=np.int64),
+        "embeddings": store.data,
+        "texts": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "text_offsets": text_offsets,
+        "children_indptr": children_indptr,
+        "children": children,
+        "parents_indptr": parents_indptr,
+        "parents": parents,
+        "layers": node_layers,
+    }
+
+    target = Path(path)
+    target.mkdir(parents=True, exist_ok=True)
+    staging = target / f".tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+
+    digest = hashlib.sha256()
+    for name, column in columns.items():
+        column = np.ascontiguousarray(column)
+        np.save(staging / f"{name}.npy", column)
+        digest.update(name.encode("utf-8"))
+        digest.update(column.tobytes())
+    extras = pickle.dumps({name: getattr(tree, name, None) for name in _EXTRA_ATTRIBUTES})
+    (staging / _EXTRAS_FILE).write_bytes(extras)
+    digest.update(extras)
+
+    meta = {
+        "format_version": COLUMNAR_FORMAT_VERSION,
+        "num_nodes": len(nodes),
+        "num_layers": tree.num_layers,
+        "embedding_model": embedding_model,
+        "embedding_dtype": embedding_dtype,
+        "dim": int(store.shape[1]) if len(nodes) else 0,
+        "columns": sorted(columns),
+        "content_hash": digest.hexdigest(),
+    }
+    (staging / _META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    version = f"{_VERSION_PREFIX}{meta['content_hash'][:16]}"
+    if (target / version).exists():
+        # Same content as a kept version; it is complete and never modified.
+        shutil.rmtree(staging)
+    else:
+        os.replace(staging, target / version)
+    previous = columnar_version_path(target).name
+    pointer = target / f".{_CURRENT_FILE}.tmp-{os.getpid()}"
+    pointer.write_text(version, encoding="utf-8")
+    os.replace(pointer, target / _CURRENT_FILE)
+
+    for entry in target.iterdir():
+        if entry.name in (version, previous, _CURRENT_FILE) or entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            if entry.name.startswith(_VERSION_PREFIX):
+                shutil.rmtree(entry, ignore_errors=True)
+        else:
+            # Files of the unversioned layout, served directly from ``path`` before.
+            entry.unlink(missing_ok=True)
+    return target
+
+
+class ColumnarKB:
+    """
+    A columnar KB directory opened with ``np.load(mmap_mode="r")``: opening reads only the
+    small metadata, the columns are paged in from the OS page cache on access and shared
+    between every process that maps the same files.
+    """
+
+    def __init__(self, path, meta: Dict, columns: Dict[str, np.ndarray], extras: Dict) -> None:
+        self.path = Path(path)
+        self.meta = meta
+        self.columns = columns
+        self.extras = extras
+        self.node_indices = columns["node_indices"]
+        self.layers = columns["layers"]
+
+    @classmethod
+    def open(cls, path, mmap: bool = True) -> "ColumnarKB":
+        """
+        Opens a columnar KB directory.
+
+        Args:
+            path: The KB directory.
+            mmap (bool): Memory-map the columns (False reads them into memory).
+
+        Returns:
+            ColumnarKB: The opened KB.
+        """
+        for attempt in range(3):
+            version_path = columnar_version_path(path)
+            try:
+                return cls._open_version(version_path, mmap)
+            except FileNotFoundError:
+                # Deleted while opening by writers that published two newer versions.
+                if attempt == 2 or columnar_version_path(path) == version_path:
+                    raise
+
+    @classmethod
+    def _open_version(cls, path: Path, mmap: bool) -> "ColumnarKB":
+        meta = read_columnar_meta(path)
+        columns = {
+            file.stem: np.load(file, mmap_mode="r" if mmap else None)
+            for file in sorted(path.glob("*.npy"))
+        }
+        missing = set(meta.get("columns", ())) - set(columns)
+        if missing:
+            raise FileNotFoundError(f"Columns {sorted(missing)} missing in {path}")
+        with open(path / _EXTRAS_FILE, "rb") as file:
+            extras = pickle.load(file)
+        return cls(path, meta, columns, extras)
+
+    def __len__(self) -> int:
+        return len(self.node_indices)
+
+    @property
+    def content_hash(self) -> str:
+        return self.meta["content_hash"]
+
+    @property
+    def embedding_model(self) -> str:
+        return self.meta["embedding_model"]
+
+    def embedding_store(self, dtype: Optional[str] = None) -> EmbeddingStore:
+        """
+        The node embeddings as a store. In the stored dtype (or with ``dtype`` None) the
+        store wraps the mapped columns without copying; another dtype is converted in memory.
+        """
+        store = EmbeddingStore(
+            self.columns["embeddings"], self.columns.get("embedding_scales")
+        )
+        if dtype is None or dtype == store.dtype:
+            return store
+        return EmbeddingStore.from_matrix(store.to_float32(), dtype=dtype)
+
+    def node_positions(self) -> np.ndarray:
+        """Node index to position lookup, as ``get_node_positions``."""
+        size = int(self.node_indices[-1]) + 1 if len(self) else 0
+        positions = np.full(size, -1, dtype=np.int64)
+        positions[self.node_indices] = np.arange(len(self), dtype=np.int64)
+        return positions
+
+    def layer_offsets(self):
+        """The layer of every position, the positions ordered by layer and the layer
+        offsets, as ``get_layer_offsets``."""
+        order, offsets = get_layer_order(self.layers, self.meta["num_layers"] + 1)
+        return self.layers, order, offsets
+
+    def position(self, node_index: int) -> int:
+        """Position of a node index, or -1 if the KB has no such node."""
+        position = int(np.searchsorted(self.node_indices, node_index))
+        if position < len(self) and self.node_indices[position] == node_index:
+            return position
+        return -1
+
+    def text(self, position: int) -> str:
+        offsets = self.columns["text_offsets"]
+        start, stop = offsets[position], offsets[position + 1]
+        return bytes(self.columns["texts"][start:stop]).decode("utf-8")
+
+    def node(self, position: int) -> Node:
+        """A Node built from the columns at ``position``; its embedding is the stored row."""
+        indptr = self.columns["children_indptr"]
+        children = self.columns["children"][indptr[position] : indptr[position + 1]]
+        embedding = self.embedding_store().rows(np.asarray([position]))[0]
+        return Node(
+            self.text(position),
+            int(self.node_indices[position]),
+            set(int(index) for index in self.node_indices[children]),
+            {self.embedding_model: embedding},
+        )
+
+
+class _NodeMap(Mapping):
+    """Read-only node index -> Node mapping over some positions of a ColumnarKB; nodes are
+    built on access."""
+
+    def __init__(self, kb: ColumnarKB, positions: np.ndarray) -> None:
+        self._kb = kb
+        self._positions = np.asarray(positions, dtype=np.int64)
+        self._indices = kb.node_indices[self._positions]
+
+    def __getitem__(self, node_index) -> Node:
+        row = int(np.searchsorted(self._indices, node_index))
+        if row >= len(self._indices) or self._indices[row] != node_index:
+            raise KeyError(node_index)
+        return self._kb.node(int(self._positions[row]))
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(index) for index in self._indices)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+class _NodeList(Sequence):
+    """Read-only list of the Nodes at some positions of a ColumnarKB, built on access."""
+
+    def __init__(self, kb: ColumnarKB, positions: np.ndarray) -> None:
+        self._kb = kb
+        self._positions = np.asarray(positions, dtype=np.int64)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return _NodeList(self._kb, self._positions[item])
+        return self._kb.node(int(self._positions[item]))
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+class ColumnarTree(Tree):
+    """
+    A Tree over a ColumnarKB. ``all_nodes``, ``leaf_nodes``, ``root_nodes`` and
+    ``layer_to_nodes`` are lazy views that build Node objects only for the nodes touched;
+    the retriever reads the columns directly through ``columns``.
+    """
+
+    def __init__(self, columns: ColumnarKB) -> None:
+        num_layers = columns.meta["num_layers"]
+        layer_to_nodes = {
+            layer: _NodeList(columns, np.flatnonzero(columns.layers == layer))
+            for layer in range(num_layers + 1)
+        }
+        super().__init__(
+            _NodeMap(columns, np.arange(len(columns))),
+            _NodeMap(columns, np.flatnonzero(columns.layers == num_layers)),
+            _NodeMap(columns, np.flatnonzero(columns.layers == 0)),
+            num_layers,
+            layer_to_nodes,
+            **{name: columns.extras.get(name) for name in _EXTRA_ATTRIBUTES},
+        )
+        self.columns = columns
+
+    def nodes(self) -> _NodeList:
+        """All nodes in position (node index) order."""
+        return _NodeList(self.columns, np.arange(len(self.columns)))
+
+
+def load_columnar_tree(path, mmap: bool = True) -> ColumnarTree:
+    """Opens a columnar KB directory as a tree (see ColumnarKB.open)."""
+    return ColumnarTree(ColumnarKB.open(path, mmap=mmap))
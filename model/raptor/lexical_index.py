@@ -0,0 +1,272 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .tree_structures import Node
+from .utils import indices_of_top_k_from_scores
+
+# Identifiers such as "ERR-504", "INC_1234", "api.v2" stay single tokens.
+_TOKEN_PATTERN = re.compile(r"[0-9a-zа-я]+(?:[-_./:][0-9a-zа-я]+)*")
+_CYRILLIC_WORD = re.compile(r"^[а-я]+$")
+
+_RU_VOWELS = set("аеиоуыэюя")
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_REFLEXIVE = ("ся", "сь")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий",
+    "ый", "ой", "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_VERB_1 = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н")
+_VERB_2 = (
+    "ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено",
+    "ует", "уют", "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым",
+    "ен", "ят", "ит", "ыт", "ую", "ю",
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи",
+    "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия",
+    "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _sorted_by_length(endings: Sequence[str]) -> Tuple[str, ...]:
+    return tuple(sorted(endings, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND_1 = _sorted_by_length(_PERFECTIVE_GERUND_1)
+_PERFECTIVE_GERUND_2 = _sorted_by_length(_PERFECTIVE_GERUND_2)
+_ADJECTIVE = _sorted_by_length(_ADJECTIVE)
+_VERB_1 = _sorted_by_length(_VERB_1)
+_VERB_2 = _sorted_by_length(_VERB_2)
+_NOUN = _sorted_by_length(_NOUN)
+
+
+def _strip_ending(word: str, group_1=(), group_2=()) -> str:
+    """
+    Removes the longest matching ending. Group 1 endings only match after 'а' or 'я',
+    which are kept. Returns the word unchanged when nothing matches.
+    """
+    best = None
+    for ending in group_1:
+        if word.endswith(ending) and len(word) > len(ending) and word[-len(ending) - 1] in "ая":
+            best = ending
+            break
+    for ending in group_2:
+        if word.endswith(ending) and (best is None or len(ending) > len(best)):
+            best = ending
+            break
+    return word[: -len(best)] if best else word
+
+
+def _regions(word: str) -> Tuple[int, int]:
+    """Returns the start offsets of the RV and R2 regions of a Snowball Russian word."""
+    rv = len(word)
+    for position, char in enumerate(word):
+        if char in _RU_VOWELS:
+            rv = position + 1
+            break
+
+    def next_region(start: int) -> int:
+        for position in range(start + 1, len(word)):
+            if word[position] not in _RU_VOWELS and word[position - 1] in _RU_VOWELS:
+                return position + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def stem_russian(word: str) -> str:
+    """
+    Stems a lower-case Russian word with the Snowball Russian algorithm.
+
+    Args:
+        word (str): A lower-case Cyrillic word ('ё' already folded to 'е').
+
+    Returns:
+        str: The stem.
+    """
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Step 1
+    stripped = _strip_ending(rv, _PERFECTIVE_GERUND_1, _PERFECTIVE_GERUND_2)
+    if stripped == rv:
+        rv = _strip_ending(rv, (), _REFLEXIVE)
+        stripped = _strip_ending(rv, (), _ADJECTIVE)
+        if stripped != rv:
+            rv = _strip_ending(stripped, _PARTICIPLE_1, _PARTICIPLE_2)
+        else:
+            stripped = _strip_ending(rv, _VERB_1, _VERB_2)
+            if stripped == rv:
+                stripped = _strip_ending(rv, (), _NOUN)
+            rv = stripped
+    else:
+        rv = stripped
+
+    # Step 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Step 3: derivational endings must lie entirely in R2.
+    for ending in _DERIVATIONAL:
+        if rv.endswith(ending) and rv_start + len(rv) - len(ending) >= r2_start:
+            rv = rv[: -len(ending)]
+            break
+
+    # Step 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        superlative = _strip_ending(rv, (), _SUPERLATIVE)
+        if superlative != rv:
+            rv = superlative[:-1] if superlative.endswith("нн") else superlative
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cases, folds 'ё', and splits text into lexical terms. Russian words are stemmed;
+    Latin words, numbers and identifiers like error codes or ticket IDs are kept verbatim.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The terms.
+    """
+    terms = []
+    for token in _TOKEN_PATTERN.findall((text or "").lower().replace("ё", "е")):
+        if _CYRILLIC_WORD.match(token):
+            terms.append(stem_russian(token))
+        else:
+            terms.append(token)
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over node texts. Postings are stored as CSR arrays:
+    the documents containing term t are ``doc_ids[indptr[t]:indptr[t + 1]]``.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        node_indices: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> None:
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.node_indices = node_indices
+        self.k1 = k1
+        self.b = b
+
+        num_docs = len(doc_lengths)
+        doc_freqs = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        average_length = float(doc_lengths.mean()) if num_docs else 0.0
+        self.length_norm = (
+            k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))
+        ).astype(np.float32)
+
+    @classmethod
+    def from_nodes(cls, node_list: List[Node], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """
+        Builds the index over the text of the given nodes.
+
+        Args:
+            node_list (List[Node]): The nodes to index.
+            k1 (float): BM25 term-frequency saturation.
+            b (float): BM25 length normalization.
+
+        Returns:
+            BM25Index: The index; search results are node indices.
+        """
+        vocabulary: Dict[str, int] = {}
+        postings: List[Dict[int, int]] = []
+        doc_lengths = np.zeros(len(node_list), dtype=np.float32)
+
+        for doc_id, node in enumerate(node_list):
+            terms = tokenize(node.text)
+            doc_lengths[doc_id] = len(terms)
+            for term in terms:
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][doc_id] = postings[term_id].get(doc_id, 0) + 1
+
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(term_postings) for term_postings in postings])
+        doc_ids = np.fromiter(
+            (doc_id for term_postings in postings for doc_id in term_postings),
+            dtype=np.int32,
+            count=int(indptr[-1]),
+        )
+        term_freqs = np.fromiter(
+            (freq for term_postings in postings for freq in term_postings.values()),
+            dtype=np.float32,
+            count=int(indptr[-1]),
+        )
+        node_indices = np.asarray([node.index for node in node_list], dtype=np.int64)
+        return cls(vocabulary, indptr, doc_ids, term_freqs, doc_lengths, node_indices, k1, b)
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def score(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every indexed document for the query."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in tokenize(query):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:stop]
+            freqs = self.term_freqs[start:stop]
+            scores[docs] += (
+                self.idf[term_id] * freqs * (self.k1 + 1) / (freqs + self.length_norm[docs])
+            )
+        return scores
+
+    def search(
+        self, query: str, top_k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the best matching documents for the query.
+
+        Args:
+            query (str): The query text.
+            top_k (int): The maximum number of results.
+            mask (np.ndarray): Optional boolean mask over the indexed documents; documents
+                outside it are never returned.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: BM25 scores and node indices, best first.
+                Documents sharing no term with the query are never returned.
+        """
+        scores = self.score(query)
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        best = indices_of_top_k_from_scores(scores, top_k)
+        best = best[scores[best] > 0]
+        return scores[best], self.node_indices[best]
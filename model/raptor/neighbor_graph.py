@@ -0,0 +1,81 @@
+from typing import List, Optional
+
+import numpy as np
+
+from .tree_structures import Node
+from .utils import get_embedding_matrix
+from .vector_index import EmbeddingStore, build_vector_index
+
+# Above this many nodes the graph is built with an HNSW index: the exact scan costs O(n^2).
+_EXACT_MAX_NODES = 20_000
+
+
+class NeighborGraph:
+    """
+    Precomputed k-nearest-neighbour graph over the node embeddings of a tree. Row i holds
+    the nearest other nodes of node ``node_indices[i]`` as node indices, best first, with
+    their cosine similarities; rows with fewer neighbours are padded with -1.
+    """
+
+    def __init__(
+        self, node_indices: np.ndarray, neighbors: np.ndarray, similarities: np.ndarray
+    ) -> None:
+        self.node_indices = node_indices
+        self.neighbors = neighbors
+        self.similarities = similarities
+
+    @classmethod
+    def build(
+        cls,
+        node_list: List[Node],
+        embedding_model: str,
+        k: int = 8,
+        backend: Optional[str] = None,
+        batch_size: int = 1024,
+    ) -> "NeighborGraph":
+        """
+        Searches every node against all nodes, in batches, and keeps its k best hits other
+        than itself.
+
+        Args:
+            node_list (List[Node]): The nodes of the tree.
+            embedding_model (str): The embedding key of the nodes.
+            k (int): Neighbours per node.
+            backend (Optional[str]): Vector index backend used for the search. Defaults to
+                the exact "matrix" scan up to ``_EXACT_MAX_NODES`` nodes and to an
+                approximate "hnsw" index (O(n log n)) above.
+            batch_size (int): Nodes searched per call.
+
+        Returns:
+            NeighborGraph: The graph.
+        """
+        nodes = sorted(node_list, key=lambda node: node.index)
+        node_indices = np.asarray([node.index for node in nodes], dtype=np.int64)
+        k = max(0, min(k, len(nodes) - 1))
+        neighbors = np.full((len(nodes), k), -1, dtype=np.int64)
+        similarities = np.zeros((len(nodes), k), dtype=np.float32)
+        if k == 0:
+            return cls(node_indices, neighbors, similarities)
+
+        if backend is None:
+            backend = "matrix" if len(nodes) <= _EXACT_MAX_NODES else "hnsw"
+        matrix = get_embedding_matrix(nodes, embedding_model)
+        index = build_vector_index(
+            EmbeddingStore.from_matrix(matrix), backend=backend, ef_search=max(128, 8 * (k + 1))
+        )
+        for start in range(0, len(nodes), batch_size):
+            scores, positions = index.search(matrix[start : start + batch_size], k + 1)
+            for offset in range(positions.shape[0]):
+                row = start + offset
+                keep = (positions[offset] >= 0) & (positions[offset] != row)
+                found = positions[offset][keep][:k]
+                neighbors[row, : len(found)] = node_indices[found]
+                similarities[row, : len(found)] = scores[offset][keep][:k]
+        return cls(node_indices, neighbors, similarities)
+
+    def __len__(self) -> int:
+        return len(self.node_indices)
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
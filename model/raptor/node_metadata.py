@@ -0,0 +1,124 @@
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from .tree_structures import Tree
+
+METADATA_FIELDS = ("doc_id", "source", "section", "product", "language")
+
+MetadataFilters = Mapping[str, Union[str, Sequence[str]]]
+
+
+class NodeMetadata:
+    """
+    Columnar provenance of tree nodes. Every field is dictionary-encoded: the value of node
+    ``node_indices[i]`` for ``field`` is ``values[field][codes[field][i]]``, code -1 meaning
+    unknown. Leaves carry the metadata of the source chunk they were split from; a summary
+    keeps a field only when all of its children agree on it.
+    """
+
+    def __init__(
+        self,
+        node_indices: np.ndarray,
+        values: Dict[str, List[str]],
+        codes: Dict[str, np.ndarray],
+    ) -> None:
+        self.node_indices = node_indices
+        self.values = values
+        self.codes = codes
+
+    @classmethod
+    def build(cls, tree: Tree, leaf_records: Mapping[int, Mapping[str, str]]) -> "NodeMetadata":
+        """
+        Encodes the leaf records and derives the metadata of every summary from its children,
+        layer by layer.
+
+        Args:
+            tree (Tree): The built tree.
+            leaf_records (Mapping[int, Mapping[str, str]]): Metadata per leaf node index;
+                fields outside METADATA_FIELDS and empty values are ignored.
+
+        Returns:
+            NodeMetadata: The columnar metadata of all nodes.
+        """
+        node_indices = np.asarray(sorted(tree.all_nodes), dtype=np.int64)
+        rows = {int(index): row for row, index in enumerate(node_indices)}
+        vocabularies: Dict[str, Dict[str, int]] = {field: {} for field in METADATA_FIELDS}
+        codes = {
+            field: np.full(len(node_indices), -1, dtype=np.int32) for field in METADATA_FIELDS
+        }
+
+        for node_index, record in leaf_records.items():
+            row = rows.get(int(node_index))
+            if row is None:
+                continue
+            for field in METADATA_FIELDS:
+                value = record.get(field)
+                if value:
+                    vocabulary = vocabularies[field]
+                    codes[field][row] = vocabulary.setdefault(str(value), len(vocabulary))
+
+        for layer in sorted(tree.layer_to_nodes)[1:]:
+            for node in tree.layer_to_nodes[layer]:
+                children = [rows[child] for child in node.children if child in rows]
+                if not children:
+                    continue
+                row = rows[node.index]
+                for field in METADATA_FIELDS:
+                    child_codes = codes[field][children]
+                    if (child_codes == child_codes[0]).all():
+                        codes[field][row] = child_codes[0]
+
+        values = {field: list(vocabularies[field]) for field in METADATA_FIELDS}
+        return cls(node_indices, values, codes)
+
+    def __len__(self) -> int:
+        return len(self.node_indices)
+
+    def get(self, node_index: int) -> Dict[str, str]:
+        """The known metadata fields of a node; unknown nodes have none."""
+        row = int(np.searchsorted(self.node_indices, node_index))
+        if row >= len(self.node_indices) or self.node_indices[row] != node_index:
+            return {}
+        metadata = {}
+        for field, column in self.codes.items():
+            code = int(column[row])
+            if code >= 0:
+                metadata[field] = self.values[field][code]
+        return metadata
+
+    def mask(self, filters: MetadataFilters) -> np.ndarray:
+        """
+        Boolean mask over ``node_indices`` of the nodes matching every filter. A filter value
+        is one accepted value or a sequence of them; nodes with an unknown value never match.
+
+        Raises:
+            ValueError: If a filter names a field outside METADATA_FIELDS.
+        """
+        mask = np.ones(len(self.node_indices), dtype=bool)
+        for field, accepted in filters.items():
+            if field not in METADATA_FIELDS:
+                raise ValueError(
+                    f"Unsupported metadata filter '{field}'. "
+                    f"Supported fields are: {list(METADATA_FIELDS)}"
+                )
+            accepted = [accepted] if isinstance(accepted, str) else list(accepted)
+            vocabulary = {value: code for code, value in enumerate(self.values.get(field, []))}
+            accepted_codes = [vocabulary[value] for value in accepted if value in vocabulary]
+            column = self.codes.get(field)
+            if column is None or not accepted_codes:
+                return np.zeros(len(self.node_indices), dtype=bool)
+            mask &= np.isin(column, accepted_codes)
+        return mask
+
+
+def filters_key(filters: Optional[MetadataFilters]) -> Optional[tuple]:
+    """Canonical hashable form of metadata filters (None when there are none), for cache keys."""
+    if not filters:
+        return None
+    return tuple(
+        sorted(
+            (field, tuple(sorted([accepted] if isinstance(accepted, str) else accepted)))
+            for field, accepted in filters.items()
+        )
+    )
@@ -2,21 +2,45 @@
 
 from __future__ import annotations
 
+import glob
+import hashlib
+import logging
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
 
 try:
-    from ..local_calls import embedding_call  # type: ignore
+    from ..local_calls import (  # type: ignore
+        embedding_call,
+        embedding_model_ready,
+        warm_up_embedding_model,
+    )
 except Exception:  # pragma: no cover - fallback for runtime package usage
     try:
-        from local_calls import embedding_call  # type: ignore
+        from local_calls import (  # type: ignore
+            embedding_call,
+            embedding_model_ready,
+            warm_up_embedding_model,
+        )
     except Exception:  # pragma: no cover - embedding API unavailable
         embedding_call = None  # type: ignore
+        embedding_model_ready = None  # type: ignore
+        warm_up_embedding_model = None  # type: ignore
 
+from .columnar_kb import columnar_version_path, is_columnar_kb, read_columnar_meta
 from .EmbeddingModels import BaseEmbeddingModel
+from .node_metadata import MetadataFilters
 from .QAModels import BaseQAModel
 from .RetrievalAugmentation import RetrievalAugmentation, RetrievalAugmentationConfig
 from .SummarizationModels import BaseSummarizationModel
+from .utils import get_text, reciprocal_rank_fusion
+from .vector_index import MatrixIndex
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_RETRIEVAL_MODES = ["dense", "lexical", "hybrid"]
+SUPPORTED_STRUCTURE_EXPANSIONS = ["parent", "ancestors", "siblings"]
 
 
 class _LocalEmbeddingModel(BaseEmbeddingModel):
@@ -27,6 +51,11 @@ class _LocalEmbeddingModel(BaseEmbeddingModel):
             raise RuntimeError("Local embedding endpoint is not configured.")
         return embedding_call([text])[0]
 
+    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if embedding_call is None:
+            raise RuntimeError("Local embedding endpoint is not configured.")
+        return embedding_call(list(texts))
+
 
 class _NoOpSummarizationModel(BaseSummarizationModel):
     """Summarizer stub to satisfy the pipeline dependencies."""
@@ -42,6 +71,40 @@ class _NoOpQAModel(BaseQAModel):
         return ""
 
 
+def _file_fingerprint(path: Path) -> str:
+    if is_columnar_kb(path):
+        # Hashed once at write time; re-reading the columns would page in the whole KB.
+        return read_columnar_meta(path)["content_hash"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _remove_stale_indexes(kb_path: Path, fingerprint: str) -> None:
+    """Delete the persisted FAISS indexes of other versions of the KB at ``kb_path``."""
+    current = f"{kb_path.name}.{fingerprint[:16]}."
+    for path in kb_path.parent.glob(f"{glob.escape(kb_path.name)}.*.faiss*"):
+        if not path.name.startswith(current):
+            path.unlink(missing_ok=True)
+
+
+def similarity_summary(scores: np.ndarray) -> Optional[dict]:
+    """Statistics of the best-first cosine scores of a query: "top1", "topk" (k-th best),
+    "margin" (top1 - topk), "mean" of the top k and "k"; None without scores."""
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(scores):
+        return None
+    return {
+        "top1": float(scores[0]),
+        "topk": float(scores[-1]),
+        "margin": float(scores[0] - scores[-1]),
+        "mean": float(scores.mean()),
+        "k": int(len(scores)),
+    }
+
+
 class RaptorRagPipeline:
     """Convenience wrapper that loads a pre-built Raptor tree and exposes retrieval helpers."""
 
@@ -50,10 +113,47 @@ class RaptorRagPipeline:
         *,
         index_path: str | Path,
         retriever_top_k: int = 10,
+        index_backend: str = "matrix",
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        persist_index: bool = True,
+        embedding_dtype: Optional[str] = None,
+        rescore_factor: int = 0,
+        first_stage_dims: Optional[int] = None,
+        first_stage_candidates: Optional[int] = None,
+        retrieval_mode: str = "dense",
+        rrf_k: int = 60,
+        fusion_candidates: int = 50,
+        lexical_fallback: bool = True,
+        prf_docs: int = 5,
+        prf_alpha: float = 1.0,
+        prf_beta: float = 0.5,
     ) -> None:
+        if retrieval_mode not in SUPPORTED_RETRIEVAL_MODES:
+            raise ValueError(
+                f"Unsupported retrieval mode '{retrieval_mode}'. "
+                f"Supported modes are: {SUPPORTED_RETRIEVAL_MODES}"
+            )
+
         resolved_path = Path(index_path).expanduser().resolve()
         if not resolved_path.exists():
             raise FileNotFoundError(f"Raptor index not found: {resolved_path}")
+        # Read the fingerprint and the tree from the same version of a columnar KB.
+        tree_path = (
+            columnar_version_path(resolved_path) if is_columnar_kb(resolved_path) else resolved_path
+        )
+
+        fingerprint = _file_fingerprint(tree_path)
+        ann_index_path = None
+        if index_backend != "matrix" and persist_index:
+            # The side indexes (per layer, first stage, question keys) extend this name, so all
+            # of them are tied to this KB version: row positions of an index built for another
+            # version point to other nodes even when the row counts match.
+            ann_index_path = resolved_path.with_name(
+                f"{resolved_path.name}.{fingerprint[:16]}.{index_backend}."
+                f"{embedding_dtype or 'saved'}.faiss"
+            )
+            _remove_stale_indexes(resolved_path, fingerprint)
 
         self._embedding_model = _LocalEmbeddingModel()
         self._config = RetrievalAugmentationConfig(
@@ -61,13 +161,42 @@ class RaptorRagPipeline:
             summarization_model=_NoOpSummarizationModel(),
             qa_model=_NoOpQAModel(),
             tr_top_k=retriever_top_k,
+            tr_index_backend=index_backend,
+            tr_index_path=str(ann_index_path) if ann_index_path is not None else None,
+            tr_nprobe=nprobe,
+            tr_ef_search=ef_search,
+            tr_embedding_dtype=embedding_dtype,
+            tr_rescore_factor=rescore_factor,
+            tr_first_stage_dims=first_stage_dims,
+            tr_first_stage_candidates=first_stage_candidates,
         )
-        self._ra = RetrievalAugmentation(config=self._config, tree=str(resolved_path))
+        self._ra = RetrievalAugmentation(config=self._config, tree=str(tree_path))
         if self._ra.retriever is None:
             raise RuntimeError("Failed to initialize Raptor retriever from index.")
 
         self._retriever = self._ra.retriever
+        searched_index = self._retriever.first_stage_index or self._retriever.index
+        if index_backend != "matrix" and isinstance(searched_index, MatrixIndex):
+            logger.warning(
+                "Index backend '%s' not used for %s: its %d rows are scanned exactly",
+                index_backend,
+                resolved_path.name,
+                searched_index.ntotal,
+            )
+        self._node_indices = self._retriever.node_indices
         self._embedding_key = self._retriever.context_embedding_model
+        self._index_path = resolved_path
+        self._fingerprint = fingerprint
+        self._retrieval_mode = retrieval_mode
+        self._rrf_k = rrf_k
+        self._fusion_candidates = fusion_candidates
+        self._lexical_fallback = lexical_fallback and embedding_model_ready is not None
+        self._prf_docs = prf_docs
+        self._prf_alpha = prf_alpha
+        self._prf_beta = prf_beta
+        if self._lexical_fallback and retrieval_mode != "lexical":
+            # Serve BM25 results while the embedding model loads in the background.
+            warm_up_embedding_model()
 
     @property
     def embedding_model(self) -> _LocalEmbeddingModel:
@@ -77,6 +206,31 @@ class RaptorRagPipeline:
     def embedding_key(self) -> str:
         return self._embedding_key
 
+    @property
+    def index_path(self) -> Path:
+        return self._index_path
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash of the loaded KB artifact; changes whenever the KB is rebuilt."""
+        return self._fingerprint
+
+    @property
+    def active_mode(self) -> str:
+        """Retrieval mode used right now: the configured one, or 'lexical' while the
+        embedding model is still loading and the lexical fallback is enabled."""
+        if (
+            self._retrieval_mode != "lexical"
+            and self._lexical_fallback
+            and not embedding_model_ready()
+        ):
+            return "lexical"
+        return self._retrieval_mode
+
+    def snapshot(self) -> "RaptorRagPipeline":
+        """The pipeline itself: a loaded tree never changes (see ShardedRaptorPipeline)."""
+        return self
+
     def retrieve(
         self,
         query: str,
@@ -84,24 +238,370 @@ class RaptorRagPipeline:
         top_k: Optional[int] = None,
         max_tokens: int = 3500,
         collapse_tree: bool = True,
+        mode: Optional[str] = None,
+        neighbors: int = 0,
+        structure: Optional[str] = None,
+        filters: Optional[MetadataFilters] = None,
     ) -> Tuple[str, List[dict]]:
-        """Return concatenated context and layer metadata for the requested query."""
+        """Return concatenated context and layer metadata for the requested query.
+
+        Lexical and hybrid modes always search the collapsed tree. ``structure`` ("parent",
+        "ancestors" or "siblings") appends the tree context of every hit (see
+        ``_structure_candidates``); ``neighbors`` > 0 then appends up to that many
+        precomputed kNN-graph neighbours of every hit (see ``_neighbor_candidates``).
+        Appended nodes only use the token budget left by the hits.
+
+        ``filters`` maps metadata fields (doc_id, source, section, product, language) to one
+        accepted value or a list of them. They are turned into a bitmask over the nodes
+        before scoring, so only matching nodes are searched (in the collapsed tree) and
+        appended; KBs built without metadata match nothing. Hits carry the known metadata
+        fields of their node.
+        """
         active_top_k = top_k if top_k is not None else self._retriever.top_k
-        return self._retriever.retrieve(
+        mode = self.resolve_mode(mode)
+        if mode != "dense" or filters:
+            (layer_info,), _ = self.retrieve_many(
+                [query],
+                top_k=active_top_k,
+                max_tokens=max_tokens,
+                mode=mode,
+                neighbors=neighbors,
+                structure=structure,
+                filters=filters,
+            )
+            nodes = [self._retriever.tree.all_nodes[hit["node_index"]] for hit in layer_info]
+            return get_text(nodes), layer_info
+
+        context, layer_info = self._retriever.retrieve(
             query,
             top_k=active_top_k,
             max_tokens=max_tokens,
             collapse_tree=collapse_tree,
             return_layer_information=True,
         )
+        for hit in layer_info:
+            hit.update(self.node_metadata(hit["node_index"]))
+        if neighbors <= 0 and structure is None:
+            return context, layer_info
+        layer_info = self._expand(layer_info, neighbors, structure, max_tokens)
+        nodes = [self._retriever.tree.all_nodes[hit["node_index"]] for hit in layer_info]
+        return get_text(nodes), layer_info
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        *,
+        top_k: Optional[int] = None,
+        max_tokens: int = 3500,
+        mode: Optional[str] = None,
+        expand: bool = False,
+        neighbors: int = 0,
+        structure: Optional[str] = None,
+        query_matrix: Optional[np.ndarray] = None,
+        filters: Optional[MetadataFilters] = None,
+    ) -> Tuple[List[List[dict]], List[dict]]:
+        """Retrieve for several queries with one batched embedding pass and one search.
+
+        ``mode`` overrides the configured retrieval mode: "dense" (cosine), "lexical" (BM25)
+        or "hybrid" (both rankings fused with RRF; "score" is then the fused score).
+        ``expand`` applies pseudo-relevance feedback to the query vectors before the dense
+        search (a first search picks the feedback nodes); it does not affect BM25.
+        ``neighbors`` and ``structure`` append related nodes to the hits, as in ``retrieve``.
+        ``query_matrix`` passes already computed query embeddings (see ``embed_queries``),
+        e.g. one embedding pass shared by several KB shards. ``filters`` restricts every
+        search and expansion to the matching nodes, as in ``retrieve``.
+
+        Returns the per-query layer metadata and the pooled hits deduplicated by node,
+        each keeping its best score, ordered by that score.
+        """
+        active_top_k = top_k if top_k is not None else self._retriever.top_k
+        queries = list(queries)
+        mode = self.resolve_mode(mode)
+        if not queries:
+            return [], []
+
+        mask = self._retriever.filter_mask(filters)
+        if mode == "dense":
+            scores, positions = self._retriever.search_embeddings(
+                self._query_matrix(queries, expand, query_matrix, mask), active_top_k, mask
+            )
+            per_query = [
+                self._retriever.layer_information(positions[row], scores[row], max_tokens)
+                for row in range(len(queries))
+            ]
+        elif mode == "lexical":
+            scores, positions = self._retriever.lexical_search(queries, active_top_k, mask)
+            per_query = [
+                self._retriever.layer_information(positions[row], scores[row], max_tokens)
+                for row in range(len(queries))
+            ]
+        else:
+            per_query = self._retrieve_hybrid(
+                queries, active_top_k, max_tokens, expand, query_matrix, mask
+            )
+        if neighbors > 0 or structure is not None:
+            per_query = [
+                self._expand(hits, neighbors, structure, max_tokens, mask) for hits in per_query
+            ]
+
+        pooled: dict = {}
+        for hits in per_query:
+            for hit in hits:
+                existing = pooled.get(hit["node_index"])
+                if existing is None or hit["score"] > existing["score"]:
+                    pooled[hit["node_index"]] = hit
+        merged = sorted(pooled.values(), key=lambda hit: hit["score"], reverse=True)
+        return per_query, merged
+
+    def _expand(
+        self,
+        layer_info: List[dict],
+        neighbors: int,
+        structure: Optional[str],
+        max_tokens: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """Append related nodes of the hits (never of other related nodes); with a filter
+        ``mask`` only matching related nodes."""
+        expanded = layer_info
+        if structure is not None:
+            candidates, relation = self._structure_candidates(layer_info, structure)
+            expanded = self._append_related(expanded, candidates, relation, max_tokens, mask)
+        if neighbors > 0:
+            candidates = self._neighbor_candidates(layer_info, neighbors)
+            expanded = self._append_related(
+                expanded, candidates, "neighbor_of", max_tokens, mask
+            )
+        return expanded
+
+    def _neighbor_candidates(
+        self, layer_info: List[dict], neighbors: int
+    ) -> List[Tuple[float, int, dict]]:
+        """Up to ``neighbors`` precomputed graph neighbours of every hit.
+
+        Neighbours cost a table lookup, no embedding or search. Each one is scored with its
+        source hit's score (1.0 for unscored hits) times their cosine similarity and they are
+        ranked best first. KBs built without a kNN graph have no neighbours.
+        """
+        if not layer_info:
+            return []
+        retriever = self._retriever
+        hit_positions = retriever.node_positions[[hit["node_index"] for hit in layer_info]]
+        similarities, neighbor_positions = retriever.graph_neighbors(hit_positions, neighbors)
+        candidates = [
+            (float(hit.get("score", 1.0)) * float(similarity), int(position), hit)
+            for row, hit in enumerate(layer_info)
+            for similarity, position in zip(similarities[row], neighbor_positions[row])
+            if position >= 0
+        ]
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return candidates
+
+    def _structure_candidates(
+        self, layer_info: List[dict], structure: str
+    ) -> Tuple[List[Tuple[float, int, dict]], str]:
+        """The tree context of every hit through the parent pointers: its "parent"
+        summaries, all its "ancestors" up to the roots (nearest first), or its "siblings"
+        (the other children of its parents). As for neighbours, each related node is scored
+        with its hit's score (1.0 for unscored hits) times their cosine similarity, so it
+        ranks below the hit it was reached from, and candidates are ranked best first.
+        Returns the candidates and the relation they are tagged with ("ancestor_of" /
+        "sibling_of")."""
+        if structure not in SUPPORTED_STRUCTURE_EXPANSIONS:
+            raise ValueError(
+                f"Unsupported structure expansion '{structure}'. "
+                f"Supported expansions are: {SUPPORTED_STRUCTURE_EXPANSIONS}"
+            )
+        retriever = self._retriever
+        candidates = []
+        for hit in layer_info:
+            position = int(retriever.node_positions[hit["node_index"]])
+            if structure == "siblings":
+                related = retriever.sibling_positions(position)
+            else:
+                related = retriever.ancestor_positions(
+                    position, levels=1 if structure == "parent" else -1
+                )
+            if not len(related):
+                continue
+            related = np.asarray(related, dtype=np.int64)
+            store = retriever.embedding_store
+            similarities = store.rows(related) @ store.rows(position)
+            score = float(hit.get("score", 1.0))
+            candidates.extend(
+                (score * float(similarity), int(other), hit)
+                for similarity, other in zip(similarities, related)
+            )
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return candidates, "sibling_of" if structure == "siblings" else "ancestor_of"
+
+    def _append_related(
+        self,
+        layer_info: List[dict],
+        candidates: List[Tuple[float, int, dict]],
+        relation: str,
+        max_tokens: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """Append ranked (score, position, source hit) candidates that are not in
+        ``layer_info`` yet (and are allowed by ``mask``), while the token budget left by it
+        allows; each appended node carries its source's node index under ``relation``."""
+        retriever = self._retriever
+        hit_positions = [retriever.node_positions[hit["node_index"]] for hit in layer_info]
+        seen = set(int(position) for position in hit_positions)
+        unique = []
+        for candidate in candidates:
+            if mask is not None and not mask[candidate[1]]:
+                continue
+            if candidate[1] not in seen:
+                seen.add(candidate[1])
+                unique.append(candidate)
+        if not unique:
+            return layer_info
+
+        used_tokens = sum(
+            len(retriever.tokenizer.encode(retriever.node_list[position].text))
+            for position in hit_positions
+        )
+        expansion = retriever.layer_information(
+            np.asarray([position for _, position, _ in unique], dtype=np.int64),
+            np.asarray([score for score, _, _ in unique], dtype=np.float32),
+            max_tokens - used_tokens,
+        )
+        for extra, (_, _, source) in zip(expansion, unique):
+            extra[relation] = source["node_index"]
+        return [*layer_info, *expansion]
+
+    def resolve_mode(self, mode: Optional[str]) -> str:
+        """The mode a request for ``mode`` (None: the configured one) is served with."""
+        if mode is None:
+            return self.active_mode
+        if mode not in SUPPORTED_RETRIEVAL_MODES:
+            raise ValueError(
+                f"Unsupported retrieval mode '{mode}'. Supported modes are: {SUPPORTED_RETRIEVAL_MODES}"
+            )
+        if mode != "lexical" and self._lexical_fallback and not embedding_model_ready():
+            logger.info("Embedding model not loaded yet; serving %s request lexically.", mode)
+            return "lexical"
+        return mode
+
+    def _query_matrix(
+        self,
+        queries: List[str],
+        expand: bool,
+        query_matrix: Optional[np.ndarray] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        if query_matrix is None:
+            query_matrix = self._retriever.embed_queries(queries)
+        if expand and self._prf_docs > 0:
+            query_matrix = self._retriever.expand_queries(
+                query_matrix,
+                self._prf_docs,
+                alpha=self._prf_alpha,
+                beta=self._prf_beta,
+                mask=mask,
+            )
+        return query_matrix
+
+    def _retrieve_hybrid(
+        self,
+        queries: List[str],
+        top_k: int,
+        max_tokens: int,
+        expand: bool = False,
+        query_matrix: Optional[np.ndarray] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[List[dict]]:
+        depth = max(top_k, self._fusion_candidates)
+        query_matrix = self._query_matrix(queries, expand, query_matrix, mask)
+        _, dense_positions = self._retriever.search_embeddings(query_matrix, depth, mask)
+        _, lexical_positions = self._retriever.lexical_search(queries, depth, mask)
+
+        per_query = []
+        for row in range(len(queries)):
+            scores, positions = reciprocal_rank_fusion(
+                [dense_positions[row], lexical_positions[row]], top_k, k=self._rrf_k
+            )
+            per_query.append(self._retriever.layer_information(positions, scores, max_tokens))
+        return per_query
+
+    def similarity_stats(self, query: str, top_k: int = 10) -> Optional[dict]:
+        """Dense cosine statistics of the query against the whole tree, independent of the
+        retrieval mode (see ``similarity_summary``). Returns None while the embedding model
+        is not available."""
+        if self._lexical_fallback and not embedding_model_ready():
+            return None
+        scores, node_indices = self.dense_search(self._retriever.embed_queries([query]), top_k)
+        return similarity_summary(scores[0][node_indices[0] >= 0])
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Unit-length query embeddings, one row per query."""
+        return self._retriever.embed_queries(list(queries))
+
+    def dense_search(
+        self, query_matrix: np.ndarray, top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Cosine search of already embedded queries over the collapsed tree: scores and
+        node indices per query, best first; missing results have node index -1."""
+        scores, positions = self._retriever.search_embeddings(query_matrix, top_k)
+        node_indices = np.where(
+            positions >= 0, self._node_indices[np.maximum(positions, 0)], -1
+        )
+        return scores, node_indices
+
+    def query_embedding(self, query: str) -> Optional[np.ndarray]:
+        """Normalized float32 query embedding, or None while the embedding model is loading."""
+        if self._lexical_fallback and not embedding_model_ready():
+            return None
+        return self._retriever.embed_queries([query])[0]
+
+    def rescore(
+        self,
+        queries: List[str],
+        node_indices: Sequence[int],
+        query_matrix: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Best cosine similarity over ``queries`` for each node, computed with the embeddings
+        at the precision the KB was saved with (not the compressed search copy)."""
+        if not len(node_indices):
+            return np.zeros(0, dtype=np.float32)
+        if query_matrix is None:
+            query_matrix = self._retriever.embed_queries(list(queries))
+        positions = self._retriever.node_positions[np.asarray(node_indices, dtype=np.int64)]
+        node_matrix = self._retriever.exact_embeddings(positions)
+        return (node_matrix @ query_matrix.T).max(axis=1)
 
     def node_text(self, node_index: int) -> str:
         return self._retriever.tree.all_nodes[node_index].text
 
-    def node_embedding(self, node_index: int) -> Optional[List[float]]:
+    def node_tokens(self, node_index: int) -> int:
+        return len(self._retriever.tokenizer.encode(self.node_text(node_index)))
+
+    def node_embedding(self, node_index: int) -> Optional[Sequence[float]]:
         embeddings = self._retriever.tree.all_nodes[node_index].embeddings
         return embeddings.get(self._embedding_key)
 
+    def node_metadata(self, node_index: int) -> Dict[str, str]:
+        """Known provenance fields of a node (doc_id, source, section, product, language);
+        empty for KBs built without metadata."""
+        return self._retriever.node_provenance(node_index)
+
+    def node_sentences(self, node_index: int) -> Optional[Tuple[List[str], np.ndarray]]:
+        """Sentences of a node with their embeddings, or None if the KB has no sentence store."""
+        store = getattr(self._retriever.tree, "sentence_store", None)
+        if store is None or not len(store):
+            return None
+        return store.sentences(node_index)
+
+    def node_descendants(self, node_index: int) -> Set[int]:
+        """Indices of all nodes summarized (directly or transitively) by the given node."""
+        positions = self._retriever.node_positions
+        if not 0 <= node_index < len(positions) or positions[node_index] < 0:
+            return set()
+        descendants = self._retriever.descendant_positions(positions[[node_index]])
+        return {self._retriever.node_list[position].index for position in descendants}
+
     def iter_nodes(self, node_indices: Iterable[int]):
         tree = self._retriever.tree.all_nodes
         for idx in node_indices:
@@ -0,0 +1,114 @@
+import re
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from .tree_structures import Node
+from .utils import normalize_rows
+
+# split_text drops the sentence delimiters and joins sentences with a space, so a former
+# sentence boundary shows up as a double space; real punctuation and newlines also split.
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n+|\s{2,}")
+
+
+def split_sentences(text: str, max_words: int = 40) -> List[str]:
+    """
+    Splits node text into sentence units. Units longer than ``max_words`` words are cut
+    into consecutive word windows so every unit stays small enough to be scored alone.
+
+    Args:
+        text (str): The node text.
+        max_words (int): The maximum number of words per unit.
+
+    Returns:
+        List[str]: The non-empty sentence units in reading order.
+    """
+    units = []
+    for sentence in _SENTENCE_BOUNDARY.split(text or ""):
+        words = sentence.split()
+        for start in range(0, len(words), max_words):
+            units.append(" ".join(words[start : start + max_words]))
+    return units
+
+
+class SentenceStore:
+    """
+    Sentence-level sub-embeddings of tree nodes. Identical sentences are stored once;
+    the sentences of the node ``node_indices[i]`` are
+    ``sentence_ids[indptr[i]:indptr[i + 1]]`` in reading order.
+    """
+
+    def __init__(
+        self,
+        texts: List[str],
+        embeddings: np.ndarray,
+        node_indices: np.ndarray,
+        indptr: np.ndarray,
+        sentence_ids: np.ndarray,
+    ) -> None:
+        self.texts = texts
+        self.embeddings = embeddings
+        self.node_indices = node_indices
+        self.indptr = indptr
+        self.sentence_ids = sentence_ids
+
+    @classmethod
+    def build(
+        cls,
+        node_list: List[Node],
+        embed: Callable[[List[str]], List[List[float]]],
+        batch_size: int = 64,
+        dtype: str = "float32",
+    ) -> "SentenceStore":
+        """
+        Splits every node into sentences and embeds each distinct sentence once.
+
+        Args:
+            node_list (List[Node]): The nodes to cover.
+            embed (Callable): Batched embedding function, texts -> vectors.
+            batch_size (int): Sentences per embedding call.
+            dtype (str): 'float32' or 'float16' storage of the sentence embeddings.
+
+        Returns:
+            SentenceStore: The populated store.
+        """
+        sentence_to_id: Dict[str, int] = {}
+        nodes = sorted(node_list, key=lambda node: node.index)
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        sentence_ids: List[int] = []
+        for position, node in enumerate(nodes):
+            for sentence in split_sentences(node.text):
+                sentence_ids.append(sentence_to_id.setdefault(sentence, len(sentence_to_id)))
+            indptr[position + 1] = len(sentence_ids)
+
+        texts = list(sentence_to_id)
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embed(texts[start : start + batch_size]))
+        embeddings = (
+            normalize_rows(np.asarray(vectors, dtype=np.float32))
+            if vectors
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+
+        return cls(
+            texts,
+            embeddings.astype(np.float16 if dtype == "float16" else np.float32),
+            np.asarray([node.index for node in nodes], dtype=np.int64),
+            indptr,
+            np.asarray(sentence_ids, dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def sentences(self, node_index: int) -> Tuple[List[str], np.ndarray]:
+        """
+        Returns the sentences of a node and their float32 embeddings, in reading order.
+        Unknown nodes yield no sentences.
+        """
+        position = int(np.searchsorted(self.node_indices, node_index))
+        if position >= len(self.node_indices) or self.node_indices[position] != node_index:
+            return [], np.zeros((0, self.embeddings.shape[1]), dtype=np.float32)
+        ids = self.sentence_ids[self.indptr[position] : self.indptr[position + 1]]
+        return [self.texts[i] for i in ids], self.embeddings[ids].astype(np.float32)
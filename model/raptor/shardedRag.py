@@ -0,0 +1,521 @@
+"""Sharded Raptor knowledge base: a JSON manifest of independently rebuilt tree shards."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .columnar_kb import columnar_version_path
+from .node_metadata import MetadataFilters
+from .raptorRag import RaptorRagPipeline, similarity_summary
+from .utils import get_text
+
+logger = logging.getLogger(__name__)
+
+# Global node ids are ``shard_id * SHARD_ID_STRIDE + node_index``, shard_id being the stable id
+# the manifest records for the shard, so chunk ids of different shards never collide and keep
+# naming the same shard when other shards are added, removed or reordered.
+SHARD_ID_STRIDE = 1 << 32
+
+# Hit keys holding node indices that must be translated to global ids.
+_NODE_KEYS = ("node_index", "neighbor_of", "ancestor_of", "sibling_of")
+_RELATION_KEYS = _NODE_KEYS[1:]
+
+
+def read_manifest(manifest_path: str | Path) -> List[Tuple[str, Path, int]]:
+    """Shard names, resolved tree paths and shard ids listed in a manifest, in manifest order.
+
+    The manifest is ``{"shards": [{"name": ..., "path": ..., "id": ...}, ...]}``; relative
+    paths are resolved against the manifest's directory. An entry without an "id" (manifests
+    written before ids were recorded) gets its position.
+    """
+    manifest_path = Path(manifest_path).expanduser().resolve()
+    data = json.loads(manifest_path.read_text(encoding="utf-8"))
+    shards: List[Tuple[str, Path, int]] = []
+    for position, entry in enumerate(data.get("shards", [])):
+        name = str(entry["name"])
+        shard_id = int(entry.get("id", position))
+        if any(existing == name for existing, _, _ in shards):
+            raise ValueError(f"Duplicate shard name '{name}' in {manifest_path}")
+        if any(existing == shard_id for _, _, existing in shards):
+            raise ValueError(f"Duplicate shard id {shard_id} in {manifest_path}")
+        if not 0 <= shard_id < SHARD_ID_STRIDE:
+            raise ValueError(f"Invalid id {shard_id} of shard '{name}' in {manifest_path}")
+        path = Path(entry["path"]).expanduser()
+        shards.append((name, (manifest_path.parent / path).resolve(), shard_id))
+    return shards
+
+
+def register_shard(manifest_path: str | Path, name: str, shard_path: str | Path) -> None:
+    """Add or update a shard entry in the manifest (created if missing), atomically.
+
+    A new shard gets the next unused id; an existing one keeps its id (see SHARD_ID_STRIDE).
+    """
+    manifest_path = Path(manifest_path).expanduser().resolve()
+    data: Dict[str, Any] = {"shards": []}
+    if manifest_path.exists():
+        data = json.loads(manifest_path.read_text(encoding="utf-8"))
+    shard_path = Path(shard_path).expanduser().resolve()
+    try:
+        stored_path = os.path.relpath(shard_path, manifest_path.parent)
+    except ValueError:  # pragma: no cover - different drive on Windows
+        stored_path = str(shard_path)
+
+    entries = [
+        {**entry, "id": int(entry.get("id", position))}
+        for position, entry in enumerate(data.get("shards", []))
+    ]
+    existing = next((entry for entry in entries if entry.get("name") == name), None)
+    shards = [entry for entry in entries if entry is not existing]
+    if existing is not None:
+        position, shard_id = entries.index(existing), existing["id"]
+    else:
+        position = len(shards)
+        shard_id = max((entry["id"] for entry in entries), default=-1) + 1
+    shards.insert(position, {"name": name, "path": stored_path, "id": shard_id})
+    data["shards"] = shards
+
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path.replace(manifest_path)
+
+
+def _file_signature(path: Path) -> Tuple[int, int, int]:
+    # Every version of a columnar KB has its own meta.json, which identifies it.
+    stat = (columnar_version_path(path) / "meta.json").stat() if path.is_dir() else path.stat()
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+@dataclass
+class _Shard:
+    name: str
+    shard_id: int
+    path: Path
+    signature: Tuple[int, int, int]
+    pipeline: RaptorRagPipeline
+
+
+# The served shards by shard id, in manifest order; never mutated once built.
+_Snapshot = Dict[int, _Shard]
+
+
+class ShardSnapshot:
+    """
+    The shards a ShardedRaptorPipeline served at one point in time, with their fingerprint.
+
+    ``refresh`` replaces the pipeline's snapshot as a whole and never mutates one, so a caller
+    that holds a snapshot resolves node ids, texts and the fingerprint against exactly the
+    shards its search ran on. Exposes the retrieval interface of RaptorRagPipeline.
+    """
+
+    def __init__(
+        self,
+        shards: _Snapshot,
+        fingerprint: str,
+        executor: ThreadPoolExecutor,
+        default_top_k: int,
+    ) -> None:
+        self._shards = shards
+        self._fingerprint = fingerprint
+        self._executor = executor
+        self._default_top_k = default_top_k
+
+    @property
+    def shard_names(self) -> List[str]:
+        return [shard.name for shard in self._shards.values()]
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the shard names and their KB fingerprints; changes when any shard does."""
+        return self._fingerprint
+
+    @property
+    def active_mode(self) -> str:
+        return _first(self._shards).pipeline.active_mode
+
+    def snapshot(self) -> "ShardSnapshot":
+        return self
+
+    def _fan_out(self, call: Callable[[RaptorRagPipeline], Any]) -> List[Any]:
+        """``call`` on every shard pipeline, results in snapshot order."""
+        if len(self._shards) == 1:
+            return [call(_first(self._shards).pipeline)]
+        return list(
+            self._executor.map(lambda shard: call(shard.pipeline), self._shards.values())
+        )
+
+    def _locate(self, node_id: int) -> Tuple[_Shard, int]:
+        shard_id, node_index = divmod(int(node_id), SHARD_ID_STRIDE)
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            raise KeyError(f"Unknown Raptor KB node id {node_id}")
+        return shard, node_index
+
+    @staticmethod
+    def _globalize(hit: dict, shard: _Shard) -> dict:
+        hit = dict(hit)
+        for key in _NODE_KEYS:
+            if key in hit:
+                hit[key] = shard.shard_id * SHARD_ID_STRIDE + int(hit[key])
+        hit["shard"] = shard.name
+        return hit
+
+    def _merge_hits(self, shard_hits: List[List[dict]], top_k: int, max_tokens: int) -> List[dict]:
+        """Merge per-shard hit lists (in snapshot order): the best ``top_k`` direct hits over
+        all shards by score, then the related nodes appended to them, all within ``max_tokens``.
+
+        Cosine and RRF scores are comparable across shards; BM25 scores use per-shard
+        statistics, as in any distributed index without a global IDF pass.
+        """
+        hits = [
+            self._globalize(hit, shard)
+            for shard, per_shard in zip(self._shards.values(), shard_hits)
+            for hit in per_shard
+        ]
+
+        direct = sorted(
+            (hit for hit in hits if not any(key in hit for key in _RELATION_KEYS)),
+            key=lambda hit: hit.get("score", 0.0),
+            reverse=True,
+        )
+        merged: List[dict] = []
+        budget = max_tokens
+        for hit in direct[:top_k]:
+            tokens = self.node_tokens(hit["node_index"])
+            if tokens > budget:
+                break
+            merged.append(hit)
+            budget -= tokens
+
+        selected = {hit["node_index"] for hit in merged}
+        for hit in hits:
+            source = next((hit[key] for key in _RELATION_KEYS if key in hit), None)
+            if source is None or source not in selected or hit["node_index"] in selected:
+                continue
+            tokens = self.node_tokens(hit["node_index"])
+            if tokens > budget:
+                continue
+            merged.append(hit)
+            selected.add(hit["node_index"])
+            budget -= tokens
+        return merged
+
+    def retrieve(
+        self,
+        query: str,
+        *,
+        top_k: Optional[int] = None,
+        max_tokens: int = 3500,
+        collapse_tree: bool = True,
+        mode: Optional[str] = None,
+        neighbors: int = 0,
+        structure: Optional[str] = None,
+        filters: Optional[MetadataFilters] = None,
+    ) -> Tuple[str, List[dict]]:
+        """Return concatenated context and merged layer metadata over all shards.
+
+        Shards are always searched as collapsed trees; ``collapse_tree`` is accepted for
+        compatibility with RaptorRagPipeline.retrieve and ignored.
+        """
+        (layer_info,), _ = self.retrieve_many(
+            [query],
+            top_k=top_k,
+            max_tokens=max_tokens,
+            mode=mode,
+            neighbors=neighbors,
+            structure=structure,
+            filters=filters,
+        )
+        nodes = []
+        for hit in layer_info:
+            shard, node_index = self._locate(hit["node_index"])
+            nodes.extend(node for _, node in shard.pipeline.iter_nodes([node_index]))
+        return get_text(nodes), layer_info
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        *,
+        top_k: Optional[int] = None,
+        max_tokens: int = 3500,
+        mode: Optional[str] = None,
+        expand: bool = False,
+        neighbors: int = 0,
+        structure: Optional[str] = None,
+        query_matrix: Optional[np.ndarray] = None,
+        filters: Optional[MetadataFilters] = None,
+    ) -> Tuple[List[List[dict]], List[dict]]:
+        """RaptorRagPipeline.retrieve_many over every shard with one embedding pass (or the
+        given ``query_matrix``); every shard applies the metadata ``filters`` to its own nodes."""
+        queries = list(queries)
+        if not queries:
+            return [], []
+        first = _first(self._shards).pipeline
+        mode = first.resolve_mode(mode)
+        if mode != "lexical" and query_matrix is None:
+            query_matrix = first.embed_queries(queries)
+        active_top_k = top_k if top_k is not None else self._default_top_k
+
+        results = self._fan_out(
+            lambda pipeline: pipeline.retrieve_many(
+                queries,
+                top_k=active_top_k,
+                max_tokens=max_tokens,
+                mode=mode,
+                expand=expand,
+                neighbors=neighbors,
+                structure=structure,
+                query_matrix=query_matrix,
+                filters=filters,
+            )[0],
+        )
+        per_query = [
+            self._merge_hits([result[row] for result in results], active_top_k, max_tokens)
+            for row in range(len(queries))
+        ]
+
+        pooled: dict = {}
+        for hits in per_query:
+            for hit in hits:
+                existing = pooled.get(hit["node_index"])
+                if existing is None or hit.get("score", 0.0) > existing.get("score", 0.0):
+                    pooled[hit["node_index"]] = hit
+        merged = sorted(pooled.values(), key=lambda hit: hit.get("score", 0.0), reverse=True)
+        return per_query, merged
+
+    def similarity_stats(self, query: str, top_k: int = 10) -> Optional[dict]:
+        """Dense similarity statistics of the query over the union of all shards."""
+        query_vector = self.query_embedding(query)
+        if query_vector is None:
+            return None
+        results = self._fan_out(
+            lambda pipeline: pipeline.dense_search(query_vector[np.newaxis, :], top_k)
+        )
+        scores = np.concatenate(
+            [shard_scores[0][node_indices[0] >= 0] for shard_scores, node_indices in results]
+        )
+        return similarity_summary(np.sort(scores)[::-1][:top_k])
+
+    def query_embedding(self, query: str) -> Optional[np.ndarray]:
+        return _first(self._shards).pipeline.query_embedding(query)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return _first(self._shards).pipeline.embed_queries(queries)
+
+    def rescore(
+        self,
+        queries: List[str],
+        node_indices: Sequence[int],
+        query_matrix: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Full-precision rescoring of global node ids, embedding the queries once (unless
+        ``query_matrix`` is given)."""
+        scores = np.zeros(len(node_indices), dtype=np.float32)
+        if not len(node_indices):
+            return scores
+        if query_matrix is None:
+            query_matrix = self.embed_queries(list(queries))
+        by_shard: Dict[int, List[int]] = {}
+        for position, node_id in enumerate(node_indices):
+            by_shard.setdefault(int(node_id) // SHARD_ID_STRIDE, []).append(position)
+        for shard_id, positions in by_shard.items():
+            shard, _ = self._locate(shard_id * SHARD_ID_STRIDE)
+            local = [int(node_indices[position]) % SHARD_ID_STRIDE for position in positions]
+            scores[positions] = shard.pipeline.rescore(queries, local, query_matrix=query_matrix)
+        return scores
+
+    def node_text(self, node_index: int) -> str:
+        shard, local = self._locate(node_index)
+        return shard.pipeline.node_text(local)
+
+    def node_tokens(self, node_index: int) -> int:
+        shard, local = self._locate(node_index)
+        return shard.pipeline.node_tokens(local)
+
+    def node_embedding(self, node_index: int) -> Optional[Sequence[float]]:
+        shard, local = self._locate(node_index)
+        return shard.pipeline.node_embedding(local)
+
+    def node_metadata(self, node_index: int) -> Dict[str, str]:
+        shard, local = self._locate(node_index)
+        return shard.pipeline.node_metadata(local)
+
+    def node_sentences(self, node_index: int):
+        shard, local = self._locate(node_index)
+        return shard.pipeline.node_sentences(local)
+
+    def node_descendants(self, node_index: int) -> Set[int]:
+        shard, local = self._locate(node_index)
+        offset = shard.shard_id * SHARD_ID_STRIDE
+        return {offset + index for index in shard.pipeline.node_descendants(local)}
+
+
+class ShardedRaptorPipeline:
+    """
+    Serves several Raptor trees listed in a manifest as one knowledge base.
+
+    Queries are embedded once and fanned out to all shards on a thread pool; the per-shard
+    hit lists are merged by score. Shards are (re)loaded independently: ``refresh`` only
+    reloads the shards whose tree file changed, so rebuilding one department's KB leaves the
+    others loaded. Node indices are global ids (see ``SHARD_ID_STRIDE``); hits carry their
+    "shard" name.
+
+    The served shards and their fingerprint are one ShardSnapshot, which ``refresh`` swaps in
+    a single assignment. Every method works on the snapshot current when it was called;
+    callers that resolve the node ids of a search later (texts, rescoring, packing) take
+    ``snapshot()`` once and use it throughout. Exposes the retrieval interface of
+    RaptorRagPipeline used by the tools.
+    """
+
+    def __init__(
+        self, *, manifest_path: str | Path, max_workers: int = 4, **pipeline_kwargs: Any
+    ) -> None:
+        self._manifest_path = Path(manifest_path).expanduser().resolve()
+        if not self._manifest_path.exists():
+            raise FileNotFoundError(f"Raptor KB manifest not found: {self._manifest_path}")
+        self._pipeline_kwargs = pipeline_kwargs
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="raptor-shard"
+        )
+        self._lock = Lock()
+        self._snapshot = self._make_snapshot({})
+        self.refresh()
+        if not self._snapshot.shard_names:
+            raise RuntimeError(f"No Raptor KB shard could be loaded from {self._manifest_path}")
+
+    def _make_snapshot(self, shards: _Snapshot) -> ShardSnapshot:
+        digest = hashlib.sha256()
+        for shard in shards.values():
+            digest.update(
+                f"{shard.name}\0{shard.shard_id}\0{shard.pipeline.fingerprint}\0".encode("utf-8")
+            )
+        return ShardSnapshot(
+            shards,
+            digest.hexdigest(),
+            self._executor,
+            self._pipeline_kwargs.get("retriever_top_k", 10),
+        )
+
+    @property
+    def manifest_path(self) -> Path:
+        return self._manifest_path
+
+    def snapshot(self) -> ShardSnapshot:
+        """The shards served right now; unaffected by later refreshes."""
+        return self._snapshot
+
+    @property
+    def shard_names(self) -> List[str]:
+        return self._snapshot.shard_names
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the shard names and their KB fingerprints; changes when any shard does."""
+        return self._snapshot.fingerprint
+
+    @property
+    def active_mode(self) -> str:
+        return self._snapshot.active_mode
+
+    def refresh(self) -> bool:
+        """Re-read the manifest and load new or changed shards; unchanged shards are kept.
+
+        A shard that fails to load keeps its previous version (if any). Returns True when
+        the set of served trees changed.
+        """
+        with self._lock:
+            served = self._snapshot._shards
+            previous = {shard.name: shard for shard in served.values()}
+            shards: _Snapshot = {}
+            for name, path, shard_id in read_manifest(self._manifest_path):
+                current = previous.get(name)
+                if current is not None and current.shard_id != shard_id:
+                    # Its global ids changed; the loaded pipeline can be kept under the new id.
+                    current = _Shard(
+                        name, shard_id, current.path, current.signature, current.pipeline
+                    )
+                if not path.exists():
+                    logger.warning("Raptor KB shard '%s' missing at %s", name, path)
+                    if current is not None:
+                        shards[shard_id] = current
+                    continue
+                signature = _file_signature(path)
+                if current is not None and current.path == path and current.signature == signature:
+                    shards[shard_id] = current
+                    continue
+                try:
+                    pipeline = RaptorRagPipeline(index_path=path, **self._pipeline_kwargs)
+                except Exception as exc:
+                    logger.warning("Raptor KB shard '%s' failed to load: %s", name, exc)
+                    if current is not None:
+                        shards[shard_id] = current
+                    continue
+                logger.info("Loaded Raptor KB shard '%s' from %s", name, path)
+                shards[shard_id] = _Shard(name, shard_id, path, signature, pipeline)
+
+            changed = _served(shards) != _served(served)
+            self._snapshot = self._make_snapshot(shards)
+            return changed
+
+    def retrieve(self, query: str, **kwargs: Any) -> Tuple[str, List[dict]]:
+        """ShardSnapshot.retrieve on the current snapshot."""
+        return self._snapshot.retrieve(query, **kwargs)
+
+    def retrieve_many(
+        self, queries: List[str], **kwargs: Any
+    ) -> Tuple[List[List[dict]], List[dict]]:
+        """ShardSnapshot.retrieve_many on the current snapshot."""
+        return self._snapshot.retrieve_many(queries, **kwargs)
+
+    def similarity_stats(self, query: str, top_k: int = 10) -> Optional[dict]:
+        return self._snapshot.similarity_stats(query, top_k)
+
+    def query_embedding(self, query: str) -> Optional[np.ndarray]:
+        return self._snapshot.query_embedding(query)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return self._snapshot.embed_queries(queries)
+
+    def rescore(
+        self,
+        queries: List[str],
+        node_indices: Sequence[int],
+        query_matrix: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        return self._snapshot.rescore(queries, node_indices, query_matrix)
+
+    def node_text(self, node_index: int) -> str:
+        return self._snapshot.node_text(node_index)
+
+    def node_tokens(self, node_index: int) -> int:
+        return self._snapshot.node_tokens(node_index)
+
+    def node_embedding(self, node_index: int) -> Optional[Sequence[float]]:
+        return self._snapshot.node_embedding(node_index)
+
+    def node_metadata(self, node_index: int) -> Dict[str, str]:
+        return self._snapshot.node_metadata(node_index)
+
+    def node_sentences(self, node_index: int):
+        return self._snapshot.node_sentences(node_index)
+
+    def node_descendants(self, node_index: int) -> Set[int]:
+        return self._snapshot.node_descendants(node_index)
+
+
+def _first(shards: _Snapshot) -> _Shard:
+    return next(iter(shards.values()))
+
+
+def _served(shards: _Snapshot) -> List[Tuple[int, str, RaptorRagPipeline]]:
+    return [(shard.shard_id, shard.name, shard.pipeline) for shard in shards.values()]
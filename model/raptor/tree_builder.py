@@ -4,7 +4,7 @@ import os
 from abc import abstractclassmethod
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 
 # убрал import openai
 import tiktoken
@@ -15,11 +15,23 @@ from .SummarizationModels import (BaseSummarizationModel,
                                   GPT3TurboSummarizationModel)
 from .tree_structures import Node, Tree
 from .utils import (distances_from_embeddings, get_children, get_embeddings,
-                    get_node_list, get_text,
-                    indices_of_nearest_neighbors_from_distances, split_text)
+                    get_embedding_matrix, get_node_list, get_text,
+                    indices_of_nearest_neighbors_from_distances, normalize_rows,
+                    split_text)
 # убрал логирование logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
 
+class TreeUpdate(NamedTuple):
+    """Outcome of ``TreeBuilder.update_from_chunks``."""
+
+    tree: Tree
+    leaf_indices: List[int]  # node index of the leaf of every chunk, in chunk order
+    added: int
+    removed: int
+    resummarized: int
+    rebuilt: bool  # the tree was re-clustered from scratch
+
+
 class TreeBuilderConfig:
     def __init__(
         self,
@@ -265,6 +277,20 @@ class TreeBuilder:
             Tree: The golden tree structure.
         """
         chunks = split_text(text, self.tokenizer, self.max_tokens)
+        return self.build_from_chunks(chunks, use_multithreading=use_multithreading)
+
+    def build_from_chunks(self, chunks: List[str], use_multithreading: bool = True) -> Tree:
+        """Builds a golden tree whose leaves are the given, already split chunks: leaf i is
+        ``chunks[i]``, so callers can keep track of where every leaf came from.
+
+        Args:
+            chunks (List[str]): The leaf texts.
+            use_multithreading (bool, optional): Whether to use multithreading when creating leaf nodes.
+                Default: True.
+
+        Returns:
+            Tree: The golden tree structure.
+        """
 # убрал логирование logging.info("Creating Leaf Nodes")
 
         if use_multithreading:
@@ -287,6 +313,203 @@ class TreeBuilder:
 
         return tree
 
+    def create_nodes(
+        self,
+        texts: Dict[int, str],
+        children: Optional[Dict[int, Set[int]]] = None,
+        use_multithreading: bool = True,
+    ) -> Dict[int, Node]:
+        """Creates (embeds) the nodes with the given indices and texts, optionally in threads.
+
+        Args:
+            texts (Dict[int, str]): Text of every node by index.
+            children (Optional[Dict[int, Set[int]]]): Children indices of every node; none by default.
+            use_multithreading (bool, optional): Whether to use multithreading. Default: True.
+
+        Returns:
+            Dict[int, Node]: The created nodes by index.
+        """
+        children = children or {}
+        if not use_multithreading:
+            return {
+                index: self.create_node(index, text, children.get(index))[1]
+                for index, text in texts.items()
+            }
+        with ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(self.create_node, index, text, children.get(index))
+                for index, text in texts.items()
+            ]
+            return dict(future.result() for future in futures)
+
+    def update_from_chunks(
+        self,
+        tree: Tree,
+        chunks: List[str],
+        drift_threshold: float = 0.2,
+        use_multithreading: bool = True,
+    ) -> TreeUpdate:
+        """Updates a built tree so that its leaves are ``chunks``, without re-clustering it.
+
+        Leaves whose text is in ``chunks`` are kept as they are. Chunks without a leaf are
+        embedded and attached to the nearest layer-1 node; leaves no longer in ``chunks``
+        are detached. Only the summaries above a changed node are re-summarized and
+        re-embedded, layer by layer, and a summary left without children is dropped. Node
+        indices of kept nodes do not change; new nodes take indices after the largest one.
+
+        Every update adds its changed-leaf fraction to ``tree.update_drift``. Once that
+        drift would exceed ``drift_threshold`` (or the tree has no summary layer) the
+        tree is rebuilt from ``chunks`` with ``build_from_chunks``, which resets it.
+
+        Optional attributes of ``tree`` (lexical index, question keys, ...) are not carried
+        over: they describe the previous nodes.
+
+        Args:
+            tree (Tree): The tree to update; it is left unchanged (unchanged Node objects
+                are shared with the updated tree).
+            chunks (List[str]): The leaf texts of the updated tree.
+            drift_threshold (float, optional): Cumulative changed-leaf fraction that
+                triggers a rebuild. Default: 0.2.
+            use_multithreading (bool, optional): Whether to use multithreading when creating nodes.
+                Default: True.
+
+        Returns:
+            TreeUpdate: The updated tree, the leaf of every chunk and what changed.
+
+        Raises:
+            ValueError: If ``chunks`` is empty.
+        """
+        if not chunks:
+            raise ValueError("Cannot update a tree to no chunks")
+        layer_of = {
+            node.index: layer
+            for layer, layer_nodes in tree.layer_to_nodes.items()
+            for node in layer_nodes
+        }
+        nodes = {index: node for index, node in tree.all_nodes.items()}
+
+        leaves_by_text: Dict[str, List[int]] = {}
+        for index in sorted(index for index, layer in layer_of.items() if layer == 0):
+            leaves_by_text.setdefault(nodes[index].text, []).append(index)
+        leaf_indices: List[Optional[int]] = []
+        for chunk in chunks:
+            same_text = leaves_by_text.get(chunk)
+            leaf_indices.append(same_text.pop(0) if same_text else None)
+        removed = [index for indices in leaves_by_text.values() for index in indices]
+        added = sum(index is None for index in leaf_indices)
+
+        num_leaves = sum(layer == 0 for layer in layer_of.values())
+        drift = (getattr(tree, "update_drift", None) or 0.0) + (added + len(removed)) / max(
+            1, num_leaves
+        )
+        summaries = [index for index, layer in layer_of.items() if layer == 1]
+        if drift > drift_threshold or not summaries:
+            rebuilt = self.build_from_chunks(chunks, use_multithreading=use_multithreading)
+            return TreeUpdate(rebuilt, list(range(len(chunks))), added, len(removed), 0, True)
+
+        parents: Dict[int, Set[int]] = {}
+        for node in nodes.values():
+            for child in node.children:
+                parents.setdefault(child, set()).add(node.index)
+        dirty: Set[int] = set()
+        # Nodes of ``tree`` are shared with the caller: copy one before changing its children.
+        copied: Set[int] = set()
+
+        def children_of(index: int) -> Set[int]:
+            if index not in copied:
+                node = nodes[index]
+                nodes[index] = Node(node.text, node.index, set(node.children), node.embeddings)
+                copied.add(index)
+            return nodes[index].children
+
+        for index in removed:
+            for parent in parents.pop(index, ()):
+                children_of(parent).discard(index)
+                dirty.add(parent)
+            del nodes[index], layer_of[index]
+
+        next_index = max(nodes) + 1
+        new_texts = {}
+        for position, chunk in enumerate(chunks):
+            if leaf_indices[position] is None:
+                leaf_indices[position] = next_index
+                new_texts[next_index] = chunk
+                next_index += 1
+        new_leaves = self.create_nodes(new_texts, use_multithreading=use_multithreading)
+        if new_leaves:
+            summary_nodes = [nodes[index] for index in sorted(summaries)]
+            centroids = normalize_rows(
+                get_embedding_matrix(summary_nodes, self.cluster_embedding_model)
+            )
+            leaf_nodes = [new_leaves[index] for index in sorted(new_leaves)]
+            similarity = normalize_rows(
+                get_embedding_matrix(leaf_nodes, self.cluster_embedding_model)
+            ) @ centroids.T
+            for leaf, row in zip(leaf_nodes, similarity):
+                parent = summary_nodes[int(row.argmax())].index
+                children_of(parent).add(leaf.index)
+                parents[leaf.index] = {parent}
+                nodes[leaf.index] = leaf
+                layer_of[leaf.index] = 0
+                dirty.add(parent)
+
+        resummarized = 0
+        layer = 1
+        while dirty:
+            current = {index for index in dirty if layer_of[index] == layer}
+            dirty -= current
+            texts, children = {}, {}
+            for index in sorted(current):
+                node = nodes[index]
+                if not node.children:
+                    for parent in parents.pop(index, ()):
+                        children_of(parent).discard(index)
+                        dirty.add(parent)
+                    del nodes[index], layer_of[index]
+                    continue
+                children[index] = set(node.children)
+                texts[index] = get_text([nodes[child] for child in sorted(node.children)])
+            if texts:
+                summaries_by_index = self._summarize_many(texts, use_multithreading)
+                nodes.update(
+                    self.create_nodes(summaries_by_index, children, use_multithreading)
+                )
+                resummarized += len(texts)
+                for index in texts:
+                    dirty.update(parents.get(index, ()))
+            layer += 1
+
+        num_layers = max(layer_of.values())
+        layer_to_nodes = {layer: [] for layer in range(num_layers + 1)}
+        for index in sorted(nodes):
+            layer_to_nodes[layer_of[index]].append(nodes[index])
+        updated = Tree(
+            nodes,
+            {node.index: node for node in layer_to_nodes[num_layers]},
+            {node.index: node for node in layer_to_nodes[0]},
+            num_layers,
+            layer_to_nodes,
+        )
+        updated.update_drift = drift
+        return TreeUpdate(updated, leaf_indices, added, len(removed), resummarized, False)
+
+    def _summarize_many(
+        self, contexts: Dict[int, str], use_multithreading: bool = True
+    ) -> Dict[int, str]:
+        if not use_multithreading:
+            return {
+                index: self.summarize(context, max_tokens=self.summarization_length)
+                for index, context in contexts.items()
+            }
+        with ThreadPoolExecutor() as executor:
+            futures = {
+                index: executor.submit(
+                    self.summarize, context, max_tokens=self.summarization_length
+                )
+                for index, context in contexts.items()
+            }
+            return {index: future.result() for index, future in futures.items()}
+
     @abstractclassmethod
     def construct_tree(
         self,
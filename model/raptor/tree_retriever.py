@@ -1,17 +1,19 @@
 # убрал логирование import logging
-import os
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import tiktoken
-from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 from .EmbeddingModels import BaseEmbeddingModel, OpenAIEmbeddingModel
+from .lexical_index import BM25Index
 from .Retrievers import BaseRetriever
 from .tree_structures import Node, Tree
-from .utils import (distances_from_embeddings, get_children, get_embeddings,
-                    get_node_list, get_text,
-                    indices_of_nearest_neighbors_from_distances,
-                    reverse_mapping)
+from .utils import (gather_csr_rows, get_children_csr, get_embedding_matrix,
+                    get_layer_offsets, get_node_list, get_node_positions,
+                    get_parents_csr, get_text, indices_of_top_k_from_scores,
+                    normalize_rows)
+from .vector_index import (SUPPORTED_EMBEDDING_DTYPES, SUPPORTED_INDEX_BACKENDS,
+                           EmbeddingStore, MatrixIndex, build_vector_index)
 # убрал логирование logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
 
@@ -26,6 +28,16 @@ class TreeRetrieverConfig:
         embedding_model=None,
         num_layers=None,
         start_layer=None,
+        index_backend=None,
+        index_path=None,
+        hnsw_m=None,
+        ivf_nlist=None,
+        nprobe=None,
+        ef_search=None,
+        embedding_dtype=None,
+        rescore_factor=None,
+        first_stage_dims=None,
+        first_stage_candidates=None,
     ):
         if tokenizer is None:
             tokenizer = tiktoken.get_encoding("cl100k_base")
@@ -78,6 +90,65 @@ class TreeRetrieverConfig:
                 raise ValueError("start_layer must be an integer and at least 0")
         self.start_layer = start_layer
 
+        if index_backend is None:
+            index_backend = "matrix"
+        if index_backend not in SUPPORTED_INDEX_BACKENDS:
+            raise ValueError(
+                f"index_backend must be one of {SUPPORTED_INDEX_BACKENDS}"
+            )
+        self.index_backend = index_backend
+
+        if index_path is not None and not isinstance(index_path, str):
+            raise ValueError("index_path must be a string")
+        self.index_path = index_path
+
+        if hnsw_m is None:
+            hnsw_m = 32
+        if not isinstance(hnsw_m, int) or hnsw_m < 2:
+            raise ValueError("hnsw_m must be an integer and at least 2")
+        self.hnsw_m = hnsw_m
+
+        if ivf_nlist is not None:
+            if not isinstance(ivf_nlist, int) or ivf_nlist < 1:
+                raise ValueError("ivf_nlist must be an integer and at least 1")
+        self.ivf_nlist = ivf_nlist
+
+        if nprobe is None:
+            nprobe = 8
+        if not isinstance(nprobe, int) or nprobe < 1:
+            raise ValueError("nprobe must be an integer and at least 1")
+        self.nprobe = nprobe
+
+        if ef_search is None:
+            ef_search = 64
+        if not isinstance(ef_search, int) or ef_search < 1:
+            raise ValueError("ef_search must be an integer and at least 1")
+        self.ef_search = ef_search
+
+        # None searches the embeddings in the dtype the tree was saved with.
+        if embedding_dtype is not None and embedding_dtype not in SUPPORTED_EMBEDDING_DTYPES:
+            raise ValueError(
+                f"embedding_dtype must be one of {SUPPORTED_EMBEDDING_DTYPES}"
+            )
+        self.embedding_dtype = embedding_dtype
+
+        if rescore_factor is None:
+            rescore_factor = 0
+        if not isinstance(rescore_factor, int) or rescore_factor < 0:
+            raise ValueError("rescore_factor must be an integer and at least 0")
+        self.rescore_factor = rescore_factor
+
+        if first_stage_dims is not None:
+            if not isinstance(first_stage_dims, int) or first_stage_dims < 1:
+                raise ValueError("first_stage_dims must be an integer and at least 1")
+        self.first_stage_dims = first_stage_dims
+
+        if first_stage_candidates is None:
+            first_stage_candidates = 100
+        if not isinstance(first_stage_candidates, int) or first_stage_candidates < 1:
+            raise ValueError("first_stage_candidates must be an integer and at least 1")
+        self.first_stage_candidates = first_stage_candidates
+
     def log_config(self):
         config_log = """
         TreeRetrieverConfig:
@@ -89,6 +160,16 @@ class TreeRetrieverConfig:
             Embedding Model: {embedding_model}
             Num Layers: {num_layers}
             Start Layer: {start_layer}
+            Index Backend: {index_backend}
+            Index Path: {index_path}
+            HNSW M: {hnsw_m}
+            IVF Lists: {ivf_nlist}
+            IVF nprobe: {nprobe}
+            HNSW efSearch: {ef_search}
+            Embedding Dtype: {embedding_dtype}
+            Rescore Factor: {rescore_factor}
+            First Stage Dims: {first_stage_dims}
+            First Stage Candidates: {first_stage_candidates}
         """.format(
             tokenizer=self.tokenizer,
             threshold=self.threshold,
@@ -98,10 +179,44 @@ class TreeRetrieverConfig:
             embedding_model=self.embedding_model,
             num_layers=self.num_layers,
             start_layer=self.start_layer,
+            index_backend=self.index_backend,
+            index_path=self.index_path,
+            hnsw_m=self.hnsw_m,
+            ivf_nlist=self.ivf_nlist,
+            nprobe=self.nprobe,
+            ef_search=self.ef_search,
+            embedding_dtype=self.embedding_dtype,
+            rescore_factor=self.rescore_factor,
+            first_stage_dims=self.first_stage_dims,
+            first_stage_candidates=self.first_stage_candidates,
         )
         return config_log
 
 
+def _saved_dtype(node_list: List[Node], embedding_model: str) -> str:
+    """The saved dtype of the nodes: "float16" for float16 embeddings, else "float32"."""
+    if node_list:
+        embedding = node_list[0].embeddings.get(embedding_model)
+        if isinstance(embedding, np.ndarray) and embedding.dtype == np.float16:
+            return "float16"
+    return "float32"
+
+
+def _share_node_embeddings(tree: Tree, embedding_model: str, store: EmbeddingStore) -> None:
+    """Point the ``embedding_model`` embedding of every node of ``tree`` (all_nodes,
+    leaf_nodes and layer_to_nodes may hold separate copies) at its row of ``store``."""
+    nodes = list(tree.all_nodes.values()) + list(tree.leaf_nodes.values())
+    for layer_nodes in tree.layer_to_nodes.values():
+        nodes.extend(layer_nodes)
+    positions = get_node_positions(get_node_list(tree.all_nodes))
+    for node in nodes:
+        if embedding_model in node.embeddings and positions[node.index] >= 0:
+            node.embeddings = {
+                **node.embeddings,
+                embedding_model: store.data[positions[node.index]],
+            }
+
+
 class TreeRetriever(BaseRetriever):
 
     def __init__(self, config, tree) -> None:
@@ -136,9 +251,392 @@ class TreeRetriever(BaseRetriever):
         self.embedding_model = config.embedding_model
         self.context_embedding_model = config.context_embedding_model
 
-        self.tree_node_index_to_layer = reverse_mapping(self.tree.layer_to_nodes)
+        # Packed once at load time so collapsed-tree queries are a single mat-vec.
+        # ``rescore_store`` keeps the embeddings at the float32/float16 precision they were
+        # saved with, for rescoring; the searched ``embedding_store`` is the same store unless
+        # config.embedding_dtype asks for another dtype. Columnar KBs already hold the packed
+        # arrays: they are used in place, memory-mapped, and nodes are only built for the
+        # positions a query touches. The nodes of a pickled tree share the rows of
+        # ``rescore_store`` instead of keeping their own copies.
+        columns = getattr(self.tree, "columns", None)
+        if columns is not None:
+            self.node_list = self.tree.nodes()
+            self.node_indices = columns.node_indices
+            embedding_matrix = None
+            # KBs written with int8 embeddings (no longer persisted) rescore on their codes.
+            self.rescore_store = columns.embedding_store()
+            self.embedding_store = (
+                self.rescore_store
+                if config.embedding_dtype in (None, self.rescore_store.dtype)
+                else columns.embedding_store(config.embedding_dtype)
+            )
+        else:
+            self.node_list = get_node_list(self.tree.all_nodes)
+            self.node_indices = np.asarray(
+                [node.index for node in self.node_list], dtype=np.int64
+            )
+            embedding_matrix = get_embedding_matrix(
+                self.node_list, self.context_embedding_model
+            )
+            self.rescore_store = EmbeddingStore.from_matrix(
+                embedding_matrix, dtype=_saved_dtype(self.node_list, self.context_embedding_model)
+            )
+            self.embedding_store = (
+                self.rescore_store
+                if config.embedding_dtype in (None, self.rescore_store.dtype)
+                else EmbeddingStore.from_matrix(embedding_matrix, dtype=config.embedding_dtype)
+            )
+            _share_node_embeddings(self.tree, self.context_embedding_model, self.rescore_store)
+        self.rescore_factor = config.rescore_factor
+
+        # Matryoshka two-stage search: a truncated-dimension index picks candidates
+        # which are then rescored at full width. The configured backend indexes the truncated
+        # vectors, the only stage that scans every node; full-width rows are only read for the
+        # candidates, so no full-width ANN index is built.
+        self.first_stage_dims = config.first_stage_dims
+        if (
+            self.first_stage_dims is not None
+            and self.first_stage_dims >= self.embedding_store.shape[1]
+        ):
+            self.first_stage_dims = None
+        self.first_stage_candidates = config.first_stage_candidates
+        self.first_stage_index = None
+        if self.first_stage_dims is not None:
+            if embedding_matrix is None:
+                embedding_matrix = self.embedding_store.to_float32()
+            # Persisted next to the full index; its row count only depends on the node count,
+            # so index_path must identify the KB version (RaptorRagPipeline puts the KB
+            # fingerprint in it and removes the files of other versions).
+            self.first_stage_index = self._build_index(
+                EmbeddingStore.from_matrix(
+                    normalize_rows(embedding_matrix[:, : self.first_stage_dims]),
+                    dtype=self.embedding_store.dtype,
+                ),
+                config,
+                f"{config.index_path}.d{self.first_stage_dims}" if config.index_path else None,
+            )
+            self.index = MatrixIndex(self.embedding_store)
+        else:
+            self.index = self._build_index(self.embedding_store, config, config.index_path)
+        del embedding_matrix
+
+        # Tree structure as flat arrays over node positions for the layer-by-layer descent.
+        # Parent pointers and layer offsets make climbing from a hit O(depth) lookups.
+        if columns is not None:
+            self.node_positions = columns.node_positions()
+            self.children_indptr = columns.columns["children_indptr"]
+            self.children_positions = columns.columns["children"]
+            self.parents_indptr = columns.columns["parents_indptr"]
+            self.parent_positions = columns.columns["parents"]
+            self.node_layers, self.layer_order, self.layer_offsets = columns.layer_offsets()
+        else:
+            self.node_positions = get_node_positions(self.node_list)
+            self.children_indptr, self.children_positions = get_children_csr(
+                self.node_list, self.node_positions
+            )
+            self.parents_indptr, self.parent_positions = get_parents_csr(
+                self.children_indptr, self.children_positions
+            )
+            self.node_layers, self.layer_order, self.layer_offsets = get_layer_offsets(
+                self.tree.layer_to_nodes, self.node_positions, len(self.node_list)
+            )
+        self.layer_positions = {
+            layer: self.layer_order[self.layer_offsets[layer] : self.layer_offsets[layer + 1]]
+            for layer in self.tree.layer_to_nodes
+        }
+        self.layer_indexes = {
+            layer: self._build_index(
+                self.embedding_store.subset(positions),
+                config,
+                f"{config.index_path}.layer{layer}" if config.index_path else None,
+            )
+            for layer, positions in self.layer_positions.items()
+            if len(positions)
+        }
+
+        # BM25 postings are persisted with the tree at build time; older KBs are indexed here.
+        self.lexical_index = getattr(self.tree, "lexical_index", None)
+        if self.lexical_index is None or len(self.lexical_index) != len(self.node_list):
+            self.lexical_index = BM25Index.from_nodes(self.node_list)
+
+        # Offline synthetic-question keys are searched next to the node texts and resolve
+        # to the node they were generated for.
+        self.key_index = None
+        question_keys = getattr(self.tree, "question_keys", None)
+        if question_keys is not None and len(question_keys):
+            key_embeddings = np.asarray(question_keys.embeddings, dtype=np.float32)
+            node_indices = np.asarray(question_keys.node_indices, dtype=np.int64)
+            known = (node_indices >= 0) & (node_indices < len(self.node_positions))
+            key_positions = np.where(
+                known, self.node_positions[np.where(known, node_indices, 0)], -1
+            )
+            keep = key_positions >= 0
+            if keep.any() and key_embeddings.shape[1] == self.embedding_store.shape[1]:
+                self.key_positions = key_positions[keep]
+                self.keys_per_node = int(np.bincount(self.key_positions).max())
+                self.key_store = EmbeddingStore.from_matrix(
+                    normalize_rows(key_embeddings[keep]), dtype=self.embedding_store.dtype
+                )
+                # Its row count only depends on the questions per leaf, so a key index of
+                # another KB version would resolve to the wrong leaves: index_path carries the
+                # KB fingerprint (see RaptorRagPipeline).
+                self.key_index = self._build_index(
+                    self.key_store,
+                    config,
+                    f"{config.index_path}.keys" if config.index_path else None,
+                )
+
+        # The kNN graph precomputed at build time, over node positions, for neighbour expansion.
+        self.neighbor_positions = None
+        self.neighbor_scores = None
+        graph = getattr(self.tree, "neighbor_graph", None)
+        if (
+            graph is not None
+            and len(graph) == len(self.node_list)
+            and graph.k
+            and np.array_equal(graph.node_indices, self.node_indices)
+        ):
+            neighbors = np.asarray(graph.neighbors, dtype=np.int64)
+            known = (neighbors >= 0) & (neighbors < len(self.node_positions))
+            self.neighbor_positions = np.where(
+                known, self.node_positions[np.where(known, neighbors, 0)], -1
+            )
+            self.neighbor_scores = np.asarray(graph.similarities, dtype=np.float32)
+
+        # Columnar node provenance; its rows are the node positions when it covers the tree.
+        self.node_metadata = getattr(self.tree, "node_metadata", None)
+        if self.node_metadata is not None and not np.array_equal(
+            self.node_metadata.node_indices, self.node_indices
+        ):
+            self.node_metadata = None
 # убрал логирование logging.info(f"Successfully initialized TreeRetriever with Config {config.log_config()}")
 
+    @staticmethod
+    def _build_index(store, config, index_path):
+        return build_vector_index(
+            store,
+            backend=config.index_backend,
+            index_path=index_path,
+            hnsw_m=config.hnsw_m,
+            ivf_nlist=config.ivf_nlist,
+            nprobe=config.nprobe,
+            ef_search=config.ef_search,
+        )
+
+    def layer_of(self, node_index: int) -> int:
+        """The layer of a node."""
+        return int(self.node_layers[self.node_positions[node_index]])
+
+    def filter_mask(self, filters) -> Optional[np.ndarray]:
+        """
+        Boolean mask over node positions of the nodes whose metadata matches ``filters``
+        (see NodeMetadata.mask), or None when there are no filters. Without node metadata
+        no node matches.
+        """
+        if not filters:
+            return None
+        if self.node_metadata is None:
+            return np.zeros(len(self.node_list), dtype=bool)
+        return self.node_metadata.mask(filters)
+
+    def node_provenance(self, node_index: int) -> Dict[str, str]:
+        """The known metadata fields (doc_id, source, ...) of a node."""
+        if self.node_metadata is None:
+            return {}
+        return self.node_metadata.get(node_index)
+
+    def search_embeddings(
+        self, query_matrix: np.ndarray, top_k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the collapsed tree with already-normalized query embeddings.
+
+        With first_stage_dims set, the truncated-dimension index selects
+        first_stage_candidates per query, which are rescored at full width. With
+        rescore_factor > 0, top_k * rescore_factor candidates are reranked with the
+        float32 node embeddings. When the tree carries question keys, they are searched
+        as well and every node keeps its best score over its text and its keys. With a
+        ``mask`` only the allowed rows (and their keys) are scored, exactly.
+
+        Args:
+            query_matrix (np.ndarray): Float32 matrix of shape (num_queries, dim).
+            top_k (int): The number of results per query.
+            mask (np.ndarray): Optional boolean mask over node positions (see filter_mask).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Scores and node positions, best first; missing
+                results have position -1.
+        """
+        if mask is not None:
+            return self._search_masked(query_matrix, top_k, mask)
+
+        if self.first_stage_index is not None:
+            _, candidates = self.first_stage_index.search(
+                normalize_rows(query_matrix[:, : self.first_stage_dims]),
+                max(self.first_stage_candidates, top_k * max(self.rescore_factor, 1)),
+            )
+            scores, positions = self._rerank(query_matrix, candidates, top_k)
+        elif self.rescore_factor:
+            _, candidates = self.index.search(query_matrix, top_k * self.rescore_factor)
+            scores, positions = self._rerank(query_matrix, candidates, top_k)
+        else:
+            scores, positions = self.index.search(query_matrix, top_k)
+
+        if self.key_index is None:
+            return scores, positions
+        key_scores, key_rows = self.key_index.search(query_matrix, top_k * self.keys_per_node)
+        key_hits = np.where(key_rows >= 0, self.key_positions[np.maximum(key_rows, 0)], -1)
+        return self._merge_key_hits(scores, positions, key_scores, key_hits, top_k)
+
+    def _search_masked(
+        self, query_matrix: np.ndarray, top_k: int, mask: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Pre-filtered search: brute force over the allowed rows only, so the cost shrinks
+        with the filtered fraction of the tree."""
+        allowed = np.flatnonzero(mask)
+        num_queries = len(query_matrix)
+        if not len(allowed):
+            return (
+                np.zeros((num_queries, 0), dtype=np.float32),
+                np.zeros((num_queries, 0), dtype=np.int64),
+            )
+
+        depth = top_k * self.rescore_factor if self.rescore_factor else top_k
+        scores, local = MatrixIndex(self.embedding_store.subset(allowed)).search(
+            query_matrix, depth
+        )
+        positions = allowed[local]
+        if self.rescore_factor:
+            scores, positions = self._rerank(query_matrix, positions, top_k)
+
+        if self.key_index is None:
+            return scores, positions
+        key_rows = np.flatnonzero(mask[self.key_positions])
+        if not len(key_rows):
+            return scores, positions
+        key_scores, local = MatrixIndex(self.key_store.subset(key_rows)).search(
+            query_matrix, top_k * self.keys_per_node
+        )
+        key_hits = self.key_positions[key_rows[local]]
+        return self._merge_key_hits(scores, positions, key_scores, key_hits, top_k)
+
+    def _merge_key_hits(
+        self,
+        scores: np.ndarray,
+        positions: np.ndarray,
+        key_scores: np.ndarray,
+        key_hits: np.ndarray,
+        top_k: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Merges question-key hits (node positions) into node hits, keeping each node's
+        best score."""
+        all_scores = np.concatenate([scores, key_scores], axis=1)
+        all_positions = np.concatenate([positions, key_hits], axis=1)
+
+        k = min(top_k, len(self.node_list))
+        merged_scores = np.full((len(scores), k), -np.inf, dtype=np.float32)
+        merged_positions = np.full((len(scores), k), -1, dtype=np.int64)
+        for row in range(len(scores)):
+            valid = all_positions[row] >= 0
+            order = np.argsort(-all_scores[row][valid], kind="stable")
+            row_positions = all_positions[row][valid][order]
+            row_scores = all_scores[row][valid][order]
+            _, first = np.unique(row_positions, return_index=True)
+            best = np.sort(first)[:k]
+            merged_scores[row, : len(best)] = row_scores[best]
+            merged_positions[row, : len(best)] = row_positions[best]
+        return merged_scores, merged_positions
+
+    def _rerank(
+        self, query_matrix: np.ndarray, candidates: np.ndarray, top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Rescores candidate positions at full width and keeps the top_k per query."""
+        k = min(top_k, candidates.shape[1])
+        scores = np.full((len(query_matrix), k), -np.inf, dtype=np.float32)
+        positions = np.full((len(query_matrix), k), -1, dtype=np.int64)
+        for row, query_embedding in enumerate(query_matrix):
+            valid = candidates[row][candidates[row] >= 0]
+            if self.rescore_factor:
+                rows = self.exact_embeddings(valid)
+            else:
+                rows = self.embedding_store.rows(valid)
+            full_scores = rows @ query_embedding
+            best = indices_of_top_k_from_scores(full_scores, k)
+            scores[row, : len(best)] = full_scores[best]
+            positions[row, : len(best)] = valid[best]
+        return scores, positions
+
+    def descendant_positions(self, positions: np.ndarray) -> np.ndarray:
+        """Positions of every node below the given ones, walking the children CSR arrays."""
+        found = []
+        frontier = np.asarray(positions, dtype=np.int64)
+        while len(frontier):
+            frontier = gather_csr_rows(self.children_indptr, self.children_positions, frontier)
+            found.append(frontier)
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def ancestor_positions(self, position: int, levels: int = -1) -> np.ndarray:
+        """
+        Climbs the parent pointers from a node position.
+
+        Args:
+            position (int): The node position.
+            levels (int): How many levels to climb; -1 climbs to the roots.
+
+        Returns:
+            np.ndarray: Ancestor positions, nearest level first.
+        """
+        found = []
+        frontier = np.asarray([position], dtype=np.int64)
+        while len(frontier) and levels != 0:
+            frontier = gather_csr_rows(self.parents_indptr, self.parent_positions, frontier)
+            found.append(frontier)
+            levels -= 1
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def sibling_positions(self, position: int) -> np.ndarray:
+        """Positions of the other children of the node's parents, in children order."""
+        parents = gather_csr_rows(
+            self.parents_indptr, self.parent_positions, np.asarray([position], dtype=np.int64)
+        )
+        siblings = gather_csr_rows(self.children_indptr, self.children_positions, parents)
+        return siblings[siblings != position]
+
+    def graph_neighbors(
+        self, positions: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up the precomputed nearest neighbours of the given node positions.
+
+        Args:
+            positions (np.ndarray): Node positions.
+            k (int): The number of neighbours per position.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Cosine similarities and neighbour positions of
+                shape (len(positions), k), best first; missing neighbours have position -1.
+                Without a graph every position is -1.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if self.neighbor_positions is None:
+            return (
+                np.zeros((len(positions), k), dtype=np.float32),
+                np.full((len(positions), k), -1, dtype=np.int64),
+            )
+        k = min(k, self.neighbor_positions.shape[1])
+        return self.neighbor_scores[positions, :k], self.neighbor_positions[positions, :k]
+
+    def exact_embeddings(self, positions: np.ndarray) -> np.ndarray:
+        """Normalized float32 embeddings of the given node positions at the precision the KB
+        was saved with (see ``rescore_store``), whatever the dtype searched."""
+        if len(positions) == 0:
+            return np.zeros((0, self.rescore_store.shape[1]), dtype=np.float32)
+        return self.rescore_store.rows(np.asarray(positions, dtype=np.int64))
+
     def create_embedding(self, text: str) -> List[float]:
         """
         Generates embeddings for the given text using the specified embedding model.
@@ -163,84 +661,220 @@ class TreeRetriever(BaseRetriever):
             str: The context created using the most relevant nodes.
         """
 
-        query_embedding = self.create_embedding(query)
-
-        selected_nodes = []
+        query_embedding = normalize_rows(self.create_embedding(query))
 
-        node_list = get_node_list(self.tree.all_nodes)
+        scores, positions = self.search_embeddings(query_embedding[np.newaxis, :], top_k)
 
-        embeddings = get_embeddings(node_list, self.context_embedding_model)
+        selected_nodes, _ = self._select_within_budget(positions[0], scores[0], max_tokens)
 
-        distances = distances_from_embeddings(query_embedding, embeddings)
+        context = get_text(selected_nodes)
+        return selected_nodes, context
 
-        indices = indices_of_nearest_neighbors_from_distances(distances)
+    def _select_within_budget(
+        self, positions: np.ndarray, scores: np.ndarray, max_tokens: int
+    ) -> Tuple[List[Node], List[float]]:
+        """Takes ranked nodes in order until the token budget is exhausted."""
+        selected_nodes = []
+        selected_scores = []
 
         total_tokens = 0
-        for idx in indices[:top_k]:
+        for idx, score in zip(positions, scores):
+            if idx < 0:
+                continue
 
-            node = node_list[idx]
+            node = self.node_list[idx]
             node_tokens = len(self.tokenizer.encode(node.text))
 
             if total_tokens + node_tokens > max_tokens:
                 break
 
             selected_nodes.append(node)
+            selected_scores.append(float(score))
             total_tokens += node_tokens
 
-        context = get_text(selected_nodes)
-        return selected_nodes, context
+        return selected_nodes, selected_scores
+
+    def retrieve_many(
+        self, queries: List[str], top_k: int = 10, max_tokens: int = 3500
+    ) -> List[List[Dict]]:
+        """
+        Runs collapsed-tree retrieval for several queries at once.
+
+        All queries are embedded in one batched call and scored against the node
+        matrix in a single search.
+
+        Args:
+            queries (List[str]): The query texts.
+            top_k (int): The number of nodes to retrieve per query. Defaults to 10.
+            max_tokens (int): The maximum number of tokens per query. Defaults to 3500.
+
+        Returns:
+            List[List[Dict]]: For every query, the layer information of the selected
+                nodes with their cosine similarity under "score".
+        """
+        if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+            raise ValueError("queries must be a list of strings")
+
+        if not isinstance(max_tokens, int) or max_tokens < 1:
+            raise ValueError("max_tokens must be an integer and at least 1")
+
+        if not queries:
+            return []
+
+        query_matrix = self.embed_queries(queries)
+
+        scores, positions = self.search_embeddings(query_matrix, top_k)
+
+        return [
+            self.layer_information(positions[row], scores[row], max_tokens)
+            for row in range(len(queries))
+        ]
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeds the queries in one batched call and returns them as unit-length rows."""
+        return normalize_rows(self.embedding_model.create_embeddings(queries))
+
+    def expand_queries(
+        self,
+        query_matrix: np.ndarray,
+        feedback_docs: int = 5,
+        alpha: float = 1.0,
+        beta: float = 0.5,
+        mask: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Rocchio pseudo-relevance feedback: moves every query towards the centroid of the
+        stored embeddings of its top ``feedback_docs`` nodes.
+
+        Args:
+            query_matrix (np.ndarray): Normalized query embeddings (num_queries, dim).
+            feedback_docs (int): The number of top nodes treated as relevant.
+            alpha (float): Weight of the original query.
+            beta (float): Weight of the feedback centroid.
+            mask (np.ndarray): Optional boolean mask over node positions the feedback
+                nodes are taken from.
+
+        Returns:
+            np.ndarray: The expanded, re-normalized query embeddings.
+        """
+        _, positions = self.search_embeddings(query_matrix, feedback_docs, mask)
+        expanded = alpha * np.asarray(query_matrix, dtype=np.float32)
+        for row in range(expanded.shape[0]):
+            feedback = positions[row][positions[row] >= 0]
+            if len(feedback):
+                expanded[row] += beta * self.embedding_store.rows(feedback).mean(axis=0)
+        return normalize_rows(expanded)
+
+    def lexical_search(
+        self, queries: List[str], top_k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ranks nodes by BM25 against each query without touching the embedding model.
+
+        Args:
+            queries (List[str]): The query texts.
+            top_k (int): The number of nodes to return per query.
+            mask (np.ndarray): Optional boolean mask over node positions; other nodes are
+                never returned.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: BM25 scores and node positions of shape
+                (num_queries, top_k); rows with fewer matches are padded with position -1.
+        """
+        scores = np.zeros((len(queries), top_k), dtype=np.float32)
+        positions = np.full((len(queries), top_k), -1, dtype=np.int64)
+        if mask is not None:
+            mask = mask[self.node_positions[self.lexical_index.node_indices]]
+        for row, query in enumerate(queries):
+            row_scores, node_indices = self.lexical_index.search(query, top_k, mask)
+            scores[row, : len(row_scores)] = row_scores
+            positions[row, : len(node_indices)] = self.node_positions[node_indices]
+        return scores, positions
+
+    def layer_information(
+        self, positions: np.ndarray, scores: np.ndarray, max_tokens: int
+    ) -> List[Dict]:
+        """
+        Takes ranked node positions within the token budget and describes each selection.
+
+        Returns:
+            List[Dict]: "node_index", "layer_number" and "score" of every selected node,
+                plus its known provenance fields (see node_provenance).
+        """
+        selected_nodes, selected_scores = self._select_within_budget(
+            positions, scores, max_tokens
+        )
+        return [
+            {
+                "node_index": node.index,
+                "layer_number": self.layer_of(node.index),
+                "score": score,
+                **self.node_provenance(node.index),
+            }
+            for node, score in zip(selected_nodes, selected_scores)
+        ]
 
     def retrieve_information(
-        self, current_nodes: List[Node], query: str, num_layers: int
+        self,
+        current_nodes: List[Node],
+        query: str,
+        num_layers: int,
+        start_layer: int = None,
     ) -> str:
         """
         Retrieves the most relevant information from the tree based on the query.
 
+        The first step searches the precomputed index of ``start_layer`` when given;
+        every following step only scores the children of the nodes selected so far.
+
         Args:
             current_nodes (List[Node]): A List of the current nodes.
             query (str): The query text.
             num_layers (int): The number of layers to traverse.
+            start_layer (int): The layer current_nodes belong to, if it is a whole layer.
 
         Returns:
             str: The context created using the most relevant nodes.
         """
 
-        query_embedding = self.create_embedding(query)
+        query_embedding = normalize_rows(self.create_embedding(query))
 
         selected_nodes = []
 
-        node_list = current_nodes
+        candidates = self.node_positions[[node.index for node in current_nodes]]
 
         for layer in range(num_layers):
 
-            embeddings = get_embeddings(node_list, self.context_embedding_model)
-
-            distances = distances_from_embeddings(query_embedding, embeddings)
+            if (
+                layer == 0
+                and self.selection_mode == "top_k"
+                and start_layer in self.layer_indexes
+            ):
+                _, local = self.layer_indexes[start_layer].search(
+                    query_embedding[np.newaxis, :], self.top_k
+                )
+                local = local[0][local[0] >= 0]
+                best_positions = self.layer_positions[start_layer][local]
 
-            indices = indices_of_nearest_neighbors_from_distances(distances)
+            else:
+                scores = self.embedding_store.rows(candidates) @ query_embedding
 
-            if self.selection_mode == "threshold":
-                best_indices = [
-                    index for index in indices if distances[index] > self.threshold
-                ]
+                if self.selection_mode == "threshold":
+                    # Keeps the nodes more similar to the query than the threshold, best first.
+                    indices = np.argsort(-scores, kind="stable")
+                    best_indices = indices[scores[indices] > self.threshold]
 
-            elif self.selection_mode == "top_k":
-                best_indices = indices[: self.top_k]
+                elif self.selection_mode == "top_k":
+                    best_indices = indices_of_top_k_from_scores(scores, self.top_k)
 
-            nodes_to_add = [node_list[idx] for idx in best_indices]
+                best_positions = candidates[best_indices]
 
-            selected_nodes.extend(nodes_to_add)
+            selected_nodes.extend(self.node_list[pos] for pos in best_positions)
 
             if layer != num_layers - 1:
-
-                child_nodes = []
-
-                for index in best_indices:
-                    child_nodes.extend(node_list[index].children)
-
-                # take the unique values
-                child_nodes = list(dict.fromkeys(child_nodes))
-                node_list = [self.tree.all_nodes[i] for i in child_nodes]
+                candidates = gather_csr_rows(
+                    self.children_indptr, self.children_positions, best_positions
+                )
 
         context = get_text(selected_nodes)
         return selected_nodes, context
@@ -303,7 +937,7 @@ class TreeRetriever(BaseRetriever):
         else:
             layer_nodes = self.tree.layer_to_nodes[start_layer]
             selected_nodes, context = self.retrieve_information(
-                layer_nodes, query, num_layers
+                layer_nodes, query, num_layers, start_layer=start_layer
             )
 
         if return_layer_information:
@@ -314,7 +948,7 @@ class TreeRetriever(BaseRetriever):
                 layer_information.append(
                     {
                         "node_index": node.index,
-                        "layer_number": self.tree_node_index_to_layer[node.index],
+                        "layer_number": self.layer_of(node.index),
                     }
                 )
 
@@ -13,16 +13,49 @@ class Node:
         self.embeddings = embeddings
 
 
+class SearchKeys:
+    """
+    Extra embedding keys that point to tree nodes, e.g. synthetic user questions per leaf.
+    Row i is ``texts[i]`` embedded as ``embeddings[i]`` and resolves to node ``node_indices[i]``.
+    """
+
+    def __init__(self, texts: List[str], node_indices, embeddings) -> None:
+        self.texts = texts
+        self.node_indices = node_indices
+        self.embeddings = embeddings
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
 class Tree:
     """
     Represents the entire hierarchical tree structure.
     """
 
     def __init__(
-        self, all_nodes, root_nodes, leaf_nodes, num_layers, layer_to_nodes
+        self,
+        all_nodes,
+        root_nodes,
+        leaf_nodes,
+        num_layers,
+        layer_to_nodes,
+        lexical_index=None,
+        question_keys=None,
+        sentence_store=None,
+        neighbor_graph=None,
+        node_metadata=None,
+        update_drift=0.0,
     ) -> None:
         self.all_nodes = all_nodes
         self.root_nodes = root_nodes
         self.leaf_nodes = leaf_nodes
         self.num_layers = num_layers
         self.layer_to_nodes = layer_to_nodes
+        self.lexical_index = lexical_index
+        self.question_keys = question_keys
+        self.sentence_store = sentence_store
+        self.neighbor_graph = neighbor_graph
+        self.node_metadata = node_metadata
+        # Fraction of leaves changed by incremental updates since the tree was clustered.
+        self.update_drift = update_drift
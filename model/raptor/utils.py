@@ -1,6 +1,6 @@
 # убрал логирование import logging
 import re
-from typing import Dict, List, Set
+from typing import Dict, List, Set, Tuple
 
 import numpy as np
 import tiktoken
@@ -177,6 +177,138 @@ def get_children(node_list: List[Node]) -> List[Set[int]]:
     return [node.children for node in node_list]
 
 
+def get_node_positions(node_list: List[Node]) -> np.ndarray:
+    """
+    Builds a lookup array from node index to the node's position in node_list.
+
+    Args:
+        node_list (List[Node]): List of nodes.
+
+    Returns:
+        np.ndarray: Array of size max(node.index) + 1; unknown indices map to -1.
+    """
+    size = max((node.index for node in node_list), default=-1) + 1
+    positions = np.full(size, -1, dtype=np.int64)
+    for position, node in enumerate(node_list):
+        positions[node.index] = position
+    return positions
+
+
+def get_children_csr(
+    node_list: List[Node], node_positions: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Packs the children of every node into CSR arrays over node positions.
+
+    The children of ``node_list[p]`` are ``children[indptr[p]:indptr[p + 1]]``.
+
+    Args:
+        node_list (List[Node]): List of nodes.
+        node_positions (np.ndarray): Node index to position lookup.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The indptr and children position arrays.
+    """
+    indptr = np.zeros(len(node_list) + 1, dtype=np.int64)
+    children = []
+    for position, node in enumerate(node_list):
+        child_indices = sorted(node.children)
+        children.extend(child_indices)
+        indptr[position + 1] = indptr[position] + len(child_indices)
+    children = np.asarray(children, dtype=np.int64)
+    return indptr, node_positions[children] if len(children) else children
+
+
+def get_parents_csr(
+    children_indptr: np.ndarray, children_positions: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inverts the children CSR arrays into parent pointers over node positions. Soft
+    clustering can put a node into several clusters, so a node may have several parents.
+
+    The parents of position p are ``parents[indptr[p]:indptr[p + 1]]``.
+
+    Args:
+        children_indptr (np.ndarray): Children CSR row pointer array.
+        children_positions (np.ndarray): Children CSR values (child positions).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The indptr and parent position arrays.
+    """
+    num_positions = len(children_indptr) - 1
+    edge_parents = np.repeat(np.arange(num_positions, dtype=np.int64), np.diff(children_indptr))
+    order = np.argsort(children_positions, kind="stable")
+    indptr = np.zeros(num_positions + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(children_positions, minlength=num_positions))
+    return indptr, edge_parents[order]
+
+
+def get_layer_offsets(
+    layer_to_nodes: Dict[int, List[Node]], node_positions: np.ndarray, num_positions: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Packs the layer structure into flat arrays over node positions.
+
+    Args:
+        layer_to_nodes (Dict[int, List[Node]]): Nodes of every layer.
+        node_positions (np.ndarray): Node index to position lookup.
+        num_positions (int): The number of node positions.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The layer of every position (-1 if none),
+            the positions ordered by layer and the layer offsets into that order: the
+            positions of layer l are ``order[offsets[l]:offsets[l + 1]]``, ascending.
+    """
+    node_layers = np.full(num_positions, -1, dtype=np.int64)
+    for layer, nodes in layer_to_nodes.items():
+        node_layers[node_positions[[node.index for node in nodes]]] = layer
+    order, offsets = get_layer_order(node_layers, max(layer_to_nodes, default=-1) + 1)
+    return node_layers, order, offsets
+
+
+def get_layer_order(
+    node_layers: np.ndarray, num_layers: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Orders node positions by layer, given the layer of every position (-1 if none).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The positions ordered by layer and the layer offsets
+            into that order, as in ``get_layer_offsets``.
+    """
+    in_layer = np.flatnonzero(node_layers >= 0)
+    order = in_layer[np.argsort(node_layers[in_layer], kind="stable")]
+    offsets = np.zeros(num_layers + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(node_layers[in_layer], minlength=num_layers))
+    return order, offsets
+
+
+def gather_csr_rows(
+    indptr: np.ndarray, values: np.ndarray, rows: np.ndarray
+) -> np.ndarray:
+    """
+    Concatenates the CSR rows for the given row ids, keeping first occurrences only.
+
+    Args:
+        indptr (np.ndarray): CSR row pointer array.
+        values (np.ndarray): CSR values array.
+        rows (np.ndarray): Row ids to gather, in priority order.
+
+    Returns:
+        np.ndarray: Unique values in order of first appearance.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=values.dtype)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    gathered = values[np.arange(total) + offsets]
+    _, first = np.unique(gathered, return_index=True)
+    return gathered[np.sort(first)]
+
+
 def get_text(node_list: List[Node]) -> str:
     """
     Generates a single text string by concatenating the text from a list of nodes.
@@ -194,6 +326,116 @@ def get_text(node_list: List[Node]) -> str:
     return text
 
 
+def get_embedding_matrix(node_list: List[Node], embedding_model: str) -> np.ndarray:
+    """
+    Packs the embeddings of nodes into a contiguous, L2-normalized float32 matrix.
+
+    Args:
+        node_list (List[Node]): List of nodes.
+        embedding_model (str): The name of the embedding model to be used.
+
+    Returns:
+        np.ndarray: Matrix of shape (len(node_list), dim) whose rows are unit vectors.
+    """
+    if not node_list:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.ascontiguousarray(
+        get_embeddings(node_list, embedding_model), dtype=np.float32
+    )
+    return normalize_rows(matrix)
+
+
+def pack_node_embeddings(node_list: List[Node], dtype: str = "float32") -> None:
+    """
+    Replaces the Python float lists in Node.embeddings with packed numpy arrays, in place.
+    A list of floats costs ~32 bytes per value; float32/float16 arrays cost 4/2 bytes.
+
+    Args:
+        node_list (List[Node]): List of nodes.
+        dtype (str): Either 'float32' or 'float16'.
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError("dtype must be either 'float32' or 'float16'")
+    for node in node_list:
+        node.embeddings = {
+            model_name: np.asarray(embedding, dtype=dtype)
+            for model_name, embedding in node.embeddings.items()
+        }
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalizes every row of a matrix (or a single vector) in float32.
+
+    Args:
+        matrix (np.ndarray): A 1-D vector or a 2-D matrix.
+
+    Returns:
+        np.ndarray: Float32 array of the same shape with unit-length rows.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    return np.ascontiguousarray(matrix / norms)
+
+
+def indices_of_top_k_from_scores(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the indices of the k highest scores sorted in descending order of score.
+
+    Uses ``argpartition`` so only the selected candidates are fully sorted.
+
+    Args:
+        scores (np.ndarray): A 1-D array of similarity scores.
+        k (int): The number of indices to return.
+
+    Returns:
+        np.ndarray: Indices of the top-k scores, best first.
+    """
+    scores = np.asarray(scores)
+    k = min(int(k), scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[np.ndarray], top_k: int, k: int = 60
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuses several rankings of the same items with Reciprocal Rank Fusion.
+
+    Each item scores ``sum(1 / (k + rank))`` over the rankings it appears in (ranks start
+    at 1). Ties keep the order of first appearance.
+
+    Args:
+        rankings (List[np.ndarray]): Item ids, best first; negative ids are padding.
+        top_k (int): The number of fused items to return.
+        k (int): The RRF damping constant.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Fused scores and item ids, best first.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        rank = 0
+        for item in ranking:
+            if item < 0:
+                continue
+            rank += 1
+            fused[int(item)] = fused.get(int(item), 0.0) + 1.0 / (k + rank)
+
+    best = sorted(fused.items(), key=lambda entry: entry[1], reverse=True)[:top_k]
+    return (
+        np.asarray([score for _, score in best], dtype=np.float32),
+        np.asarray([item for item, _ in best], dtype=np.int64),
+    )
+
+
 def indices_of_nearest_neighbors_from_distances(distances: List[float]) -> np.ndarray:
     """
     Returns the indices of nearest neighbors sorted in ascending order of distance.
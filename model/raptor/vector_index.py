@@ -0,0 +1,364 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+from .utils import indices_of_top_k_from_scores
+
+SUPPORTED_INDEX_BACKENDS = ["matrix", "flat", "hnsw", "ivf"]
+SUPPORTED_EMBEDDING_DTYPES = ["float32", "float16", "int8"]
+
+# Below this many rows an exact matrix scan beats any ANN structure (and IVF cannot train).
+_MIN_ANN_ROWS = 1024
+
+# Rows dequantized at once while scoring a compressed store; bounds the float32 scratch space.
+_SCORE_BLOCK_ROWS = 16384
+
+
+class EmbeddingStore:
+    """
+    Row-major matrix of unit-length embeddings kept as float32, float16, or int8 codes
+    with one float32 scale per row (scalar quantization: row ~= codes * scale).
+    """
+
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray] = None) -> None:
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, dtype: str = "float32") -> "EmbeddingStore":
+        """
+        Compresses a normalized float32 matrix into the requested representation.
+
+        Args:
+            matrix (np.ndarray): Matrix of unit-length embeddings.
+            dtype (str): One of SUPPORTED_EMBEDDING_DTYPES.
+
+        Returns:
+            EmbeddingStore: The compressed store.
+        """
+        if dtype not in SUPPORTED_EMBEDDING_DTYPES:
+            raise ValueError(
+                f"Unsupported embedding dtype '{dtype}'. Supported dtypes are: {SUPPORTED_EMBEDDING_DTYPES}"
+            )
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dtype == "float32":
+            return cls(np.ascontiguousarray(matrix))
+        if dtype == "float16":
+            return cls(np.ascontiguousarray(matrix, dtype=np.float16))
+
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0)
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        codes = np.rint(matrix / scales[:, np.newaxis]).astype(np.int8)
+        return cls(np.ascontiguousarray(codes), scales)
+
+    @property
+    def dtype(self) -> str:
+        return "int8" if self.scales is not None else str(self.data.dtype)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def rows(self, positions) -> np.ndarray:
+        """Returns the selected rows (an array of positions or a slice) as float32."""
+        rows = np.asarray(self.data[positions], dtype=np.float32)
+        if self.scales is not None:
+            rows *= self.scales[positions][..., np.newaxis]
+        return rows
+
+    def to_float32(self) -> np.ndarray:
+        return self.rows(slice(None))
+
+    def subset(self, positions: np.ndarray) -> "EmbeddingStore":
+        """Returns a store over the given rows; a view when the positions are contiguous."""
+        if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+            positions = slice(positions[0], positions[-1] + 1)
+        scales = self.scales[positions] if self.scales is not None else None
+        return EmbeddingStore(self.data[positions], scales)
+
+    def dot(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Inner products between queries and every row, computed on the compressed data.
+
+        Args:
+            queries (np.ndarray): Float32 matrix of shape (num_queries, dim).
+
+        Returns:
+            np.ndarray: Float32 scores of shape (num_queries, len(self)).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.dtype == "float32":
+            return queries @ self.data.T
+
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), _SCORE_BLOCK_ROWS):
+            stop = min(start + _SCORE_BLOCK_ROWS, len(self))
+            block = self.data[start:stop].astype(np.float32)
+            scores[:, start:stop] = queries @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+
+class BaseVectorIndex(ABC):
+    """
+    Inner-product index over the rows of a normalized embedding matrix.
+    Returned ids are row positions in that matrix.
+    """
+
+    @abstractmethod
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the index for the k best rows per query.
+
+        Args:
+            queries (np.ndarray): Float32 matrix of shape (num_queries, dim).
+            k (int): The number of results per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Scores and row positions, both of shape
+                (num_queries, k'). Missing results are marked with position -1.
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def ntotal(self) -> int:
+        pass
+
+
+class MatrixIndex(BaseVectorIndex):
+    """Brute-force search over an EmbeddingStore: one matrix product plus an argpartition top-k."""
+
+    def __init__(self, store: EmbeddingStore) -> None:
+        self.store = store
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.store)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(queries)
+        k = min(k, self.ntotal)
+        scores = self.store.dot(queries)
+        positions = np.empty((queries.shape[0], k), dtype=np.int64)
+        top_scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for row in range(queries.shape[0]):
+            positions[row] = indices_of_top_k_from_scores(scores[row], k)
+            top_scores[row] = scores[row, positions[row]]
+        return top_scores, positions
+
+
+class FaissIndex(BaseVectorIndex):
+    """
+    Wraps a FAISS inner-product index (flat, HNSW or IVF) built over the matrix rows.
+    float16/int8 stores use the matching FAISS scalar quantizer so the index itself is
+    compressed as well.
+    """
+
+    def __init__(
+        self,
+        index,
+        backend: str,
+        nprobe: int = 8,
+        ef_search: int = 64,
+    ) -> None:
+        self.index = index
+        self.backend = backend
+        self.set_search_params(nprobe=nprobe, ef_search=ef_search)
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        backend: str = "flat",
+        hnsw_m: int = 32,
+        ivf_nlist: Optional[int] = None,
+        nprobe: int = 8,
+        ef_search: int = 64,
+        dtype: str = "float32",
+    ) -> "FaissIndex":
+        """
+        Builds a FAISS index over the rows of a normalized float32 matrix.
+
+        Args:
+            matrix (np.ndarray): Matrix of unit-length embeddings.
+            backend (str): One of 'flat', 'hnsw' or 'ivf'.
+            hnsw_m (int): Number of graph neighbours per node for HNSW.
+            ivf_nlist (Optional[int]): Number of IVF lists. Defaults to ~4*sqrt(n), capped
+                so that every list gets enough training points.
+            nprobe (int): Number of IVF lists visited per query.
+            ef_search (int): HNSW search beam width.
+            dtype (str): Vector storage inside the index, one of SUPPORTED_EMBEDDING_DTYPES.
+
+        Returns:
+            FaissIndex: The populated index.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        num_rows, dim = matrix.shape
+        qtype = {
+            "float16": faiss.ScalarQuantizer.QT_fp16,
+            "int8": faiss.ScalarQuantizer.QT_8bit,
+        }.get(dtype)
+        metric = faiss.METRIC_INNER_PRODUCT
+
+        if backend == "flat":
+            if qtype is None:
+                index = faiss.IndexFlatIP(dim)
+            else:
+                index = faiss.IndexScalarQuantizer(dim, qtype, metric)
+        elif backend == "hnsw":
+            if qtype is None:
+                index = faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+            else:
+                index = faiss.IndexHNSWSQ(dim, qtype, hnsw_m, metric)
+        elif backend == "ivf":
+            if ivf_nlist is None:
+                ivf_nlist = min(int(4 * np.sqrt(num_rows)), num_rows // 39)
+            ivf_nlist = max(1, min(ivf_nlist, num_rows))
+            quantizer = faiss.IndexFlatIP(dim)
+            if qtype is None:
+                index = faiss.IndexIVFFlat(quantizer, dim, ivf_nlist, metric)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(
+                    quantizer, dim, ivf_nlist, qtype, metric
+                )
+            index.train(matrix)
+        else:
+            raise ValueError(
+                f"Unsupported FAISS backend '{backend}'. Supported backends are: 'flat', 'hnsw', 'ivf'"
+            )
+
+        if qtype is not None and backend != "ivf":
+            index.train(matrix)
+        index.add(matrix)
+        return cls(index, backend, nprobe=nprobe, ef_search=ef_search)
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = 8, ef_search: int = 64) -> "FaissIndex":
+        index = faiss.read_index(path)
+        if isinstance(index, faiss.IndexHNSW):
+            backend = "hnsw"
+        elif isinstance(index, faiss.IndexIVF):
+            backend = "ivf"
+        else:
+            backend = "flat"
+        return cls(index, backend, nprobe=nprobe, ef_search=ef_search)
+
+    def save(self, path: str) -> None:
+        faiss.write_index(self.index, path)
+
+    def set_search_params(self, nprobe: int = 8, ef_search: int = 64) -> None:
+        if self.backend == "ivf":
+            self.index.nprobe = nprobe
+        elif self.backend == "hnsw":
+            self.index.hnsw.efSearch = ef_search
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def dim(self) -> int:
+        return self.index.d
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        k = min(k, self.ntotal)
+        scores, positions = self.index.search(queries, k)
+        return scores, positions
+
+
+def build_vector_index(
+    store: EmbeddingStore,
+    backend: str = "matrix",
+    index_path: Optional[str] = None,
+    hnsw_m: int = 32,
+    ivf_nlist: Optional[int] = None,
+    nprobe: int = 8,
+    ef_search: int = 64,
+) -> BaseVectorIndex:
+    """
+    Creates the vector index for a store of normalized embeddings.
+
+    FAISS backends are loaded from ``index_path`` when it holds an index of the matching
+    size and dimension that was built with the same parameters (backend, vector dtype, metric,
+    HNSW M, IVF lists; recorded in ``<index_path>.params.json``); otherwise they are built
+    and, if a path is given, written there with their parameters. Approximate backends fall
+    back to the exact matrix scan for very small stores.
+
+    Args:
+        store (EmbeddingStore): The node embeddings.
+        backend (str): One of SUPPORTED_INDEX_BACKENDS.
+        index_path (Optional[str]): Where to load/persist a FAISS index.
+
+    Returns:
+        BaseVectorIndex: The index ready for search.
+    """
+    if backend not in SUPPORTED_INDEX_BACKENDS:
+        raise ValueError(
+            f"Unsupported index backend '{backend}'. Supported backends are: {SUPPORTED_INDEX_BACKENDS}"
+        )
+
+    if backend == "matrix" or (backend != "flat" and len(store) < _MIN_ANN_ROWS):
+        return MatrixIndex(store)
+
+    params = {
+        "backend": backend,
+        "dtype": store.dtype,
+        "metric": "inner_product",
+        "hnsw_m": hnsw_m if backend == "hnsw" else None,
+        "ivf_nlist": ivf_nlist if backend == "ivf" else None,
+    }
+    params_path = f"{index_path}.params.json" if index_path is not None else None
+    if (
+        index_path is not None
+        and os.path.exists(index_path)
+        and _read_build_params(params_path) == params
+    ):
+        index = FaissIndex.load(index_path, nprobe=nprobe, ef_search=ef_search)
+        if (
+            index.backend == backend
+            and index.index.metric_type == faiss.METRIC_INNER_PRODUCT
+            and index.ntotal == store.shape[0]
+            and index.dim == store.shape[1]
+        ):
+            return index
+
+    index = FaissIndex.build(
+        store.to_float32(),
+        backend=backend,
+        hnsw_m=hnsw_m,
+        ivf_nlist=ivf_nlist,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        dtype=store.dtype,
+    )
+    if index_path is not None:
+        # Parameters last: an index written without them is never reused.
+        if os.path.exists(params_path):
+            os.remove(params_path)
+        index.save(index_path)
+        with open(params_path, "w", encoding="utf-8") as file:
+            json.dump(params, file)
+    return index
+
+
+def _read_build_params(path: str) -> Optional[dict]:
+    """The build parameters recorded next to a persisted FAISS index, or None."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
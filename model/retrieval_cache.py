@@ -0,0 +1,63 @@
+"""Thread-safe TTL + LRU cache for retrieval results."""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Bounded LRU whose entries also expire ``ttl_seconds`` after insertion.
+
+    ``max_entries=0`` disables caching; ``ttl_seconds<=0`` keeps entries until evicted.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 600.0) -> None:
+        self._max_entries = max(0, int(max_entries))
+        self._ttl = float(ttl_seconds)
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self._misses += 1
+                return None
+            stored_at, value = item
+            if self._ttl > 0 and time.monotonic() - stored_at > self._ttl:
+                del self._entries[key]
+                self._expired += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self._max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "expired": self._expired,
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+            }
@@ -0,0 +1,220 @@
+"""Shadow retrieval: replay sampled queries against a candidate KB off the response path."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    from .embedding_cache import normalize_cache_text
+except Exception:  # pragma: no cover - allow flat layout imports
+    from embedding_cache import normalize_cache_text  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def _hit_key(pipeline: Any, hit: Dict[str, Any]) -> str:
+    """Identity of a hit that survives a KB rebuild: node ids do not, the text does."""
+    text = normalize_cache_text(pipeline.node_text(hit["node_index"]))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _is_related(hit: Dict[str, Any]) -> bool:
+    """Nodes appended by neighbour/structure expansion are not part of the ranking."""
+    return any(key in hit for key in ("neighbor_of", "ancestor_of", "sibling_of"))
+
+
+def _overlap(primary: Sequence[Any], candidate: Sequence[Any], k: int) -> Optional[float]:
+    """|top-k(primary) & top-k(candidate)| / k, or None when both are empty."""
+    if not primary and not candidate:
+        return None
+    return len(set(primary[:k]) & set(candidate[:k])) / max(1, k)
+
+
+class ShadowRetrieval:
+    """Replays a sampled fraction of queries against a candidate pipeline and appends one JSON
+    line per query to ``report_path``: overlap@k of the two rankings (by chunk text and, when
+    both KBs carry provenance, by doc id), score deltas, and the latency of every stage.
+
+    Comparisons run on one background thread, one at a time; when ``max_pending`` of them are
+    queued further samples are dropped, so a slow or broken candidate never delays requests.
+    ``candidate()`` returns the candidate pipeline or None (shadowing is then skipped).
+    """
+
+    def __init__(
+        self,
+        candidate: Callable[[], Any],
+        report_path: str | Path,
+        sample_rate: float = 0.05,
+        max_pending: int = 8,
+    ) -> None:
+        self._candidate = candidate
+        self._report_path = Path(report_path)
+        self._sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self._max_pending = max(1, int(max_pending))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-shadow")
+        self._lock = Lock()
+        self._pending = 0
+        self._sampled = 0
+        self._dropped = 0
+        self._compared = 0
+        self._failed = 0
+        self._overlap_sum = 0.0
+        self._overlap_count = 0
+
+    def submit(
+        self,
+        primary: Any,
+        queries: Sequence[str],
+        top_k: int,
+        served_seconds: float,
+        **retrieval_kwargs: Any,
+    ) -> bool:
+        """Sample the call and, if picked, queue its comparison. Returns whether it was queued."""
+        if primary is None or not queries or random.random() >= self._sample_rate:
+            return False
+        with self._lock:
+            self._sampled += 1
+            if self._pending >= self._max_pending:
+                self._dropped += 1
+                return False
+            self._pending += 1
+        self._executor.submit(
+            self._run, primary, list(queries), top_k, served_seconds, retrieval_kwargs
+        )
+        return True
+
+    def _run(
+        self,
+        primary: Any,
+        queries: List[str],
+        top_k: int,
+        served_seconds: float,
+        retrieval_kwargs: Dict[str, Any],
+    ) -> None:
+        try:
+            records = self._compare(primary, queries, top_k, served_seconds, retrieval_kwargs)
+            if records:
+                self._write(records)
+        except Exception as exc:
+            logger.warning("Shadow retrieval failed: %s", exc)
+            with self._lock:
+                self._failed += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _compare(
+        self,
+        primary: Any,
+        queries: List[str],
+        top_k: int,
+        served_seconds: float,
+        retrieval_kwargs: Dict[str, Any],
+    ) -> List[Dict[str, Any]]:
+        candidate = self._candidate()
+        if candidate is None:
+            return []
+
+        # Both sides run the primary's serving mode on one shared query embedding.
+        mode = primary.active_mode
+        query_matrix = None
+        embed_seconds = 0.0
+        if mode != "lexical":
+            started = time.perf_counter()
+            query_matrix = primary.embed_queries(queries)
+            embed_seconds = time.perf_counter() - started
+
+        sides = {}
+        for name, pipeline in (("primary", primary), ("candidate", candidate)):
+            started = time.perf_counter()
+            per_query, _ = pipeline.retrieve_many(
+                queries, top_k=top_k, mode=mode, query_matrix=query_matrix, **retrieval_kwargs
+            )
+            sides[name] = (pipeline, per_query, time.perf_counter() - started)
+
+        records = []
+        for row, query in enumerate(queries):
+            record: Dict[str, Any] = {
+                "ts": round(time.time(), 3),
+                "query": query[:200],
+                "mode": mode,
+                "top_k": top_k,
+                "latency_ms": {
+                    "served": round(served_seconds * 1e3, 3),
+                    "embed": round(embed_seconds * 1e3, 3),
+                },
+            }
+            keys, doc_ids, scores = {}, {}, {}
+            for name, (pipeline, per_query, seconds) in sides.items():
+                hits = [hit for hit in per_query[row] if not _is_related(hit)][:top_k]
+                keys[name] = [_hit_key(pipeline, hit) for hit in hits]
+                doc_ids[name] = [hit.get("doc_id") for hit in hits]
+                scores[name] = [float(hit.get("score", 0.0)) for hit in hits]
+                record["latency_ms"][f"{name}_search"] = round(seconds / len(queries) * 1e3, 3)
+                record[name] = {
+                    "fingerprint": pipeline.fingerprint,
+                    "hits": [
+                        {"chunk": key, "doc_id": doc_id, "score": round(score, 6)}
+                        for key, doc_id, score in zip(keys[name], doc_ids[name], scores[name])
+                    ],
+                }
+
+            record["overlap_at_k"] = _overlap(keys["primary"], keys["candidate"], top_k)
+            if all(doc_ids["primary"]) and all(doc_ids["candidate"]):
+                record["doc_overlap_at_k"] = _overlap(
+                    doc_ids["primary"], doc_ids["candidate"], top_k
+                )
+            if scores["primary"] and scores["candidate"]:
+                record["top1_score_delta"] = round(scores["candidate"][0] - scores["primary"][0], 6)
+                record["mean_score_delta"] = round(
+                    sum(scores["candidate"]) / len(scores["candidate"])
+                    - sum(scores["primary"]) / len(scores["primary"]),
+                    6,
+                )
+            shared = set(keys["primary"]) & set(keys["candidate"])
+            if shared:
+                primary_scores = dict(zip(keys["primary"], scores["primary"]))
+                candidate_scores = dict(zip(keys["candidate"], scores["candidate"]))
+                record["shared_score_delta"] = round(
+                    sum(candidate_scores[key] - primary_scores[key] for key in shared)
+                    / len(shared),
+                    6,
+                )
+            records.append(record)
+        return records
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._lock:
+            self._report_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._report_path.open("a", encoding="utf-8") as file:
+                file.write(lines)
+            self._compared += len(records)
+            for record in records:
+                if record["overlap_at_k"] is not None:
+                    self._overlap_sum += record["overlap_at_k"]
+                    self._overlap_count += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "report": str(self._report_path),
+                "sample_rate": self._sample_rate,
+                "sampled": self._sampled,
+                "dropped": self._dropped,
+                "pending": self._pending,
+                "compared": self._compared,
+                "failed": self._failed,
+                "avg_overlap_at_k": (
+                    self._overlap_sum / self._overlap_count if self._overlap_count else None
+                ),
+            }
+
@@ -0,0 +1,63 @@
+"""Thread-safe latency and candidate-count telemetry for multi-stage retrieval."""
+
+from __future__ import annotations
+
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, Tuple
+
+import numpy as np
+
+
+class StageTelemetry:
+    """Running per-stage counters plus latency percentiles over the last ``window`` calls.
+
+    Each record carries how many candidates entered and left the stage, so the
+    over-fetch / rescore / rerank depths can be tuned against a latency SLO.
+    """
+
+    def __init__(self, window: int = 1024) -> None:
+        self._window = max(1, int(window))
+        self._lock = Lock()
+        self._calls: Dict[str, int] = {}
+        self._total_seconds: Dict[str, float] = {}
+        self._candidates_in: Dict[str, int] = {}
+        self._candidates_out: Dict[str, int] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def record(
+        self, stage: str, seconds: float, candidates_in: int, candidates_out: int
+    ) -> None:
+        with self._lock:
+            self._calls[stage] = self._calls.get(stage, 0) + 1
+            self._total_seconds[stage] = self._total_seconds.get(stage, 0.0) + seconds
+            self._candidates_in[stage] = self._candidates_in.get(stage, 0) + candidates_in
+            self._candidates_out[stage] = self._candidates_out.get(stage, 0) + candidates_out
+            self._latencies.setdefault(stage, deque(maxlen=self._window)).append(seconds)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            snapshot: Dict[str, Tuple[int, float, int, int, np.ndarray]] = {
+                stage: (
+                    calls,
+                    self._total_seconds[stage],
+                    self._candidates_in[stage],
+                    self._candidates_out[stage],
+                    np.asarray(self._latencies[stage], dtype=np.float64),
+                )
+                for stage, calls in self._calls.items()
+            }
+
+        report: Dict[str, Dict[str, float]] = {}
+        for stage, (calls, total, cand_in, cand_out, latencies) in snapshot.items():
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1e3
+            report[stage] = {
+                "calls": calls,
+                "avg_ms": total / calls * 1e3,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "max_ms": float(latencies.max() * 1e3),
+                "avg_candidates_in": cand_in / calls,
+                "avg_candidates_out": cand_out / calls,
+            }
+        return report
@@ -0,0 +1,108 @@
+"""Offline generation of synthetic user questions for KB leaf nodes (batched LLM calls, cached)."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from .config import HF_CHAT_MODEL
+from .embedding_cache import normalize_cache_text
+from .local_calls import LLM_call
+from .prompts import get_synthetic_questions_prompt
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt changes so cached questions are regenerated.
+_PROMPT_VERSION = 1
+
+
+class QuestionCache:
+    """JSON file of generated questions keyed by chat model, prompt version, count and text."""
+
+    def __init__(self, path: Optional[str | Path]) -> None:
+        self._path = Path(path).expanduser().resolve() if path else None
+        self._entries: Dict[str, List[str]] = {}
+        if self._path is not None and self._path.exists():
+            self._entries = json.loads(self._path.read_text(encoding="utf-8"))
+
+    def key(self, text: str, per_passage: int) -> str:
+        payload = f"{HF_CHAT_MODEL}\n{_PROMPT_VERSION}\n{per_passage}\n{normalize_cache_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        return self._entries.get(key)
+
+    def put(self, key: str, questions: List[str]) -> None:
+        self._entries[key] = questions
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self._entries, ensure_ascii=False), encoding="utf-8")
+        tmp_path.replace(self._path)
+
+
+def _parse_questions(raw_response: str, batch_size: int, per_passage: int) -> List[List[str]]:
+    parsed = json.loads(raw_response)
+    by_id = parsed.get("questions", {}) if isinstance(parsed, dict) else {}
+    results: List[List[str]] = []
+    for position in range(batch_size):
+        candidates = by_id.get(str(position), []) if isinstance(by_id, dict) else []
+        questions: List[str] = []
+        for candidate in candidates if isinstance(candidates, list) else []:
+            if isinstance(candidate, str) and candidate.strip() and candidate.strip() not in questions:
+                questions.append(candidate.strip())
+        results.append(questions[:per_passage])
+    return results
+
+
+def generate_questions(
+    texts: Sequence[str],
+    per_passage: int = 3,
+    batch_size: int = 8,
+    cache_path: Optional[str | Path] = None,
+) -> List[List[str]]:
+    """Return up to ``per_passage`` likely user questions for every text.
+
+    Texts are sent to the chat model ``batch_size`` at a time; answers are cached on disk so
+    rebuilding an unchanged KB costs no LLM calls. A failed batch yields empty lists (and is
+    retried on the next build).
+    """
+    cache = QuestionCache(cache_path)
+    results: List[Optional[List[str]]] = []
+    pending: List[int] = []
+    for position, text in enumerate(texts):
+        cached = cache.get(cache.key(text, per_passage))
+        results.append(cached)
+        if cached is None:
+            pending.append(position)
+
+    logger.info(
+        "Synthetic questions: %d cached, %d to generate in batches of %d",
+        len(texts) - len(pending),
+        len(pending),
+        batch_size,
+    )
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start : start + batch_size]
+        try:
+            raw_response = LLM_call(
+                get_synthetic_questions_prompt([texts[position] for position in batch], per_passage)
+            )
+            generated = _parse_questions(raw_response, len(batch), per_passage)
+        except Exception as exc:
+            logger.warning("Question generation failed for batch at %d: %s", start, exc)
+            generated = [[] for _ in batch]
+
+        for position, questions in zip(batch, generated):
+            results[position] = questions
+            if questions:
+                cache.put(cache.key(texts[position], per_passage), questions)
+        cache.save()
+
+    return [questions or [] for questions in results]
@@ -4,9 +4,13 @@ from __future__ import annotations
 
 import json
 import logging
+import re
+import time
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+
 try:
     from .local_calls import LLM_call, reranker_call  # type: ignore
 except Exception:  # pragma: no cover - allow flat layout imports
@@ -17,9 +21,105 @@ except Exception:  # pragma: no cover - allow flat layout imports
         reranker_call = None  # type: ignore
 
 try:
+    from .config import (
+        RAG_PRF_ALPHA,
+        RAG_PRF_BETA,
+        RAG_PRF_DOCS,
+        RAG_QUERY_EXPANSION,
+        RAG_CASCADE_CANDIDATES,
+        RAG_CASCADE_RERANK,
+        RAG_CASCADE_RESCORE,
+        RAG_RESULT_CACHE_SIZE,
+        RAG_RESULT_CACHE_TTL,
+        RAPTOR_EMBEDDING_DTYPE,
+        RAPTOR_FIRST_STAGE_CANDIDATES,
+        RAPTOR_FIRST_STAGE_DIMS,
+        RAPTOR_FUSION_CANDIDATES,
+        RAPTOR_HNSW_EF_SEARCH,
+        RAPTOR_INDEX_BACKEND,
+        RAPTOR_IVF_NPROBE,
+        RAPTOR_KB_DIR,
+        RAPTOR_KB_MANIFEST,
+        RAPTOR_KB_MEMORY_BUDGET_MB,
+        RAPTOR_KB_WATCH_INTERVAL,
+        RAPTOR_LEXICAL_FALLBACK,
+        RAPTOR_NEIGHBOR_EXPANSION,
+        RAPTOR_RESCORE_FACTOR,
+        RAPTOR_RETRIEVAL_MODE,
+        RAPTOR_RRF_K,
+        RAPTOR_SHADOW_KB,
+        RAPTOR_SHADOW_MAX_PENDING,
+        RAPTOR_SHADOW_REPORT,
+        RAPTOR_SHADOW_SAMPLE_RATE,
+        RAPTOR_SHARD_WORKERS,
+        RAPTOR_STRUCTURE_EXPANSION,
+    )
+except Exception:  # pragma: no cover - fallback
+    from config import (  # type: ignore
+        RAG_PRF_ALPHA,
+        RAG_PRF_BETA,
+        RAG_PRF_DOCS,
+        RAG_QUERY_EXPANSION,
+        RAG_CASCADE_CANDIDATES,
+        RAG_CASCADE_RERANK,
+        RAG_CASCADE_RESCORE,
+        RAG_RESULT_CACHE_SIZE,
+        RAG_RESULT_CACHE_TTL,
+        RAPTOR_EMBEDDING_DTYPE,
+        RAPTOR_FIRST_STAGE_CANDIDATES,
+        RAPTOR_FIRST_STAGE_DIMS,
+        RAPTOR_FUSION_CANDIDATES,
+        RAPTOR_HNSW_EF_SEARCH,
+        RAPTOR_INDEX_BACKEND,
+        RAPTOR_IVF_NPROBE,
+        RAPTOR_KB_DIR,
+        RAPTOR_KB_MANIFEST,
+        RAPTOR_KB_MEMORY_BUDGET_MB,
+        RAPTOR_KB_WATCH_INTERVAL,
+        RAPTOR_LEXICAL_FALLBACK,
+        RAPTOR_NEIGHBOR_EXPANSION,
+        RAPTOR_RESCORE_FACTOR,
+        RAPTOR_RETRIEVAL_MODE,
+        RAPTOR_RRF_K,
+        RAPTOR_SHADOW_KB,
+        RAPTOR_SHADOW_MAX_PENDING,
+        RAPTOR_SHADOW_REPORT,
+        RAPTOR_SHADOW_SAMPLE_RATE,
+        RAPTOR_SHARD_WORKERS,
+        RAPTOR_STRUCTURE_EXPANSION,
+    )
+
+try:
+    from .embedding_cache import normalize_cache_text
+    from .pipeline_registry import PipelineRegistry
+    from .retrieval_cache import TTLCache
+    from .shadow_retrieval import ShadowRetrieval
+    from .stage_telemetry import StageTelemetry
+except Exception:  # pragma: no cover - fallback
+    from embedding_cache import normalize_cache_text  # type: ignore
+    from pipeline_registry import PipelineRegistry  # type: ignore
+    from retrieval_cache import TTLCache  # type: ignore
+    from shadow_retrieval import ShadowRetrieval  # type: ignore
+    from stage_telemetry import StageTelemetry  # type: ignore
+
+try:
+    from .raptor.columnar_kb import columnar_version_path  # type: ignore
+    from .raptor.node_metadata import MetadataFilters, filters_key  # type: ignore
     from .raptor.raptorRag import RaptorRagPipeline  # type: ignore
+    from .raptor.shardedRag import (  # type: ignore
+        ShardSnapshot,
+        ShardedRaptorPipeline,
+        read_manifest,
+    )
 except Exception:  # pragma: no cover - fallback when running as flat package
+    from raptor.columnar_kb import columnar_version_path  # type: ignore
+    from raptor.node_metadata import MetadataFilters, filters_key  # type: ignore
     from raptor.raptorRag import RaptorRagPipeline  # type: ignore
+    from raptor.shardedRag import (  # type: ignore
+        ShardSnapshot,
+        ShardedRaptorPipeline,
+        read_manifest,
+    )
 
 try:
     from .State import EvidenceItem
@@ -33,49 +133,206 @@ except Exception:  # pragma: no cover - fallback
 
 logger = logging.getLogger(__name__)
 
-_RAPTOR_PIPELINE: Optional[RaptorRagPipeline] = None
-_RAPTOR_INDEX_PATH: Optional[Path] = None
+DEFAULT_KB = "default"
+_KB_NAME_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
 _MAX_VARIANTS = 3  # original + two rewrites
+_RESULT_CACHE = TTLCache(max_entries=RAG_RESULT_CACHE_SIZE, ttl_seconds=RAG_RESULT_CACHE_TTL)
+_CASCADE_TELEMETRY = StageTelemetry()
+# Candidate generation ranks nodes only; the prompt token budget is applied after reranking.
+_CANDIDATE_MAX_TOKENS = 1_000_000
+
+
+def _file_signature(path: Path) -> Tuple[int, int, int]:
+    # Every version of a columnar KB has its own meta.json, which identifies it.
+    stat = (columnar_version_path(path) / "meta.json").stat() if path.is_dir() else path.stat()
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _pipeline_settings() -> Dict[str, Any]:
+    return dict(
+        index_backend=RAPTOR_INDEX_BACKEND,
+        nprobe=RAPTOR_IVF_NPROBE,
+        ef_search=RAPTOR_HNSW_EF_SEARCH,
+        embedding_dtype=RAPTOR_EMBEDDING_DTYPE,
+        rescore_factor=RAPTOR_RESCORE_FACTOR,
+        first_stage_dims=RAPTOR_FIRST_STAGE_DIMS,
+        first_stage_candidates=RAPTOR_FIRST_STAGE_CANDIDATES,
+        retrieval_mode=RAPTOR_RETRIEVAL_MODE,
+        rrf_k=RAPTOR_RRF_K,
+        fusion_candidates=RAPTOR_FUSION_CANDIDATES,
+        lexical_fallback=RAPTOR_LEXICAL_FALLBACK,
+        prf_docs=RAG_PRF_DOCS,
+        prf_alpha=RAG_PRF_ALPHA,
+        prf_beta=RAG_PRF_BETA,
+    )
+
+
+def _kb_dir() -> Path:
+    return Path(RAPTOR_KB_DIR).expanduser() if RAPTOR_KB_DIR else Path(__file__).parent
+
+
+def _kb_source(kb: str) -> Optional[Path]:
+    """The manifest or tree pickle serving ``kb``, if one exists.
+
+    The default KB is RAPTOR_KB_MANIFEST, the columnar ``raptorkb.kb`` directory or
+    ``raptorkb.pickle``; a named KB is ``<name>.manifest.json``, ``<name>.kb`` or
+    ``<name>.pickle``, all inside RAPTOR_KB_DIR.
+    """
+    base_dir = _kb_dir()
+    if kb == DEFAULT_KB:
+        candidates = [
+            base_dir / RAPTOR_KB_MANIFEST,
+            base_dir / "raptorkb.kb",
+            base_dir / "raptorkb.pickle",
+        ]
+    elif _KB_NAME_PATTERN.fullmatch(kb):
+        candidates = [
+            base_dir / f"{kb}.manifest.json",
+            base_dir / f"{kb}.kb",
+            base_dir / f"{kb}.pickle",
+        ]
+    else:
+        raise ValueError(f"Invalid knowledge base name: {kb!r}")
+    return next((path.resolve() for path in candidates if path.exists()), None)
+
+
+def _kb_signature(kb: str) -> Optional[Tuple[Any, ...]]:
+    """Changes when the KB file, a sharded KB's manifest or one of its shards is replaced."""
+    return _source_signature(_kb_source(kb))
+
+
+def _source_signature(path: Optional[Path]) -> Optional[Tuple[Any, ...]]:
+    if path is None:
+        return (path,)
+    if path.name.endswith(".json"):
+        return (
+            path,
+            *_file_signature(path),
+            *(
+                (name, shard_path, *_file_signature(shard_path))
+                for name, shard_path, _ in read_manifest(path)
+                if shard_path.exists()
+            ),
+        )
+    return (path, *_file_signature(path))
+
+
+def _kb_size(kb: str) -> int:
+    """Bytes of the artifacts behind ``kb``: the registry's size estimate of its pipeline."""
+    path = _kb_source(kb)
+    if path is None:
+        return 0
+    if path.name.endswith(".json"):
+        return sum(
+            _artifact_size(shard_path)
+            for _, shard_path, _ in read_manifest(path)
+            if shard_path.exists()
+        )
+    return _artifact_size(path)
+
 
+def _artifact_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(
+            file.stat().st_size for file in columnar_version_path(path).iterdir() if file.is_file()
+        )
+    return path.stat().st_size
 
-def _load_raptor_pipeline(top_k: int) -> Optional[RaptorRagPipeline]:
-    """Load (or cache) the Raptor pipeline from the persisted knowledge base."""
-    global _RAPTOR_PIPELINE, _RAPTOR_INDEX_PATH
-    base_dir = Path(__file__).resolve().parent
-    index_path = (base_dir / "raptorkb.pickle").resolve()
 
-    if not index_path.exists():
+def _open_kb(kb: str) -> Optional[RaptorRagPipeline | ShardedRaptorPipeline]:
+    path = _kb_source(kb)
+    if path is None:
         logger.warning(
-            "Raptor knowledge base missing at %s; skipping retrieval and returning no evidence.",
-            index_path,
+            "Raptor knowledge base '%s' not found; skipping retrieval and returning no evidence.",
+            kb,
         )
         return None
+    return _open_source(path)
 
-    if (_RAPTOR_PIPELINE is None) or (_RAPTOR_INDEX_PATH != index_path):
-        try:
-            _RAPTOR_PIPELINE = RaptorRagPipeline(index_path=index_path, retriever_top_k=top_k)
-            _RAPTOR_INDEX_PATH = index_path
-        except Exception as exc:
-            logger.warning("Raptor pipeline initialization failed: %s", exc)
-            _RAPTOR_PIPELINE = None
-            _RAPTOR_INDEX_PATH = None
-            return None
-    return _RAPTOR_PIPELINE
-
-
-def _retrieve_with_raptor(
-    pipeline: Optional[RaptorRagPipeline], query: str, top_k: int
-) -> List[Dict[str, Any]]:
-    """Run retrieval with the active pipeline and return chunk metadata without scoring."""
-    if pipeline is None:
-        return []
 
+def _open_source(path: Path) -> RaptorRagPipeline | ShardedRaptorPipeline:
+    if path.name.endswith(".json"):
+        return ShardedRaptorPipeline(
+            manifest_path=path, max_workers=RAPTOR_SHARD_WORKERS, **_pipeline_settings()
+        )
+    return RaptorRagPipeline(index_path=path, **_pipeline_settings())
+
+
+def _refresh_kb(kb: str, pipeline: Any) -> bool:
+    """Reload only the changed shards of a loaded sharded KB whose manifest still serves it."""
+    if not isinstance(pipeline, ShardedRaptorPipeline):
+        return False
+    if pipeline.manifest_path != _kb_source(kb):
+        return False
+    pipeline.refresh()
+    return True
+
+
+_PIPELINES = PipelineRegistry(
+    _open_kb,
+    _kb_signature,
+    max_bytes=int(RAPTOR_KB_MEMORY_BUDGET_MB * 2**20),
+    size_hint=_kb_size,
+    refresh=_refresh_kb,
+)
+
+
+def _shadow_source(_: str = "") -> Optional[Path]:
+    """The candidate KB artifact replayed by shadow retrieval, if it exists."""
+    path = Path(RAPTOR_SHADOW_KB).expanduser()
+    if not path.is_absolute():
+        path = _kb_dir() / path
+    return path.resolve() if path.exists() else None
+
+
+def _open_shadow(_: str) -> Optional[RaptorRagPipeline | ShardedRaptorPipeline]:
+    path = _shadow_source()
+    return _open_source(path) if path is not None else None
+
+
+# The candidate KB is loaded on the first sampled call and reloaded when its artifact changes.
+_SHADOW = None
+if RAPTOR_SHADOW_KB:
+    _SHADOW_PIPELINES = PipelineRegistry(
+        _open_shadow, lambda name: _source_signature(_shadow_source())
+    )
+    _report_path = Path(RAPTOR_SHADOW_REPORT).expanduser()
+    _SHADOW = ShadowRetrieval(
+        lambda: _SHADOW_PIPELINES.get("shadow"),
+        _report_path if _report_path.is_absolute() else _kb_dir() / _report_path,
+        sample_rate=RAPTOR_SHADOW_SAMPLE_RATE,
+        max_pending=RAPTOR_SHADOW_MAX_PENDING,
+    )
+
+
+def start_kb_watcher() -> None:
+    """Load the default KB in the background and keep every loaded KB hot-reloaded (see
+    RAPTOR_KB_WATCH_INTERVAL); a no-op when the interval is 0 or the watcher runs.
+
+    The default KB is preloaded, not pinned: when the memory budget evicts it, the next
+    request loads it again, as for any other KB."""
+    if RAPTOR_KB_WATCH_INTERVAL > 0:
+        _PIPELINES.watch([DEFAULT_KB], interval=RAPTOR_KB_WATCH_INTERVAL)
+
+
+def _load_raptor_pipeline(
+    kb: Optional[str] = None,
+) -> Optional[RaptorRagPipeline | ShardedRaptorPipeline]:
+    """The pipeline of ``kb`` (None: the default KB), loaded on first use. A replaced KB file
+    is loaded in the background while the current version keeps serving; sharded KBs reload
+    only their changed shards, also in the background."""
     try:
-        _, layer_info = pipeline.retrieve(query, top_k=top_k, collapse_tree=True)
-    except Exception as exc:
-        logger.warning("Raptor pipeline retrieval failed for query '%s': %s", query, exc)
-        return []
+        return _PIPELINES.get(kb or DEFAULT_KB)
+    except ValueError as exc:
+        logger.warning("%s; returning no evidence.", exc)
+        return None
+
 
+def _entries_from_layer_info(
+    pipeline: RaptorRagPipeline, layer_info: List[Dict[str, Any]], top_k: int
+) -> List[Dict[str, Any]]:
+    """Turn retriever layer metadata into chunk entries for downstream tooling; every entry
+    records the fingerprint of the KB version its chunk id belongs to."""
     results: List[Dict[str, Any]] = []
     for meta in layer_info[:top_k]:
         node_index = int(meta["node_index"])
@@ -83,11 +340,14 @@ def _retrieve_with_raptor(
             "text": pipeline.node_text(node_index),
             "chunk_id": node_index,
             "layer": int(meta.get("layer_number", -1)),
+            "kb_fingerprint": pipeline.fingerprint,
         }
+        if "score" in meta:
+            entry["retrieval_score"] = float(meta["score"])
         extra_meta = {
             key: value
             for key, value in meta.items()
-            if key not in {"node_index", "layer_number"}
+            if key not in {"node_index", "layer_number", "score"}
         }
         if extra_meta:
             entry["metadata"] = extra_meta
@@ -95,10 +355,237 @@ def _retrieve_with_raptor(
     return results
 
 
-def RAG_call(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-    """Low-level retrieval call returning raw chunk metadata for downstream tooling."""
-    pipeline = _load_raptor_pipeline(top_k)
-    return _retrieve_with_raptor(pipeline, query, top_k)
+def _result_cache_key(
+    pipeline: RaptorRagPipeline, query: str, settings: Tuple[Any, ...]
+) -> Tuple[Any, ...]:
+    """KB fingerprint + normalized query + every retrieval setting that changes the result."""
+    return (pipeline.fingerprint, normalize_cache_text(query), *settings)
+
+
+def _retrieve_many_with_raptor(
+    pipeline: Optional[RaptorRagPipeline],
+    queries: List[str],
+    top_k: int,
+    max_tokens: int = 3500,
+    expand: bool = False,
+    neighbors: int = RAPTOR_NEIGHBOR_EXPANSION,
+    structure: Optional[str] = RAPTOR_STRUCTURE_EXPANSION,
+    filters: Optional[MetadataFilters] = None,
+    query_matrix: Optional[np.ndarray] = None,
+) -> List[List[Dict[str, Any]]]:
+    """Collapsed-tree retrieval for several queries, served from the result cache when possible.
+
+    ``neighbors`` > 0 appends that many kNN-graph neighbours of every hit after the hits;
+    ``structure`` appends their tree context; ``filters`` restricts the search to nodes with
+    matching metadata (see RaptorRagPipeline.retrieve). ``query_matrix``, one embedding row
+    per query, spares embedding the queries again.
+    """
+    if pipeline is None:
+        return [[] for _ in queries]
+    # Chunk ids, texts and the fingerprint must all come from the version that was searched.
+    pipeline = pipeline.snapshot()
+
+    # Resolved once so lexical fallback results never land under a dense/hybrid key.
+    mode = pipeline.active_mode
+    settings = (top_k, mode, max_tokens, expand, neighbors, structure, filters_key(filters))
+    results: List[Optional[List[Dict[str, Any]]]] = []
+    missing: Dict[str, List[int]] = {}
+    for position, query in enumerate(queries):
+        cached = _RESULT_CACHE.get(_result_cache_key(pipeline, query, settings))
+        results.append(cached)
+        if cached is None:
+            missing.setdefault(query, []).append(position)
+
+    if missing:
+        to_retrieve = list(missing)
+        if query_matrix is not None:
+            query_matrix = query_matrix[[missing[query][0] for query in to_retrieve]]
+        try:
+            per_query_info, _ = pipeline.retrieve_many(
+                to_retrieve,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                mode=mode,
+                expand=expand,
+                neighbors=neighbors,
+                structure=structure,
+                query_matrix=query_matrix,
+                filters=filters,
+            )
+        except Exception as exc:
+            logger.warning(
+                "Raptor pipeline retrieval failed for %d queries: %s", len(to_retrieve), exc
+            )
+            return [[dict(entry) for entry in entries or []] for entries in results]
+
+        for query, layer_info in zip(to_retrieve, per_query_info):
+            entries = _entries_from_layer_info(pipeline, layer_info, len(layer_info))
+            _RESULT_CACHE.put(_result_cache_key(pipeline, query, settings), entries)
+            for position in missing[query]:
+                results[position] = entries
+
+    # Hand out copies so callers can annotate entries without touching the cache.
+    return [[dict(entry) for entry in entries or []] for entries in results]
+
+
+def _retrieve_with_raptor(
+    pipeline: Optional[RaptorRagPipeline],
+    query: str,
+    top_k: int,
+    filters: Optional[MetadataFilters] = None,
+) -> List[Dict[str, Any]]:
+    """Run retrieval with the active pipeline and return chunk metadata without scoring."""
+    return _retrieve_many_with_raptor(pipeline, [query], top_k, filters=filters)[0]
+
+
+def _pool_entries(per_query: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Deduplicate entries by chunk, keeping the best retrieval score, best first."""
+    pooled: Dict[Any, Dict[str, Any]] = {}
+    for entries in per_query:
+        for entry in entries:
+            existing = pooled.get(entry["chunk_id"])
+            if existing is None or entry.get("retrieval_score", 0.0) > existing.get(
+                "retrieval_score", 0.0
+            ):
+                pooled[entry["chunk_id"]] = entry
+    return sorted(
+        pooled.values(), key=lambda entry: entry.get("retrieval_score", 0.0), reverse=True
+    )
+
+
+def RAG_call(
+    query: str,
+    top_k: int = 5,
+    kb: Optional[str] = None,
+    filters: Optional[MetadataFilters] = None,
+) -> List[Dict[str, Any]]:
+    """Low-level retrieval call returning raw chunk metadata for downstream tooling.
+
+    With RAPTOR_SHADOW_KB set, a sample of the calls is replayed against that candidate KB in
+    the background (see ShadowRetrieval); the returned entries never depend on it.
+    """
+    pipeline = _load_raptor_pipeline(kb)
+    started = time.perf_counter()
+    entries = _retrieve_with_raptor(pipeline, query, top_k, filters)
+    _submit_shadow(pipeline, [query], top_k, time.perf_counter() - started, filters=filters)
+    return entries
+
+
+def RAG_call_many(
+    queries: List[str],
+    top_k: int = 5,
+    max_tokens: int = 3500,
+    expand: bool = False,
+    kb: Optional[str] = None,
+    filters: Optional[MetadataFilters] = None,
+    query_matrix: Optional[np.ndarray] = None,
+) -> Tuple[List[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Batched retrieval: per-query chunk entries plus the pooled, deduplicated entries.
+
+    ``expand`` applies pseudo-relevance feedback to the query vectors; ``kb`` selects the
+    knowledge base (None: the default one); ``filters`` restricts the search to chunks with
+    matching metadata, e.g. ``{"product": "..."}``; ``query_matrix`` holds the queries'
+    embeddings when the caller already has them.
+    """
+    pipeline = _load_raptor_pipeline(kb)
+    started = time.perf_counter()
+    per_query = _retrieve_many_with_raptor(
+        pipeline,
+        list(queries),
+        top_k,
+        max_tokens,
+        expand,
+        filters=filters,
+        query_matrix=query_matrix,
+    )
+    _submit_shadow(
+        pipeline,
+        list(queries),
+        top_k,
+        time.perf_counter() - started,
+        max_tokens=max_tokens,
+        expand=expand,
+        filters=filters,
+    )
+    return per_query, _pool_entries(per_query)
+
+
+def _submit_shadow(
+    pipeline: Optional[RaptorRagPipeline | ShardedRaptorPipeline],
+    queries: List[str],
+    top_k: int,
+    served_seconds: float,
+    max_tokens: int = 3500,
+    expand: bool = False,
+    filters: Optional[MetadataFilters] = None,
+) -> None:
+    """Offer a served call to shadow retrieval, with the settings it was served with."""
+    if _SHADOW is None:
+        return
+    try:
+        _SHADOW.submit(
+            pipeline,
+            queries,
+            top_k,
+            served_seconds,
+            max_tokens=max_tokens,
+            expand=expand,
+            neighbors=RAPTOR_NEIGHBOR_EXPANSION,
+            structure=RAPTOR_STRUCTURE_EXPANSION,
+            filters=filters,
+        )
+    except Exception as exc:
+        logger.warning("Shadow retrieval submission failed: %s", exc)
+
+
+def shadow_stats() -> Optional[Dict[str, Any]]:
+    """Sampling and overlap counters of shadow retrieval; None when it is off."""
+    return _SHADOW.stats() if _SHADOW is not None else None
+
+
+def retrieval_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters of the retrieval result cache."""
+    return _RESULT_CACHE.stats()
+
+
+def RAG_similarity_stats(
+    query: str, top_k: int = 10, kb: Optional[str] = None
+) -> Optional[Dict[str, float]]:
+    """Dense similarity statistics of the query against the KB (see
+    RaptorRagPipeline.similarity_stats); None when they cannot be computed."""
+    pipeline = _load_raptor_pipeline(kb)
+    if pipeline is None or not (query or "").strip():
+        return None
+    try:
+        return pipeline.similarity_stats(query, top_k=top_k)
+    except Exception as exc:
+        logger.warning("Similarity statistics failed: %s", exc)
+        return None
+
+
+def cascade_stats() -> Dict[str, Dict[str, float]]:
+    """Per-stage latency and candidate counts of the RAG_tool retrieval cascade."""
+    return _CASCADE_TELEMETRY.stats()
+
+
+def pipeline_registry_stats() -> Dict[str, Any]:
+    """Loaded knowledge bases with their estimated sizes, load state and active version (with
+    the KB fingerprint), plus load/eviction counters."""
+    stats = _PIPELINES.stats()
+    for kb, status in stats["status"].items():
+        pipeline = _PIPELINES.peek(kb)
+        if pipeline is not None:
+            status["fingerprint"] = pipeline.fingerprint
+    return stats
+
+
+def current_raptor_pipeline(
+    kb: Optional[str] = None,
+) -> Optional[RaptorRagPipeline | ShardSnapshot]:
+    """A snapshot of the loaded Raptor pipeline of ``kb`` (None: the default KB), if any
+    (never loads one); its fingerprint and node ids stay consistent across a shard refresh."""
+    pipeline = _PIPELINES.peek(kb or DEFAULT_KB)
+    return pipeline.snapshot() if pipeline is not None else None
 
 
 def _coerce_doc_id(entry: Dict[str, Any]) -> str:
@@ -110,48 +597,133 @@ def _coerce_doc_id(entry: Dict[str, Any]) -> str:
     return f"kb-chunk-{entry['chunk_id']}"
 
 
-def RAG_tool(query: str, top_k: int = 3) -> List[EvidenceItem]:
-    """Convert retrieval results into EvidenceItems ranked via the reranker."""
+def _rescore_entries(
+    queries: List[str],
+    entries: List[Dict[str, Any]],
+    kb: Optional[str] = None,
+    query_matrix: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    """Cascade stage two: reorder entries by full-precision cosine to the closest query variant.
+
+    ``query_matrix`` holds the query embeddings stage one searched with; without it the
+    queries are embedded again. Entries retrieved from another version of the KB than the one
+    now loaded (it was hot reloaded in between) keep their order: their chunk ids would name
+    other nodes.
+    """
+    pipeline = current_raptor_pipeline(kb)
+    if pipeline is None or pipeline.active_mode == "lexical":
+        # Lexical-only serving means the embedding model is unavailable; keep stage-one order.
+        return entries
+    if any(entry.get("kb_fingerprint") != pipeline.fingerprint for entry in entries):
+        logger.info("Skipping rescoring: the KB was reloaded since the candidates were retrieved")
+        return entries
+    try:
+        scores = pipeline.rescore(
+            queries, [int(entry["chunk_id"]) for entry in entries], query_matrix=query_matrix
+        )
+    except Exception as exc:
+        logger.warning("Full-precision rescoring failed for %d candidates: %s", len(entries), exc)
+        return entries
+    for entry, score in zip(entries, scores):
+        entry["rescore_score"] = float(score)
+    return sorted(entries, key=lambda entry: entry["rescore_score"], reverse=True)
+
+
+def _embed_query_variants(queries: List[str], kb: Optional[str]) -> Optional[np.ndarray]:
+    """Embeddings of the query variants, computed once for cascade stages one and two; None
+    when ``kb`` is served lexically or embedding failed (retrieval then handles the queries)."""
+    pipeline = _load_raptor_pipeline(kb)
+    if pipeline is None or pipeline.active_mode == "lexical":
+        return None
+    try:
+        return pipeline.embed_queries(queries)
+    except Exception as exc:
+        logger.warning("Embedding %d query variants failed: %s", len(queries), exc)
+        return None
+
+
+def RAG_tool(
+    query: str,
+    top_k: int = 3,
+    kb: Optional[str] = None,
+    filters: Optional[MetadataFilters] = None,
+) -> List[EvidenceItem]:
+    """Convert retrieval results into EvidenceItems through a three-stage cascade.
+
+    Query variants come from RAG_QUERY_EXPANSION: LLM rephrasings, or only the original
+    query searched with pseudo-relevance feedback ("prf"). Every query variant over-fetches ``RAG_CASCADE_CANDIDATES`` hits, the best
+    ``RAG_CASCADE_RESCORE`` pooled hits are rescored with full-precision embeddings, and
+    only the best ``RAG_CASCADE_RERANK`` (at least ``top_k``) are sent to the reranker.
+    ``filters`` restricts the search to chunks with matching metadata; evidence items carry
+    the document id of their chunk when the KB records one.
+    """
     queries = _generate_query_variants(query)
-    deduped_entries: Dict[Any, Dict[str, Any]] = {}
+    if not queries:
+        return []
 
-    for variant in queries:
-        try:
-            raw_results = RAG_call(variant, top_k=top_k)
-        except Exception as exc:
-            logger.warning("RAG_call failed for variant '%s': %s", variant, exc)
-            continue
+    num_candidates = max(top_k, RAG_CASCADE_CANDIDATES)
+    started = time.perf_counter()
+    query_matrix = _embed_query_variants(queries, kb)
+    try:
+        _, pooled_entries = RAG_call_many(
+            queries,
+            top_k=num_candidates,
+            max_tokens=_CANDIDATE_MAX_TOKENS,
+            expand=RAG_QUERY_EXPANSION == "prf",
+            kb=kb,
+            filters=filters,
+            query_matrix=query_matrix,
+        )
+    except Exception as exc:
+        logger.warning("RAG_call_many failed for %d variants: %s", len(queries), exc)
+        return []
+    retrieve_seconds = time.perf_counter() - started
+    _CASCADE_TELEMETRY.record("retrieve", retrieve_seconds, len(queries), len(pooled_entries))
 
-        for entry in raw_results:
-            chunk_id = entry.get("chunk_id")
-            if chunk_id is None:
-                continue
-
-            if chunk_id not in deduped_entries:
-                deduped_entries[chunk_id] = entry
-            else:
-                existing = deduped_entries[chunk_id]
-                if "metadata" in entry and isinstance(entry["metadata"], dict):
-                    metadata = existing.setdefault("metadata", {})
-                    if isinstance(metadata, dict):
-                        metadata.update(entry["metadata"])
-
-    if not deduped_entries:
+    if not pooled_entries:
         return []
 
-    pooled_entries = list(deduped_entries.values())
-    documents = [str(entry["text"]) for entry in pooled_entries]
-    scores = reranker_call(query, documents)
+    num_rescore = min(RAG_CASCADE_RESCORE, len(pooled_entries))
+    rescore_seconds = 0.0
+    if num_rescore > 0:
+        started = time.perf_counter()
+        pooled_entries = (
+            _rescore_entries(queries, pooled_entries[:num_rescore], kb, query_matrix)
+            + pooled_entries[num_rescore:]
+        )
+        rescore_seconds = time.perf_counter() - started
+        _CASCADE_TELEMETRY.record("rescore", rescore_seconds, num_rescore, num_rescore)
 
-    if len(scores) != len(pooled_entries):
+    rerank_entries = pooled_entries[: max(top_k, RAG_CASCADE_RERANK)]
+    documents = [str(entry["text"]) for entry in rerank_entries]
+    started = time.perf_counter()
+    scores = reranker_call(query, documents)
+    rerank_seconds = time.perf_counter() - started
+    _CASCADE_TELEMETRY.record(
+        "rerank", rerank_seconds, len(rerank_entries), min(top_k, len(rerank_entries))
+    )
+
+    logger.info(
+        "RAG cascade: retrieve %d variants -> %d candidates in %.1f ms; rescore %d in %.1f ms; "
+        "rerank %d in %.1f ms",
+        len(queries),
+        len(pooled_entries),
+        retrieve_seconds * 1e3,
+        num_rescore,
+        rescore_seconds * 1e3,
+        len(rerank_entries),
+        rerank_seconds * 1e3,
+    )
+
+    if len(scores) != len(rerank_entries):
         logger.warning(
             "Reranker returned %d scores for %d documents; missing entries default to 0.0",
             len(scores),
-            len(pooled_entries),
+            len(rerank_entries),
         )
 
     ranked_entries: List[Tuple[Dict[str, Any], float]] = []
-    for idx, entry in enumerate(pooled_entries):
+    for idx, entry in enumerate(rerank_entries):
         score = float(scores[idx]) if idx < len(scores) else 0.0
         ranked_entries.append((entry, score))
 
@@ -166,6 +738,7 @@ def RAG_tool(query: str, top_k: int = 3) -> List[EvidenceItem]:
                 chunk_id=str(entry["chunk_id"]),
                 text=str(entry["text"]),
                 score=score,
+                kb_fingerprint=entry.get("kb_fingerprint"),
             )
         )
 
@@ -173,11 +746,12 @@ def RAG_tool(query: str, top_k: int = 3) -> List[EvidenceItem]:
 
 
 def _generate_query_variants(query: str) -> List[str]:
-    """Create a list containing the original query and up to two LLM-generated rewrites."""
+    """Create a list containing the original query and, in "llm" expansion mode, up to two
+    LLM-generated rewrites."""
     cleaned_query = (query or "").strip()
     variants: List[str] = [cleaned_query] if cleaned_query else []
 
-    if not cleaned_query:
+    if not cleaned_query or RAG_QUERY_EXPANSION != "llm":
         return variants
 
     try:
@@ -3,33 +3,47 @@
 from __future__ import annotations
 
 import logging
+from functools import partial
 from pathlib import Path
-from typing import Sequence
+from typing import Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
 
 try:
-    from .local_calls import embedding_call  # type: ignore
+    from .local_calls import embedding_call, open_embedding_store  # type: ignore
 except Exception:  # pragma: no cover - allow flat module usage
     try:
-        from local_calls import embedding_call  # type: ignore
+        from local_calls import embedding_call, open_embedding_store  # type: ignore
     except Exception:  # pragma: no cover - embedding API unavailable
         embedding_call = None  # type: ignore
+        open_embedding_store = None  # type: ignore
 
 from .raptor import (
     RetrievalAugmentation,
     RetrievalAugmentationConfig,
 )
+from .raptor.utils import get_node_list, split_text
 from .raptor.QAModels import GPT3TurboQAModel
 from .raptor.SummarizationModels import GPT3TurboSummarizationModel
 from .raptor.EmbeddingModels import BaseEmbeddingModel
+from .raptor.neighbor_graph import NeighborGraph
+from .raptor.node_metadata import NodeMetadata
+from .raptor.sentence_index import SentenceStore
+from .raptor.tree_structures import SearchKeys, Tree
+from .synthetic_questions import generate_questions
 
 logger = logging.getLogger(__name__)
 
+_QUESTION_EMBEDDING_BATCH = 32
+
 
 class _LocalEmbeddingModel(BaseEmbeddingModel):
-    """Adapter that routes embedding requests to the local embedding implementation."""
+    """Adapter that routes embedding requests to the local embedding implementation,
+    through a persistent embedding store when one is given (see open_embedding_store)."""
 
-    def __init__(self) -> None:
+    def __init__(self, store=None) -> None:
         self._call_count = 0
+        self._store = store
 
     def create_embedding(self, text: str):
         if embedding_call is None:
@@ -42,7 +56,7 @@ class _LocalEmbeddingModel(BaseEmbeddingModel):
             "Requesting embedding %d (text length=%d)", request_id, len(text or "")
         )
         try:
-            result = embedding_call([text])[0]
+            result = embedding_call([text], store=self._store)[0]
         except Exception:
             logger.exception(
                 "Embedding request %d failed (text length=%d)",
@@ -54,8 +68,87 @@ class _LocalEmbeddingModel(BaseEmbeddingModel):
         return result
 
 
-def build_raptor_tree(chunks: Sequence[str], output_path: str | Path) -> Path:
-    """Build a Raptor tree from the provided text chunks and persist it to disk."""
+def attach_question_keys(
+    tree: Tree,
+    questions_per_leaf: int,
+    batch_size: int = 8,
+    cache_path: Optional[str | Path] = None,
+    embedding_dtype: Optional[str] = "float32",
+    embedding_store=None,
+) -> int:
+    """Generate synthetic user questions for every leaf, embed them (through
+    ``embedding_store``, if given), and store them on the tree as ``question_keys`` pointing
+    back to their leaf. Returns the number of keys."""
+    leaves = sorted(tree.leaf_nodes.values(), key=lambda node: node.index)
+    questions = generate_questions(
+        [leaf.text for leaf in leaves],
+        per_passage=questions_per_leaf,
+        batch_size=batch_size,
+        cache_path=cache_path,
+    )
+
+    texts: List[str] = []
+    node_indices: List[int] = []
+    for leaf, leaf_questions in zip(leaves, questions):
+        texts.extend(leaf_questions)
+        node_indices.extend([leaf.index] * len(leaf_questions))
+    if not texts:
+        logger.warning("No synthetic questions were generated; KB keeps node texts only.")
+        return 0
+
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), _QUESTION_EMBEDDING_BATCH):
+        embeddings.extend(
+            embedding_call(
+                texts[start : start + _QUESTION_EMBEDDING_BATCH], store=embedding_store
+            )
+        )
+
+    tree.question_keys = SearchKeys(
+        texts,
+        np.asarray(node_indices, dtype=np.int64),
+        np.asarray(embeddings, dtype=np.float16 if embedding_dtype == "float16" else np.float32),
+    )
+    logger.info("Attached %d question keys to %d leaves", len(texts), len(leaves))
+    return len(texts)
+
+
+def build_raptor_tree(
+    chunks: Sequence[str],
+    output_path: str | Path,
+    embedding_dtype: Optional[str] = "float32",
+    questions_per_leaf: int = 0,
+    question_batch_size: int = 8,
+    question_cache_path: Optional[str | Path] = None,
+    sentence_embeddings: bool = False,
+    neighbor_k: int = 0,
+    chunk_metadata: Optional[Sequence[Mapping[str, str]]] = None,
+    incremental: bool = False,
+    drift_threshold: float = 0.2,
+    embedding_store_path: Optional[str | Path] = None,
+) -> Path:
+    """Build a Raptor tree from the provided text chunks and persist it to disk.
+
+    ``embedding_dtype`` ("float32"/"float16") packs node embeddings into numpy arrays in the
+    saved KB; ``None`` keeps them as Python lists. ``questions_per_leaf`` > 0 adds synthetic
+    question keys (see ``attach_question_keys``); ``sentence_embeddings`` stores per-sentence
+    sub-embeddings of every node for evidence compression; ``neighbor_k`` > 0 persists a
+    kNN graph over the node embeddings for neighbour expansion at query time.
+
+    With ``chunk_metadata`` (one record per chunk: doc_id, source, section, product,
+    language) every chunk is split into leaves on its own, so no leaf spans two chunks, and
+    the records are stored as columnar node metadata for filtered retrieval. Without it the
+    chunks are joined and split as one text.
+
+    With ``incremental`` and an existing KB at ``output_path`` the saved tree is updated
+    instead of rebuilt (see RetrievalAugmentation.update_chunks): only new leaves are embedded
+    and only the summaries above changed leaves are regenerated, until the accumulated
+    changes exceed ``drift_threshold`` and the tree is re-clustered.
+
+    ``embedding_store_path`` is a persistent content-addressed embedding store (sqlite, keyed
+    by model id, pooling and text) used for every embedding of the build: leaves, summaries,
+    question keys and sentences. A rebuild only embeds texts the store has not seen.
+    """
     if embedding_call is None:
         raise RuntimeError(
             "Local embedding model is not available. Install `torch` and `transformers`."
@@ -64,6 +157,9 @@ def build_raptor_tree(chunks: Sequence[str], output_path: str | Path) -> Path:
     path = Path(output_path).expanduser().resolve()
     path.parent.mkdir(parents=True, exist_ok=True)
 
+    if chunk_metadata is not None and len(chunk_metadata) != len(chunks):
+        raise ValueError("chunk_metadata must hold one record per chunk")
+
     text = "\n\n".join(chunk.strip() for chunk in chunks if chunk and chunk.strip())
 
     logger.info(
@@ -71,12 +167,88 @@ def build_raptor_tree(chunks: Sequence[str], output_path: str | Path) -> Path:
         sum(1 for chunk in chunks if chunk and chunk.strip()),
         path,
     )
+    store = open_embedding_store(embedding_store_path) if embedding_store_path else None
     config = RetrievalAugmentationConfig(
-        embedding_model=_LocalEmbeddingModel(),
+        embedding_model=_LocalEmbeddingModel(store),
         summarization_model=GPT3TurboSummarizationModel(),
         qa_model=GPT3TurboQAModel(),
     )
-    pipeline = RetrievalAugmentation(config=config)
-    pipeline.add_documents(text)
-    pipeline.save(str(path))
+    existing = str(path) if incremental and path.exists() else None
+    pipeline = RetrievalAugmentation(config=config, tree=existing)
+    builder = pipeline.tree_builder
+    leaves: List[str] = []
+    leaf_records: Dict[int, Mapping[str, str]] = {}
+    if chunk_metadata is None:
+        leaves = split_text(text, builder.tokenizer, builder.max_tokens)
+    else:
+        for chunk, record in zip(chunks, chunk_metadata):
+            if not chunk or not chunk.strip():
+                continue
+            for leaf in split_text(chunk.strip(), builder.tokenizer, builder.max_tokens):
+                leaf_records[len(leaves)] = record
+                leaves.append(leaf)
+
+    if existing is None:
+        pipeline.add_chunks(leaves)
+        leaf_indices = list(range(len(leaves)))
+    else:
+        update = pipeline.update_chunks(leaves, drift_threshold=drift_threshold)
+        leaf_indices = update.leaf_indices
+        if update.rebuilt:
+            logger.info(
+                "Drift above %.2f (%d leaves added, %d removed); re-clustered the tree",
+                drift_threshold,
+                update.added,
+                update.removed,
+            )
+        else:
+            logger.info(
+                "Updated the tree: %d leaves added, %d removed, %d summaries regenerated "
+                "(drift %.3f)",
+                update.added,
+                update.removed,
+                update.resummarized,
+                pipeline.tree.update_drift,
+            )
+    if chunk_metadata is not None:
+        pipeline.tree.node_metadata = NodeMetadata.build(
+            pipeline.tree,
+            {leaf_indices[leaf]: record for leaf, record in leaf_records.items()},
+        )
+        logger.info("Attached metadata of %d chunks to %d leaves", len(chunks), len(leaves))
+    if questions_per_leaf > 0:
+        attach_question_keys(
+            pipeline.tree,
+            questions_per_leaf,
+            batch_size=question_batch_size,
+            cache_path=question_cache_path,
+            embedding_dtype=embedding_dtype,
+            embedding_store=store,
+        )
+    if sentence_embeddings:
+        tree = pipeline.tree
+        tree.sentence_store = SentenceStore.build(
+            get_node_list(tree.all_nodes),
+            partial(embedding_call, store=store),
+            dtype="float16" if embedding_dtype == "float16" else "float32",
+        )
+        logger.info("Attached %d sentence embeddings", len(tree.sentence_store))
+    if neighbor_k > 0:
+        tree = pipeline.tree
+        tree.neighbor_graph = NeighborGraph.build(
+            get_node_list(tree.all_nodes),
+            pipeline.tree_retriever_config.context_embedding_model,
+            k=neighbor_k,
+        )
+        logger.info(
+            "Attached a %d-NN graph over %d nodes", tree.neighbor_graph.k, len(tree.neighbor_graph)
+        )
+    if store is not None:
+        stats = store.stats()
+        logger.info(
+            "Embedding store: %d embeddings reused, %d computed",
+            stats["disk_hits"],
+            stats["misses"],
+        )
+    pipeline.save(str(path), embedding_dtype=embedding_dtype)
     return path